@@ -0,0 +1,159 @@
+import json
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+# Translation between the OpenAI chat format used by the agent and Anthropic's Messages API.
+
+FINISH_REASONS = {
+    "end_turn": "stop",
+    "stop_sequence": "stop",
+    "tool_use": "tool_calls",
+    "max_tokens": "length",
+}
+
+
+def _blocks(content: Any) -> List[Dict[str, Any]]:
+    if isinstance(content, list):
+        return list(content)
+    return [{"type": "text", "text": content}] if content else []
+
+
+def _append(anthropic_messages: List[Dict[str, Any]], role: str, blocks: List[Dict[str, Any]]):
+    # Anthropic expects alternating roles; consecutive messages of one role are merged
+    if not blocks:
+        return
+    if anthropic_messages and anthropic_messages[-1]["role"] == role:
+        anthropic_messages[-1]["content"].extend(blocks)
+    else:
+        anthropic_messages.append({"role": role, "content": blocks})
+
+
+def to_anthropic_messages(messages: List[Dict[str, Any]],
+                          tool_blocks: bool = True) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Return (system blocks, messages) for Anthropic: tool calls become tool_use blocks, tool messages tool_result blocks.
+
+    Anthropic rejects tool blocks in a request without tools, so with tool_blocks=False
+    the calls and results of earlier rounds are given as text instead.
+    """
+    system_blocks, anthropic_messages = [], []
+    for msg in messages:
+        role = msg["role"]
+        if role == "system":
+            # System messages (prompt, conversation summary, date) go into Anthropic's system parameter
+            system_blocks.append({"type": "text", "text": msg["content"]})
+        elif role == "user":
+            _append(anthropic_messages, "user", _blocks(msg["content"]))
+        elif role == "assistant":
+            blocks = _blocks(msg.get("content"))
+            for tool_call in msg.get("tool_calls") or ():
+                if not tool_blocks:
+                    blocks.append({"type": "text", "text": f"[Called tool {tool_call['function']['name']} with "
+                                                           f"{tool_call['function']['arguments'] or '{}'}]"})
+                    continue
+                try:
+                    arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+                except json.JSONDecodeError:
+                    arguments = {}
+                blocks.append({
+                    "type": "tool_use",
+                    "id": tool_call["id"],
+                    "name": tool_call["function"]["name"],
+                    "input": arguments,
+                })
+            _append(anthropic_messages, "assistant", blocks)
+        elif role == "tool":
+            # Results of one round's calls end up in a single user message
+            if not tool_blocks:
+                _append(anthropic_messages, "user", [{
+                    "type": "text",
+                    "text": f"[Result of tool {msg.get('name', '')}]\n{msg.get('content') or ''}",
+                }])
+                continue
+            _append(anthropic_messages, "user", [{
+                "type": "tool_result",
+                "tool_use_id": msg["tool_call_id"],
+                "content": str(msg.get("content") or ""),
+            }])
+    return system_blocks, anthropic_messages
+
+
+def to_anthropic_tools(tools: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "name": tool["function"]["name"],
+            "description": tool["function"]["description"],
+            "input_schema": tool["function"]["parameters"],
+        }
+        for tool in tools or () if tool["type"] == "function"
+    ]
+
+
+def _chunk(content: Optional[str] = None, tool_call: Optional[SimpleNamespace] = None,
+           finish_reason: Optional[str] = None, usage: Any = None) -> SimpleNamespace:
+    delta = SimpleNamespace(role="assistant", content=content, tool_calls=[tool_call] if tool_call else None)
+    choices = [] if usage is not None else [SimpleNamespace(index=0, delta=delta, finish_reason=finish_reason)]
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+def _tool_call_delta(index: int, call_id: Optional[str] = None, name: Optional[str] = None,
+                     arguments: str = "") -> SimpleNamespace:
+    return SimpleNamespace(index=index, id=call_id, type="function",
+                           function=SimpleNamespace(name=name, arguments=arguments))
+
+
+def _final_usage(start: Any, final: Any) -> Optional[SimpleNamespace]:
+    """Usage of message_start updated with the (cumulative) counts of message_delta."""
+    if start is None and final is None:
+        return None
+    fields = ("input_tokens", "cache_read_input_tokens", "cache_creation_input_tokens", "output_tokens")
+    merged = {}
+    for field in fields:
+        value = getattr(final, field, None)
+        merged[field] = value if value is not None else (getattr(start, field, None) or 0)
+    return SimpleNamespace(**merged)
+
+
+async def stream_openai_chunks(events: AsyncIterator[Any]) -> AsyncIterator[SimpleNamespace]:
+    """
+    Translate a native Anthropic event stream into OpenAI-style chat completion chunks.
+
+    Every event is translated as it arrives: text_delta becomes delta.content,
+    tool_use blocks and their input_json_delta parts become delta.tool_calls
+    (numbered in the order of the tool blocks). The usage is sent after the
+    finish reason as a chunk without choices, like OpenAI's include_usage chunk:
+    the input tokens of message_start with the output tokens of the final message_delta.
+    """
+    tool_indexes: Dict[int, int] = {}
+    tool_arguments: Dict[int, bool] = {}
+    usage = None
+    async for event in events:
+        event_type = getattr(event, "type", None)
+        if event_type == "message_start":
+            usage = getattr(event.message, "usage", None)
+        elif event_type == "content_block_start":
+            block = event.content_block
+            if block.type == "tool_use":
+                tool_indexes[event.index] = len(tool_indexes)
+                tool_arguments[event.index] = False
+                yield _chunk(tool_call=_tool_call_delta(tool_indexes[event.index], block.id, block.name))
+            elif block.type == "text" and getattr(block, "text", ""):
+                yield _chunk(content=block.text)
+        elif event_type == "content_block_delta":
+            delta = event.delta
+            if delta.type == "text_delta" and delta.text:
+                yield _chunk(content=delta.text)
+            elif delta.type == "input_json_delta" and delta.partial_json and event.index in tool_indexes:
+                tool_arguments[event.index] = True
+                yield _chunk(tool_call=_tool_call_delta(tool_indexes[event.index], arguments=delta.partial_json))
+        elif event_type == "content_block_stop":
+            if event.index in tool_arguments and not tool_arguments[event.index]:
+                # A tool called without input streams no JSON at all
+                yield _chunk(tool_call=_tool_call_delta(tool_indexes[event.index], arguments="{}"))
+        elif event_type == "message_delta":
+            stop_reason = getattr(event.delta, "stop_reason", None)
+            if stop_reason:
+                yield _chunk(finish_reason=FINISH_REASONS.get(stop_reason, stop_reason))
+            final_usage = _final_usage(usage, getattr(event, "usage", None))
+            if final_usage is not None:
+                yield _chunk(usage=final_usage)
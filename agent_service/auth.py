@@ -1,22 +1,29 @@
 import os
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 import requests
 
 from .schemas import TokenData, LoginRequest
-
-# In-memory storage to replace database
-user_store: Dict[str, Dict] = {}
+from .session_vault import create_session_vault
 
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Verified JWTs kept per worker, so a token is only decoded and checked once until it expires
+TOKEN_CACHE_MAX_SIZE = int(os.getenv("TOKEN_CACHE_MAX_SIZE", "10000"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Login sessions: the client gets an opaque id, the credentials stay encrypted on the server
+sessions = create_session_vault()
+_verified_tokens: "OrderedDict[str, Tuple[TokenData, float]]" = OrderedDict()
+
 
 # Create a JWT token with an expiration time
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -43,34 +50,31 @@ def verify_egroupware_credentials(url: str, username: str, password: str) -> boo
         return False
 
 
-def verify_and_save_credentials(username: str, password: str, egw_url: str) -> bool:
-    # First verify with EGroupware
-    if not verify_egroupware_credentials(egw_url, username, password):
-        return False
-
-    # Store user credentials in memory
-    user_store[username] = {
-        "username": username,
-        "password": password,
-        "egw_url": egw_url,
-        "updated_at": datetime.utcnow()
-    }
-    return True
-
-
-def verify_stored_credentials(username: str, password: str) -> Optional[Dict]:
-    user = user_store.get(username)
-    if not user or user["password"] != password:
-        return None
-    return user
+async def create_session(user: TokenData) -> str:
+    """Store the login in the session vault and return the session id the client sends instead of a JWT."""
+    return await sessions.create(user)
 
 
-# Authenticate user credentials and return a JWT token
+# Authenticate a session id (or a JWT) and return the user's credentials
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials or token expired",
     )
+    if token.count(".") != 2:
+        # Opaque session id
+        user = await sessions.get(token)
+        if user is None:
+            raise credentials_exception
+        return user
+
+    cached = _verified_tokens.get(token)
+    if cached is not None:
+        if cached[1] > time.time():
+            _verified_tokens.move_to_end(token)
+            return cached[0]
+        del _verified_tokens[token]
+
     try:
         # Decode the entire payload
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -90,11 +94,20 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
         raise credentials_exception
 
     # Return the user data
-    return TokenData(
+    user = TokenData(
         username=username,
         password=password,
         egw_url=egw_url,
         ai_key=ai_key,
         provider_type=provider_type,
         base_url=base_url
-    )
\ No newline at end of file
+    )
+    if payload.get("exp"):
+        _verified_tokens[token] = (user, float(payload["exp"]))
+        while len(_verified_tokens) > TOKEN_CACHE_MAX_SIZE:
+            _verified_tokens.popitem(last=False)
+    return user
+
+
+def stats() -> Dict:
+    return {"sessions": sessions.stats(), "verified_tokens": len(_verified_tokens)}
@@ -0,0 +1,361 @@
+import asyncio
+import importlib.util
+import json
+import os
+import secrets
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Chat history storage: "memory" (per process), "sqlite" or "redis" (shared by all workers)
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "memory").lower()
+HISTORY_SQLITE_PATH = os.getenv("HISTORY_SQLITE_PATH", "chat_history.db")
+HISTORY_REDIS_URL = os.getenv("HISTORY_REDIS_URL", "redis://localhost:6379/0")
+# Prompt token budget of one conversation, older turns are dropped beyond it
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "12000"))
+# Conversations idle for longer are removed, as is the least recently used one beyond HISTORY_MAX_USERS
+HISTORY_IDLE_TTL = float(os.getenv("HISTORY_IDLE_TTL", "3600"))
+HISTORY_MAX_USERS = int(os.getenv("HISTORY_MAX_USERS", "1000"))
+
+# tiktoken is optional, without it tokens are estimated from the text length
+if importlib.util.find_spec("tiktoken") is not None:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text, disallowed_special=()))
+else:
+    def count_tokens(text: str) -> int:
+        return len(text) // 4 + 1
+
+
+# Per message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_message_tokens(message: Dict[str, Any]) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    if message.get("content"):
+        tokens += count_tokens(message["content"] if isinstance(message["content"], str) else json.dumps(message["content"]))
+    for tool_call in message.get("tool_calls") or ():
+        tokens += count_tokens(tool_call["function"]["name"]) + count_tokens(tool_call["function"]["arguments"])
+    return tokens
+
+
+def split_turns(history: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[List[Dict[str, Any]]]]:
+    """
+    Split a history into its leading system messages (prompt, conversation summary)
+    and turns. A turn is a user message with everything that follows it up to the
+    next user message, so an assistant tool_calls message stays with its tool results.
+    """
+    head_length = 0
+    while head_length < len(history) and history[head_length].get("role") == "system":
+        head_length += 1
+    turns: List[List[Dict[str, Any]]] = []
+    for message in history[head_length:]:
+        if message.get("role") == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return history[:head_length], turns
+
+
+def trim_history(history: List[Dict[str, Any]], max_tokens: int = HISTORY_MAX_TOKENS) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Drop the oldest turns (see split_turns) until the history fits into max_tokens.
+    The system messages and the latest turn are always kept.
+    Returns (trimmed history, number of dropped messages).
+    """
+    head, turns = split_turns(history)
+
+    turn_tokens = [sum(count_message_tokens(message) for message in turn) for turn in turns]
+    total = sum(count_message_tokens(message) for message in head) + sum(turn_tokens)
+    dropped = 0
+    while len(turns) > 1 and total > max_tokens:
+        total -= turn_tokens.pop(0)
+        dropped += len(turns.pop(0))
+    if not dropped:
+        return history, 0
+    return head + [message for turn in turns for message in turn], dropped
+
+
+class StoredHistory(list):
+    """
+    A history as loaded from or saved to a store. version identifies the stored
+    revision ("" = nothing was stored), stored_length is the number of leading
+    messages that revision had; the messages after them are new.
+    """
+
+    def __init__(self, messages=(), version: str = "", stored_length: Optional[int] = None):
+        super().__init__(messages)
+        self.version = version
+        self.stored_length = len(self) if stored_length is None else stored_length
+
+    def replaced(self, messages: List[Dict[str, Any]]) -> "StoredHistory":
+        """A rewrite of this revision (e.g. summarized), only stored if nobody saved the conversation since."""
+        return StoredHistory(messages, self.version)
+
+
+def new_history(messages: List[Dict[str, Any]]) -> StoredHistory:
+    """A conversation that isn't stored yet; its first messages (the system prompt) don't count as new."""
+    return StoredHistory(messages, "")
+
+
+def new_version() -> str:
+    return secrets.token_hex(8)
+
+
+# Merge function of HistoryStore._update: (stored version, stored messages or None) -> messages to store
+Merge = Callable[[str, Optional[List[Dict[str, Any]]]], List[Dict[str, Any]]]
+
+
+class HistoryStore:
+    """
+    Base class of the chat history backends, histories are lists of chat messages keyed by username.
+
+    Saves are compare-and-set: a StoredHistory whose version is no longer the stored one
+    (another tab or worker saved the conversation meanwhile) has its new messages appended
+    to the stored messages instead of overwriting them. Plain lists always overwrite.
+    """
+
+    backend = ""
+
+    def __init__(self, max_tokens: int = HISTORY_MAX_TOKENS, idle_ttl: float = HISTORY_IDLE_TTL,
+                 max_users: int = HISTORY_MAX_USERS):
+        self.max_tokens = max_tokens
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self.trimmed_messages = 0
+        self.conflicts = 0
+
+    async def load(self, key: str) -> Optional[StoredHistory]:
+        raise NotImplementedError
+
+    async def save(self, key: str, history: List[Dict[str, Any]]) -> StoredHistory:
+        """Trim the history to the token budget, store it and return the stored list."""
+        version = getattr(history, "version", None)
+        added = list(history[getattr(history, "stored_length", 0):])
+        outcome = {}
+
+        def merge(stored_version: str, stored: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+            messages = list(history)
+            conflict = version is not None and stored is not None and stored_version != version
+            if conflict:
+                messages = stored + added
+            messages, dropped = trim_history(messages, self.max_tokens)
+            outcome.update(conflict=conflict, dropped=dropped)
+            return messages
+
+        stored_version, messages = await self._update(key, merge)
+        # merge may run again when a backend retries, count the attempt that was stored
+        self.conflicts += outcome["conflict"]
+        self.trimmed_messages += outcome["dropped"]
+        return StoredHistory(messages, stored_version)
+
+    async def _update(self, key: str, merge: Merge) -> Tuple[str, List[Dict[str, Any]]]:
+        """Atomically replace the stored messages with merge(stored version, stored messages); returns (new version, messages)."""
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "max_tokens": self.max_tokens, "trimmed_messages": self.trimmed_messages,
+                "conflicts": self.conflicts}
+
+
+class MemoryHistoryStore(HistoryStore):
+    """Histories in a process-local LRU dict; every uvicorn worker has its own."""
+
+    backend = "memory"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._histories: "OrderedDict[str, Tuple[List[Dict[str, Any]], float, str]]" = OrderedDict()
+        self.evictions = 0
+
+    def _evict(self, now: float):
+        while self._histories:
+            key, (_, last_used, _) = next(iter(self._histories.items()))
+            if now - last_used <= self.idle_ttl and len(self._histories) <= self.max_users:
+                break
+            del self._histories[key]
+            self.evictions += 1
+
+    async def load(self, key: str) -> Optional[StoredHistory]:
+        now = time.monotonic()
+        self._evict(now)
+        entry = self._histories.get(key)
+        if entry is None:
+            return None
+        self._histories[key] = (entry[0], now, entry[2])
+        self._histories.move_to_end(key)
+        # Callers append to the list, keep the stored one unchanged until save()
+        return StoredHistory(entry[0], entry[2])
+
+    async def _update(self, key: str, merge: Merge) -> Tuple[str, List[Dict[str, Any]]]:
+        # No await in between: atomic within the worker
+        entry = self._histories.get(key)
+        messages = merge(entry[2], list(entry[0])) if entry is not None else merge("", None)
+        version = new_version()
+        self._histories[key] = (list(messages), time.monotonic(), version)
+        self._histories.move_to_end(key)
+        self._evict(time.monotonic())
+        return version, messages
+
+    async def delete(self, key: str):
+        self._histories.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "conversations": len(self._histories), "evictions": self.evictions}
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """Histories in a SQLite database (WAL mode) that all workers on the host can share."""
+
+    backend = "sqlite"
+
+    def __init__(self, path: str = HISTORY_SQLITE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._last_cleanup = 0.0
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS chat_history "
+                "(key TEXT PRIMARY KEY, messages TEXT NOT NULL, updated REAL NOT NULL, version TEXT NOT NULL DEFAULT '')")
+            connection.execute("CREATE INDEX IF NOT EXISTS chat_history_updated ON chat_history (updated)")
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(chat_history)")]
+            if "version" not in columns:
+                # Databases created before saves were versioned
+                connection.execute("ALTER TABLE chat_history ADD COLUMN version TEXT NOT NULL DEFAULT ''")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One transaction per connection; the connection's with block commits but doesn't close it
+        connection = sqlite3.connect(self.path, timeout=10)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _load(self, key: str) -> Optional[StoredHistory]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT messages, version FROM chat_history WHERE key = ? AND updated >= ?",
+                (key, time.time() - self.idle_ttl)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE chat_history SET updated = ? WHERE key = ?", (time.time(), key))
+        return StoredHistory(json.loads(row[0]), row[1])
+
+    def _store(self, key: str, merge: Merge) -> Tuple[str, List[Dict[str, Any]]]:
+        now = time.time()
+        with self._connect() as connection:
+            # Take the write lock before reading, so no other worker saves in between
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT messages, version FROM chat_history WHERE key = ? AND updated >= ?",
+                (key, now - self.idle_ttl)).fetchone()
+            messages = merge(row[1], json.loads(row[0])) if row is not None else merge("", None)
+            version = new_version()
+            connection.execute(
+                "INSERT INTO chat_history (key, messages, updated, version) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET messages = excluded.messages, updated = excluded.updated, "
+                "version = excluded.version",
+                (key, json.dumps(messages), now, version))
+            if now - self._last_cleanup > 60:
+                self._last_cleanup = now
+                connection.execute("DELETE FROM chat_history WHERE updated < ?", (now - self.idle_ttl,))
+                connection.execute(
+                    "DELETE FROM chat_history WHERE key NOT IN (SELECT key FROM chat_history ORDER BY updated DESC LIMIT ?)",
+                    (self.max_users,))
+        return version, messages
+
+    def _delete(self, key: str):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM chat_history WHERE key = ?", (key,))
+
+    async def load(self, key: str) -> Optional[StoredHistory]:
+        return await asyncio.to_thread(self._load, key)
+
+    async def _update(self, key: str, merge: Merge) -> Tuple[str, List[Dict[str, Any]]]:
+        return await asyncio.to_thread(self._store, key, merge)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "path": self.path}
+
+
+class RedisHistoryStore(HistoryStore):
+    """
+    Histories in Redis (needs the optional 'redis' package). Idle conversations expire
+    via the key TTL; configure maxmemory-policy allkeys-lru for the LRU bound.
+    """
+
+    backend = "redis"
+    key_prefix = "egw-chatbot:history:"
+
+    def __init__(self, url: str = HISTORY_REDIS_URL, **kwargs):
+        super().__init__(**kwargs)
+        import redis.asyncio
+
+        self.redis = redis.asyncio.from_url(url)
+
+    @staticmethod
+    def _decode(value) -> Tuple[str, Optional[List[Dict[str, Any]]]]:
+        if value is None:
+            return "", None
+        data = json.loads(value)
+        # Values written before saves were versioned are plain message lists
+        return ("", data) if isinstance(data, list) else (data["version"], data["messages"])
+
+    async def load(self, key: str) -> Optional[StoredHistory]:
+        version, messages = self._decode(await self.redis.getex(self.key_prefix + key, ex=int(self.idle_ttl)))
+        return StoredHistory(messages, version) if messages is not None else None
+
+    async def _update(self, key: str, merge: Merge) -> Tuple[str, List[Dict[str, Any]]]:
+        from redis.exceptions import WatchError
+
+        name = self.key_prefix + key
+        async with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    # Optimistic transaction: retried if another worker writes the key before EXEC
+                    await pipe.watch(name)
+                    messages = merge(*self._decode(await pipe.get(name)))
+                    version = new_version()
+                    pipe.multi()
+                    pipe.set(name, json.dumps({"version": version, "messages": messages}), ex=int(self.idle_ttl))
+                    await pipe.execute()
+                    return version, messages
+                except WatchError:
+                    continue
+
+    async def delete(self, key: str):
+        await self.redis.delete(self.key_prefix + key)
+
+    async def aclose(self):
+        await self.redis.aclose()
+
+
+def create_history_store(backend: str = HISTORY_BACKEND) -> HistoryStore:
+    if backend == "sqlite":
+        return SQLiteHistoryStore()
+    if backend == "redis":
+        return RedisHistoryStore()
+    if backend != "memory":
+        print(f"Unknown HISTORY_BACKEND '{backend}', using the in-memory store")
+    return MemoryHistoryStore()
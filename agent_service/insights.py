@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from . import llm_service, prompts
+
+load_dotenv()
+
+# Seconds between checks for a changed knowledge base to regenerate insights ahead of time (0 = off)
+INSIGHTS_REFRESH_INTERVAL = float(os.getenv("INSIGHTS_REFRESH_INTERVAL", "0"))
+# Maximum number of cached insights (knowledge version x provider configuration)
+INSIGHTS_CACHE_MAX_SIZE = int(os.getenv("INSIGHTS_CACHE_MAX_SIZE", "64"))
+# Seconds the refresher keeps regenerating for a provider configuration no request has asked for
+INSIGHTS_CONFIG_TTL = float(os.getenv("INSIGHTS_CONFIG_TTL", "3600"))
+# Characters of the knowledge base given to the LLM
+INSIGHTS_KNOWLEDGE_CHARS = 4000
+
+INSIGHTS_REQUEST = "Summarize the following company knowledge in 3 bullet points and suggest 2 quick actions a user can take with EGroupware:"
+
+InsightsKey = Tuple[str, str, str, str]
+
+
+def parse_knowledge(knowledge_raw: Any) -> Tuple[str, str]:
+    """Return (version, content) of a get_company_info result; the version falls back to a content hash."""
+    content, version = '', ''
+    try:
+        knowledge_parsed = json.loads(knowledge_raw) if isinstance(knowledge_raw, str) else knowledge_raw
+        if isinstance(knowledge_parsed, dict) and knowledge_parsed.get('content'):
+            content = knowledge_parsed.get('content', '')
+            version = knowledge_parsed.get('version', '')
+        elif isinstance(knowledge_parsed, str):
+            # If the tool returned a raw string
+            content = knowledge_parsed
+    except Exception:
+        content = str(knowledge_raw)
+    return version or hashlib.sha256(content.encode("utf-8")).hexdigest()[:16], content
+
+
+class InsightsCache:
+    """
+    AI insights of the knowledge base, shared by all users of the same provider configuration.
+
+    Insights only change with the knowledge base, so they are cached by (knowledge
+    version, provider, base_url, model). Concurrent requests for a missing entry
+    share one LLM call (single flight).
+    """
+
+    def __init__(self, max_size: int = INSIGHTS_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[InsightsKey, Tuple[str, float]]" = OrderedDict()
+        self._inflight: Dict[InsightsKey, asyncio.Task] = {}
+        # Latest session (and when it asked) per provider configuration, used by the background refresher;
+        # only the session id is kept, its credentials are looked up while the session is active
+        self._configs: Dict[Tuple[str, str, str], Tuple[str, float]] = {}
+        self._refresher: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.generated = 0
+        self.refreshed = 0
+
+    @staticmethod
+    def config_key(current_user) -> Tuple[str, str, str]:
+        return (current_user.provider_type, current_user.base_url or "",
+                llm_service.quick_completion_model(current_user.provider_type))
+
+    async def get(self, version: str, content: str, current_user, session: Optional[str] = None) -> str:
+        """Return the insights for this knowledge version, generating them at most once at a time."""
+        config = self.config_key(current_user)
+        if session:
+            self._configs[config] = (session, time.monotonic())
+        key = (version, *config)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._generate(key, content, current_user))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.shared += 1
+        # A client disconnecting must not cancel the call other requests are waiting for
+        return await asyncio.shield(task)
+
+    async def _generate(self, key: InsightsKey, content: str, current_user) -> str:
+        messages = [
+            {"role": "system", "content": prompts.get_system_prompt()},
+            {"role": "user", "content": INSIGHTS_REQUEST},
+            {"role": "user", "content": content[:INSIGHTS_KNOWLEDGE_CHARS]}  # limit size
+        ]
+        summary = await llm_service.get_non_streaming_completion(messages, current_user)
+        if summary:
+            # Failed calls return an empty summary, which is not cached
+            self.generated += 1
+            self._entries[key] = (summary, time.time())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return summary
+
+    def forget(self, session: str):
+        """The session ended (logout): stop refreshing with its credentials."""
+        for config, (config_session, _) in list(self._configs.items()):
+            if config_session == session:
+                del self._configs[config]
+
+    def start_refresher(self, fetch_knowledge: Callable[[Any], Awaitable[Any]],
+                        active_user: Callable[[str], Awaitable[Any]],
+                        interval: float = INSIGHTS_REFRESH_INTERVAL, config_ttl: float = INSIGHTS_CONFIG_TTL):
+        """
+        Regenerate the insights of known provider configurations whenever the knowledge base changes.
+
+        active_user returns the user of a session id, None once it expired or logged out;
+        configurations without an active session or not asked for within config_ttl are dropped.
+        """
+        if interval > 0 and self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop(fetch_knowledge, active_user, interval, config_ttl))
+
+    async def _refresh_loop(self, fetch_knowledge: Callable[[Any], Awaitable[Any]],
+                            active_user: Callable[[str], Awaitable[Any]], interval: float, config_ttl: float):
+        while True:
+            await asyncio.sleep(interval)
+            for config, (session, used) in list(self._configs.items()):
+                try:
+                    current_user = None
+                    if time.monotonic() - used <= config_ttl:
+                        current_user = await active_user(session)
+                    if current_user is None or self.config_key(current_user) != config:
+                        if self._configs.get(config, (None,))[0] == session:
+                            del self._configs[config]
+                        continue
+                    version, content = parse_knowledge(await fetch_knowledge(current_user))
+                    if (version, *config) not in self._entries and content:
+                        await self.get(version, content, current_user)
+                        self.refreshed += 1
+                except Exception as e:
+                    print(f"Error refreshing AI insights: {e}")
+
+    async def aclose(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+        for task in list(self._inflight.values()):
+            task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_inflight": self.shared,
+            "generated": self.generated,
+            "refreshed": self.refreshed,
+            "refresh_configs": len(self._configs),
+        }
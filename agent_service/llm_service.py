@@ -1,11 +1,77 @@
+import asyncio
+import hashlib
+import importlib.util
 import os
+import time
+from collections import OrderedDict, deque
+import httpx
 import openai
 from dotenv import load_dotenv
 from enum import Enum, auto
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable, Tuple
+
+from . import anthropic_adapter
 
 load_dotenv()
 
+# Client pool configuration
+LLM_CLIENT_POOL_MAX_SIZE = int(os.getenv("LLM_CLIENT_POOL_MAX_SIZE", "256"))
+LLM_CLIENT_IDLE_TTL = float(os.getenv("LLM_CLIENT_IDLE_TTL", "900"))
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 needs the optional 'h2' package (installed via httpx[http2])
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+# Output token limit of an Anthropic response (the Messages API requires one)
+ANTHROPIC_MAX_TOKENS = int(os.getenv("ANTHROPIC_MAX_TOKENS", "4096"))
+# Route tool-deciding calls on short user messages and the helper completions to a fast model (false = always "strong")
+LLM_ROUTING = os.getenv("LLM_ROUTING", "true").lower() == "true"
+# User messages up to this many characters count as short
+LLM_ROUTE_FAST_MAX_CHARS = int(os.getenv("LLM_ROUTE_FAST_MAX_CHARS", "500"))
+# Latency samples kept per route for the percentiles in /metrics
+LLM_ROUTE_SAMPLES = 500
+# Providers tried in this order when the user's provider fails or its circuit is open, e.g. "openrouter,github";
+# they use the server's keys and endpoints of FALLBACK_ENV
+LLM_FALLBACK_PROVIDERS = [name.strip() for name in os.getenv("LLM_FALLBACK_PROVIDERS", "").split(",") if name.strip()]
+# Environment variables of the server's key and base URL for each fallback provider, as documented in .env.example
+FALLBACK_ENV = {
+    "openai": ("OPENAI_API_KEY", None),
+    "ionos": ("IONOS_API_KEY", "IONOS_BASE_URL"),
+    "github": ("GITHUB_TOKEN", "GITHUB_MODELS_BASE_URL"),
+    "openrouter": ("OPENROUTER_API_KEY", "OPENROUTER_BASE_URL"),
+    "anthropic": ("ANTHROPIC_API_KEY", None),
+    "azure": ("AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT"),
+}
+# Circuit breaker per provider endpoint: opens after this many consecutive failures ...
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+# ... or when the p95 time to first token exceeds this many seconds (0 = errors only) ...
+LLM_BREAKER_TTFT_P95 = float(os.getenv("LLM_BREAKER_TTFT_P95", "20"))
+# ... and lets a trial request through after this many seconds
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Send a second (hedged) request if the first token hasn't arrived after this many seconds (0 = off)
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+# Time to first token samples kept per provider endpoint
+LLM_TTFT_SAMPLES = 200
+# Samples needed before the breaker judges latency
+LLM_BREAKER_MIN_SAMPLES = 10
+
+# Models per provider and route: "fast" decides on tool calls and answers helper prompts, "strong" composes answers
+DEFAULT_MODEL_ROUTES = {
+    "openai": {"fast": "gpt-4o-mini", "strong": "gpt-4o"},
+    "ionos": {"fast": "meta-llama/Meta-Llama-3.1-8B-Instruct", "strong": "meta-llama/Llama-3.3-70B-Instruct"},
+    "github": {"fast": "openai/gpt-4o-mini", "strong": "openai/gpt-4o"},
+    "openrouter": {"fast": "openrouter/auto", "strong": "openrouter/auto"},
+    "anthropic": {"fast": "claude-3-5-haiku-20241022", "strong": "claude-3-opus-20240229"},
+    # Azure models are deployment names of the customer's resource
+    "azure": {"fast": "gpt-4", "strong": "gpt-4"},
+}
+# Override models as "provider.route=model", e.g. "openai.fast=gpt-4o-mini,azure.strong=my-gpt4-deployment"
+MODEL_ROUTES = {provider: dict(routes) for provider, routes in DEFAULT_MODEL_ROUTES.items()}
+for _item in os.getenv("LLM_MODEL_ROUTES", "").split(","):
+    _key, _, _model = _item.partition("=")
+    _provider, _, _route = _key.strip().partition(".")
+    if _model.strip() and _provider in MODEL_ROUTES and _route in ("fast", "strong"):
+        MODEL_ROUTES[_provider][_route] = _model.strip()
+
 class ProviderType(Enum):
     OPENAI = "openai"
     IONOS = "ionos"
@@ -14,19 +80,290 @@ class ProviderType(Enum):
     ANTHROPIC = "anthropic"
     AZURE = "azure"
 
+def create_http_client() -> httpx.AsyncClient:
+    """Keep-alive HTTP connection pool shared by all requests of one SDK client"""
+    return httpx.AsyncClient(
+        http2=LLM_HTTP2,
+        timeout=httpx.Timeout(600.0, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=None,
+            max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+class ClientRegistry:
+    """Process-wide LRU registry of provider SDK clients.
+
+    Clients are keyed by (provider_type, api key hash, base_url) so every chat turn,
+    suggestion and insight call of the same configuration reuses one connection pool.
+    Entries idle for longer than idle_ttl are evicted, as is the least recently used
+    entry once max_size is exceeded. Clients are handed out with acquire(); an evicted
+    client that is still streaming is only closed by its last release().
+    """
+
+    def __init__(self, max_size: int = LLM_CLIENT_POOL_MAX_SIZE, idle_ttl: float = LLM_CLIENT_IDLE_TTL):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._clients: "OrderedDict[Tuple, Tuple[Any, float]]" = OrderedDict()
+        # Requests using a client (by id) and evicted clients waiting for their last request
+        self._in_use: Dict[int, int] = {}
+        self._retired: Dict[int, Any] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple, factory: Callable[[], Any]):
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        entry = self._clients.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._clients[key] = (entry[0], now)
+            self._clients.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        client = factory()
+        self._clients[key] = (client, now)
+        while len(self._clients) > self.max_size:
+            _, (evicted, _) = self._clients.popitem(last=False)
+            self._close(evicted)
+        return client
+
+    def acquire(self, key: Tuple, factory: Callable[[], Any]):
+        client = self.get(key, factory)
+        self._in_use[id(client)] = self._in_use.get(id(client), 0) + 1
+        return client
+
+    def release(self, client):
+        count = self._in_use.get(id(client), 0) - 1
+        if count > 0:
+            self._in_use[id(client)] = count
+            return
+        self._in_use.pop(id(client), None)
+        if self._retired.pop(id(client), None) is not None:
+            self._schedule_close(client)
+
+    def _evict_idle(self, now: float):
+        while self._clients:
+            key, (client, last_used) = next(iter(self._clients.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            del self._clients[key]
+            self._close(client)
+
+    def _close(self, client):
+        self.evictions += 1
+        if self._in_use.get(id(client)):
+            # Still used by a request; closed once that releases it
+            self._retired[id(client)] = client
+            return
+        self._schedule_close(client)
+
+    def _schedule_close(self, client):
+        try:
+            asyncio.get_running_loop().create_task(client.close())
+        except RuntimeError:
+            # No running loop (e.g. interpreter shutdown); let GC release the pool
+            pass
+
+    async def aclose(self):
+        clients = [client for client, _ in self._clients.values()] + list(self._retired.values())
+        self._clients.clear()
+        self._retired.clear()
+        self._in_use.clear()
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:  # noqa: BLE001
+                print(f"Error closing LLM client: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._clients),
+            "max_size": self.max_size,
+            "in_use": sum(self._in_use.values()),
+            "retired": len(self._retired),
+            "idle_ttl": self.idle_ttl,
+            "http2": LLM_HTTP2,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+client_registry = ClientRegistry()
+
+
+def usage_tokens(usage) -> Dict[str, int]:
+    """Prompt token counts of an OpenAI or Anthropic usage object, including the part served from the prompt cache."""
+    if usage is None:
+        return {"prompt_tokens": 0, "cached_tokens": 0, "cache_write_tokens": 0}
+    if getattr(usage, "input_tokens", None) is not None:
+        # Anthropic reports cache reads and writes separately from the uncached input tokens
+        cached = getattr(usage, "cache_read_input_tokens", 0) or 0
+        written = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        return {"prompt_tokens": usage.input_tokens + cached + written, "cached_tokens": cached, "cache_write_tokens": written}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+        "cache_write_tokens": 0,
+    }
+
+
+class PromptCacheStats:
+    """Process-wide counters of prompt tokens and provider prompt cache hits."""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.cache_write_tokens = 0
+
+    def record(self, usage) -> Dict[str, int]:
+        tokens = usage_tokens(usage)
+        self.requests += 1
+        self.prompt_tokens += tokens["prompt_tokens"]
+        self.cached_tokens += tokens["cached_tokens"]
+        self.cache_write_tokens += tokens["cache_write_tokens"]
+        return tokens
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "cache_hit_ratio": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0,
+        }
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+def choose_route(messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]]) -> str:
+    """
+    "fast" for the call deciding on tools after a short user message, "strong" otherwise.
+
+    Answers composed from tool results, long user messages and calls without tools
+    go to the strong model.
+    """
+    if not LLM_ROUTING or not tools:
+        return "strong"
+    last = next((message for message in reversed(messages) if message.get("role") != "system"), None)
+    if last is None or last.get("role") != "user":
+        return "strong"
+    return "fast" if len(str(last.get("content") or "")) <= LLM_ROUTE_FAST_MAX_CHARS else "strong"
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class RouteStats:
+    """Latency (time to first chunk for streams) and token counters per (provider, route, model)."""
+
+    def __init__(self, samples: int = LLM_ROUTE_SAMPLES):
+        self.samples = samples
+        self._routes: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+    def record(self, key: Tuple[str, str, str], latency: Optional[float], usage=None, error: bool = False):
+        route = self._routes.get(key)
+        if route is None:
+            route = self._routes[key] = {"requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                         "latencies": deque(maxlen=self.samples)}
+        route["requests"] += 1
+        route["errors"] += error
+        if latency is not None:
+            route["latencies"].append(latency)
+        if usage is not None:
+            route["prompt_tokens"] += usage_tokens(usage)["prompt_tokens"]
+            route["completion_tokens"] += (getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", 0) or 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "/".join(key): {
+                "requests": route["requests"],
+                "errors": route["errors"],
+                "latency_p50_ms": round(percentile(route["latencies"], 50) * 1000, 1),
+                "latency_p95_ms": round(percentile(route["latencies"], 95) * 1000, 1),
+                "prompt_tokens": route["prompt_tokens"],
+                "completion_tokens": route["completion_tokens"],
+            }
+            for key, route in self._routes.items()
+        }
+
+
+route_stats = RouteStats()
+
+
 class Provider:
     """Base class for AI model providers"""
 
+    provider_type: ProviderType
+    # Whether the API accepts stream_options to send token usage at the end of a stream
+    stream_usage = False
+
     def __init__(self, api_key: str, base_url: Optional[str] = None):
         self.api_key = api_key
         self.base_url = base_url
+        self._leases: List[Any] = []
 
     def get_client(self):
-        raise NotImplementedError("Subclasses must implement get_client method")
+        """Return the pooled SDK client for this provider configuration, in use until release()"""
+        client = client_registry.acquire(self.client_key(), self.create_client)
+        self._leases.append(client)
+        return client
+
+    def release(self):
+        """The request (or stream) of the last get_client() is finished"""
+        if self._leases:
+            client_registry.release(self._leases.pop())
+
+    def client_key(self) -> Tuple:
+        api_key_hash = hashlib.sha256((self.api_key or "").encode("utf-8")).hexdigest()
+        return self.provider_type.value, api_key_hash, self.base_url
+
+    def create_client(self):
+        raise NotImplementedError("Subclasses must implement create_client method")
 
-    def get_completion(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], stream: bool = True):
+    def usage_options(self, stream: bool) -> Dict[str, Any]:
+        return {"stream_options": {"include_usage": True}} if stream and self.stream_usage else {}
+
+    def tool_options(self, tools: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        # The APIs reject an empty tools list, a turn without tools omits the parameters
+        return {"tools": tools, "tool_choice": "auto"} if tools else {}
+
+    def model_for(self, route: str = "strong") -> str:
+        return MODEL_ROUTES[self.provider_type.value][route]
+
+    async def get_completion(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], stream: bool = True,
+                             model: Optional[str] = None):
         raise NotImplementedError("Subclasses must implement get_completion method")
 
+    async def get_text_completion(self, messages: List[Dict[str, Any]], model: str, max_tokens: int,
+                                  temperature: float) -> Tuple[str, Any]:
+        """One non-streaming answer without tools; returns (text, usage)"""
+        client = self.get_client()
+        resp = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=False,
+        )
+        text = (resp.choices[0].message.content or "") if getattr(resp, "choices", None) else ""
+        return text, getattr(resp, "usage", None)
+
     @staticmethod
     def create_provider(provider_type: str, api_key: str, base_url: Optional[str] = None):
         """Factory method to create appropriate provider instance"""
@@ -48,61 +385,64 @@ class Provider:
 class OpenAIProvider(Provider):
     """OpenAI API provider"""
 
-    def get_client(self):
-        return openai.OpenAI(api_key=self.api_key)
+    provider_type = ProviderType.OPENAI
+    stream_usage = True
 
-    def get_completion(self, messages, tools, stream=True):
+    def create_client(self):
+        return openai.AsyncOpenAI(api_key=self.api_key, http_client=create_http_client())
+
+    async def get_completion(self, messages, tools, stream=True, model=None):
         client = self.get_client()
-        return client.chat.completions.create(
-            model="gpt-3.5-turbo",
+        return await client.chat.completions.create(
+            model=model or self.model_for(),
             messages=messages,
-            tools=tools,
-            tool_choice="auto",
+            **self.tool_options(tools),
             stream=stream,
+            **self.usage_options(stream),
         )
 
 class IONOSProvider(Provider):
     """IONOS API provider"""
 
-    def get_client(self):
-        return openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
+    provider_type = ProviderType.IONOS
+
+    def create_client(self):
+        return openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=create_http_client())
 
-    def get_completion(self, messages, tools, stream=True):
+    async def get_completion(self, messages, tools, stream=True, model=None):
         client = self.get_client()
-        return client.chat.completions.create(
-            model="meta-llama/Llama-3.3-70B-Instruct",
+        return await client.chat.completions.create(
+            model=model or self.model_for(),
             messages=messages,
-            tools=tools,
-            tool_choice="auto",
+            **self.tool_options(tools),
             stream=stream,
         )
 
 class GitHubProvider(Provider):
     """GitHub AI Models provider"""
 
-    def get_client(self):
+    provider_type = ProviderType.GITHUB
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
         # For GitHub models, prioritize the environment variable token if available
-        github_token = os.environ.get("GITHUB_TOKEN")
-        if github_token:
-            api_key = github_token
-        else:
-            api_key = self.api_key
+        super().__init__(os.environ.get("GITHUB_TOKEN") or api_key, base_url)
 
+    def create_client(self):
         # Use provided base_url if it exists, otherwise use the default GitHub endpoint
         base_url = self.base_url or "https://models.github.ai/inference"
-        return openai.OpenAI(
-            api_key=api_key,
-            base_url=base_url
+        return openai.AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=base_url,
+            http_client=create_http_client()
         )
 
-    def get_completion(self, messages, tools, stream=True):
+    async def get_completion(self, messages, tools, stream=True, model=None):
         client = self.get_client()
         try:
-            return client.chat.completions.create(
-                model="openai/gpt-4o-mini",
+            return await client.chat.completions.create(
+                model=model or self.model_for(),
                 messages=messages,
-                tools=tools,
-                tool_choice="auto",
+                **self.tool_options(tools),
                 stream=stream,
                 temperature=1.0,
                 top_p=1.0,
@@ -115,106 +455,363 @@ class GitHubProvider(Provider):
 class OpenRouterProvider(Provider):
     """OpenRouter API provider"""
 
-    def get_client(self):
+    provider_type = ProviderType.OPENROUTER
+    stream_usage = True
+
+    def create_client(self):
         base_url = self.base_url or "https://openrouter.ai/api/v1"
-        return openai.OpenAI(api_key=self.api_key, base_url=base_url)
+        return openai.AsyncOpenAI(api_key=self.api_key, base_url=base_url, http_client=create_http_client())
 
-    def get_completion(self, messages, tools, stream=True):
+    async def get_completion(self, messages, tools, stream=True, model=None):
         client = self.get_client()
-        return client.chat.completions.create(
-            model="openrouter/auto",
+        return await client.chat.completions.create(
+            model=model or self.model_for(),
             messages=messages,
-            tools=tools,
-            tool_choice="auto",
+            **self.tool_options(tools),
             stream=stream,
+            **self.usage_options(stream),
         )
 
 class AnthropicProvider(Provider):
     """Anthropic API provider"""
 
-    def get_client(self):
+    provider_type = ProviderType.ANTHROPIC
+
+    def create_client(self):
         try:
             import anthropic
-            return anthropic.Anthropic(api_key=self.api_key)
+            return anthropic.AsyncAnthropic(api_key=self.api_key, http_client=create_http_client())
         except ImportError:
             raise ImportError("The 'anthropic' package is required for using the Anthropic provider")
 
-    def get_completion(self, messages, tools, stream=True):
+    async def get_completion(self, messages, tools, stream=True, model=None):
         client = self.get_client()
 
-        # Convert OpenAI format messages to Anthropic format
-        anthropic_messages = []
-        for msg in messages:
-            if msg["role"] == "user":
-                anthropic_messages.append({"role": "user", "content": msg["content"]})
-            elif msg["role"] == "assistant":
-                anthropic_messages.append({"role": "assistant", "content": msg["content"]})
-            elif msg["role"] == "system":
-                # System message is handled differently in Anthropic
-                system_message = msg["content"]
-
         # Anthropic uses a different tools format, so we need to adapt
-        tool_choice = None
-        anthropic_tools = []
-
-        for tool in tools:
-            if tool["type"] == "function":
-                anthropic_tools.append({
-                    "name": tool["function"]["name"],
-                    "description": tool["function"]["description"],
-                    "input_schema": tool["function"]["parameters"]
-                })
-
-        # Use Claude model
-        response = client.messages.create(
-            model="claude-3-opus-20240229",
+        anthropic_tools = anthropic_adapter.to_anthropic_tools(tools)
+
+        # Convert OpenAI format messages (including tool calls and results) to Anthropic format
+        system_blocks, anthropic_messages = anthropic_adapter.to_anthropic_messages(messages, bool(anthropic_tools))
+        if system_blocks:
+            # Cache breakpoint after the static system prompt: tools and prompt are read from the cache
+            system_blocks[0]["cache_control"] = {"type": "ephemeral"}
+
+        if anthropic_tools and not system_blocks:
+            anthropic_tools[-1]["cache_control"] = {"type": "ephemeral"}
+
+        options = {}
+        if system_blocks:
+            options["system"] = system_blocks
+        if anthropic_tools:
+            options["tools"] = anthropic_tools
+
+        response = await client.messages.create(
+            model=model or self.model_for(),
             messages=anthropic_messages,
-            system=system_message if "system_message" in locals() else None,
-            tools=anthropic_tools if anthropic_tools else None,
-            stream=stream
+            max_tokens=ANTHROPIC_MAX_TOKENS,
+            stream=stream,
+            **options,
         )
-
+        if stream:
+            # The chat loop reads OpenAI-style chunks, translated event by event
+            return anthropic_adapter.stream_openai_chunks(response)
         return response
 
+    async def get_text_completion(self, messages, model, max_tokens, temperature):
+        client = self.get_client()
+        system_blocks, anthropic_messages = anthropic_adapter.to_anthropic_messages(messages, tool_blocks=False)
+        options = {"system": system_blocks} if system_blocks else {}
+        resp = await client.messages.create(
+            model=model,
+            messages=anthropic_messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **options,
+        )
+        text = "".join(block.text for block in resp.content if getattr(block, "type", None) == "text")
+        return text, getattr(resp, "usage", None)
+
 class AzureProvider(Provider):
     """Azure OpenAI API provider"""
 
-    def get_client(self):
-        return openai.AzureOpenAI(
+    provider_type = ProviderType.AZURE
+
+    def create_client(self):
+        return openai.AsyncAzureOpenAI(
             api_key=self.api_key,
             azure_endpoint=self.base_url,
-            api_version="2023-05-15"
+            api_version="2023-05-15",
+            http_client=create_http_client()
         )
 
-    def get_completion(self, messages, tools, stream=True):
+    async def get_completion(self, messages, tools, stream=True, model=None):
         client = self.get_client()
-        return client.chat.completions.create(
-            model="gpt-4",
+        return await client.chat.completions.create(
+            model=model or self.model_for(),
             messages=messages,
-            tools=tools,
-            tool_choice="auto",
+            **self.tool_options(tools),
             stream=stream,
         )
 
-def get_streaming_chat_response(messages, tools, current_user_config):
-    """Get streaming chat response from the configured AI provider"""
-    provider = Provider.create_provider(
-        provider_type=current_user_config.provider_type,
-        api_key=current_user_config.ai_key,
-        base_url=current_user_config.base_url
-    )
-
+async def _timed_stream(stream, key: Tuple[str, str, str], started: float, provider: "Provider"):
+    """Pass the chunks through, record the route's time to first chunk and token usage and release the client."""
+    first_chunk, usage, failed = None, None, False
     try:
-        return provider.get_completion(
-            messages=messages,
-            tools=tools,
-            stream=True
-        )
-    except Exception as e:
-        print(f"Error calling LLM: {e}")
+        async for chunk in stream:
+            if first_chunk is None:
+                first_chunk = time.monotonic() - started
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            yield chunk
+    except Exception:
+        failed = True
         raise
+    finally:
+        route_stats.record(key, first_chunk, usage, error=failed)
+        provider.release()
 
-def get_non_streaming_completion(
+
+class CircuitBreaker:
+    """
+    Health of one provider endpoint, judged by errors and time to first token.
+
+    Closed: requests pass. Open (after LLM_BREAKER_FAILURES consecutive failures or a
+    p95 TTFT over LLM_BREAKER_TTFT_P95): requests go to fallbacks. Half-open (after
+    LLM_BREAKER_COOLDOWN): one trial request decides whether it closes again.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, ttft_p95: float = LLM_BREAKER_TTFT_P95,
+                 cooldown: float = LLM_BREAKER_COOLDOWN, samples: int = LLM_TTFT_SAMPLES):
+        self.failures = failures
+        self.ttft_p95 = ttft_p95
+        self.cooldown = cooldown
+        self.ttfts = deque(maxlen=samples)
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.opened = 0
+        self.errors = 0
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+        if self.state == "half_open" and not self.trial:
+            self.trial = True
+            return True
+        return self.state == "closed"
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.opened += 1
+
+    def success(self, ttft: float):
+        self.trial = False
+        self.consecutive_failures = 0
+        self.ttfts.append(ttft)
+        if self.state == "half_open":
+            # A fast trial closes the circuit, earlier slow samples must not reopen it at once
+            if not self.ttft_p95 or ttft <= self.ttft_p95:
+                self.state = "closed"
+                self.ttfts.clear()
+            else:
+                self._open()
+        elif (self.state == "closed" and self.ttft_p95 and len(self.ttfts) >= LLM_BREAKER_MIN_SAMPLES
+              and percentile(self.ttfts, 95) > self.ttft_p95):
+            self._open()
+
+    def failure(self):
+        self.trial = False
+        self.errors += 1
+        self.consecutive_failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.consecutive_failures >= self.failures):
+            self._open()
+
+    def release(self):
+        """The request was cancelled (lost a hedge) before it could be judged."""
+        self.trial = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "opened": self.opened,
+            "errors": self.errors,
+            "ttft_p50_ms": round(percentile(self.ttfts, 50) * 1000, 1),
+            "ttft_p95_ms": round(percentile(self.ttfts, 95) * 1000, 1),
+            "ttft_p99_ms": round(percentile(self.ttfts, 99) * 1000, 1),
+        }
+
+
+def counts_as_failure(error: Exception) -> bool:
+    """
+    Errors of the request itself say nothing about the provider's health.
+
+    That includes invalid input and the errors of one key (401, 403, 429): users bring
+    their own keys, and the breaker of an endpoint is shared by all of them.
+    """
+    status_code = getattr(error, "status_code", None)
+    return status_code is None or status_code >= 500 or status_code == 408
+
+
+async def _resume(first_chunk, chunks):
+    try:
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+
+class LLMGateway:
+    """
+    Streams chat completions with failover between providers and optional hedging.
+
+    The user's provider comes first, then LLM_FALLBACK_PROVIDERS; providers with an
+    open circuit are skipped. A request only counts as started once its first chunk
+    arrived, so failures before that fall over to the next provider without the
+    user noticing. With LLM_HEDGE_AFTER, a slow first token starts the next
+    candidate in parallel; the first to deliver a chunk wins and the other is cancelled.
+    """
+
+    def __init__(self, fallbacks: List[str] = LLM_FALLBACK_PROVIDERS, hedge_after: float = LLM_HEDGE_AFTER):
+        self.fallbacks = fallbacks
+        self.hedge_after = hedge_after
+        self.breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self.failovers = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.exhausted = 0
+
+    def breaker(self, provider: "Provider") -> CircuitBreaker:
+        key = (provider.provider_type.value, provider.base_url or "")
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker()
+        return breaker
+
+    def candidates(self, current_user_config) -> List["Provider"]:
+        providers = [Provider.create_provider(
+            provider_type=current_user_config.provider_type,
+            api_key=current_user_config.ai_key,
+            base_url=current_user_config.base_url
+        )]
+        for provider_type in self.fallbacks:
+            if provider_type == current_user_config.provider_type or provider_type not in FALLBACK_ENV:
+                continue
+            key_env, base_url_env = FALLBACK_ENV[provider_type]
+            api_key = os.getenv(key_env, "")
+            if not api_key:
+                continue
+            base_url = (os.getenv(base_url_env) or None) if base_url_env else None
+            providers.append(Provider.create_provider(provider_type, api_key, base_url))
+        return providers
+
+    async def _first_chunk(self, provider: "Provider", messages, tools, route: str):
+        """Open a stream and wait for its first chunk; return (first chunk, remaining chunks, seconds to it)."""
+        model = provider.model_for(route)
+        key = (provider.provider_type.value, route if LLM_ROUTING else "default", model)
+        started = time.monotonic()
+        try:
+            stream = await provider.get_completion(messages=messages, tools=tools, stream=True, model=model)
+        except BaseException:
+            provider.release()
+            route_stats.record(key, None, error=True)
+            raise
+        chunks = _timed_stream(stream, key, started, provider)
+        try:
+            first_chunk = await chunks.__anext__()
+        except BaseException:
+            await chunks.aclose()
+            raise
+        return first_chunk, chunks, time.monotonic() - started
+
+    async def stream(self, messages, tools, current_user_config):
+        route = choose_route(messages, tools)
+        providers = self.candidates(current_user_config)
+        attempts: Dict[asyncio.Task, "Provider"] = {}
+        hedge_task, last_error = None, None
+
+        def next_provider() -> Optional["Provider"]:
+            # Skip providers with an open circuit; the breaker is asked only when the provider would be used
+            while providers:
+                provider = providers.pop(0)
+                if self.breaker(provider).allow():
+                    return provider
+            return None
+
+        def start(provider: "Provider") -> asyncio.Task:
+            task = asyncio.create_task(self._first_chunk(provider, messages, tools, route))
+            attempts[task] = provider
+            return task
+
+        # With every circuit open the user's provider is still tried
+        first = providers[0]
+        start(next_provider() or first)
+        try:
+            while attempts:
+                # Hedge once, on the next candidate (or the same provider if there is no other)
+                hedge = self.hedge_after > 0 and hedge_task is None and len(attempts) == 1
+                done, _ = await asyncio.wait(attempts, timeout=self.hedge_after if hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedges += 1
+                    hedge_task = start(next_provider() or next(iter(attempts.values())))
+                    continue
+                for task in done:
+                    provider = attempts.pop(task)
+                    try:
+                        first_chunk, chunks, ttft = task.result()
+                    except Exception as e:
+                        last_error = e
+                        print(f"Error calling LLM ({provider.provider_type.value}): {e}")
+                        if counts_as_failure(e):
+                            self.breaker(provider).failure()
+                        else:
+                            self.breaker(provider).release()
+                        continue
+                    self.breaker(provider).success(ttft)
+                    self.hedge_wins += task is hedge_task
+                    return _resume(first_chunk, chunks)
+                if not attempts:
+                    provider = next_provider()
+                    if provider is not None:
+                        self.failovers += 1
+                        start(provider)
+        finally:
+            # The loser of a hedge is cancelled and its stream closed
+            for task, provider in attempts.items():
+                task.cancel()
+                self.breaker(provider).release()
+            for result in await asyncio.gather(*attempts, return_exceptions=True):
+                if isinstance(result, tuple):
+                    await result[1].aclose()
+        self.exhausted += 1
+        raise last_error or RuntimeError("No LLM provider available")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "breakers": {"/".join(filter(None, key)): breaker.stats() for key, breaker in self.breakers.items()},
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "exhausted": self.exhausted,
+        }
+
+
+llm_gateway = LLMGateway()
+
+
+async def get_streaming_chat_response(messages, tools, current_user_config):
+    """Get streaming chat response from the configured AI provider (or a fallback), on the model chosen by choose_route"""
+    return await llm_gateway.stream(messages, tools, current_user_config)
+
+def quick_completion_model(provider_type: str) -> str:
+    """Model used by get_non_streaming_completion when no override is given"""
+    return MODEL_ROUTES[provider_type]["fast"] if LLM_ROUTING else MODEL_ROUTES[provider_type]["strong"]
+
+
+async def get_non_streaming_completion(
     messages,
     current_user_config,
     model_override: str | None = None,
@@ -230,23 +827,19 @@ def get_non_streaming_completion(
         api_key=current_user_config.ai_key,
         base_url=current_user_config.base_url,
     )
+    model = model_override or quick_completion_model(current_user_config.provider_type)
+    # Without routing there is no fast tier, the statistics say so
+    key = (provider.provider_type.value, "override" if model_override else ("fast" if LLM_ROUTING else "default"), model)
+    started = time.monotonic()
     try:
-        client = provider.get_client()
-        model = model_override or (
-            'gpt-4o-mini'
-            if current_user_config.provider_type == ProviderType.GITHUB.value
-            else 'gpt-3.5-turbo'
-        )
-        resp = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            stream=False,
-        )
-        if hasattr(resp, 'choices') and resp.choices:
-            return resp.choices[0].message.content or ""
-        return ""
+        # Anthropic answers through its Messages API, the other providers through chat completions
+        text, usage = await provider.get_text_completion(messages, model, max_tokens, temperature)
+        prompt_cache_stats.record(usage)
+        route_stats.record(key, time.monotonic() - started, usage)
+        return text
     except Exception as e:  # noqa: BLE001
+        route_stats.record(key, None, error=True)
         print(f"Non-streaming completion error: {e}")
-        return ""
\ No newline at end of file
+        return ""
+    finally:
+        provider.release()
\ No newline at end of file
@@ -1,8 +1,11 @@
+import asyncio
 import json
 import os
+import time
+import weakref
+from contextlib import asynccontextmanager
 from typing import AsyncGenerator
-import requests
-import openai
+import httpx
 from datetime import datetime
 
 from dotenv import load_dotenv
@@ -12,20 +15,76 @@ from pydantic import BaseModel, Field
 
 from fastapi.staticfiles import StaticFiles
 
-from . import auth, llm_service, prompts, schemas
+from . import auth, history_store, insights, llm_service, prompts, schemas, sse, suggestions, summarizer, tool_results, tool_selector
 from .schemas import LoginRequest
 
 load_dotenv()
 
-app = FastAPI(title="EGroupware Agent Service", root_path="/chatbot")
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-chat_histories = {}
+# Chat histories by username, trimmed to HISTORY_MAX_TOKENS and evicted when idle
+chat_histories = history_store.create_history_store()
+conversation_summarizer = summarizer.ConversationSummarizer(chat_histories)
+# Full copies of large tool results, the history only keeps a digest
+tool_result_store = tool_results.ToolResultStore()
+# AI insights by knowledge base version and provider configuration
+insights_cache = insights.InsightsCache()
+# Quick reply suggestions from templates, the LLM only as fallback, cached per conversation state
+suggestion_engine = suggestions.SuggestionEngine()
 TOOL_SERVER_URL = os.getenv("TOOL_SERVER_URL")
+TOOL_SERVER_TIMEOUT = float(os.getenv("TOOL_SERVER_TIMEOUT", "20"))
+TOOL_SERVER_MAX_CONNECTIONS = int(os.getenv("TOOL_SERVER_MAX_CONNECTIONS", "100"))
+TOOL_CONCURRENCY_PER_USER = int(os.getenv("TOOL_CONCURRENCY_PER_USER", "4"))
+# Agent loop limits: LLM rounds per user message, streamed token budget and wall time (checked while streaming and waiting on tools)
+AGENT_MAX_ROUNDS = int(os.getenv("AGENT_MAX_ROUNDS", "5"))
+AGENT_MAX_TOKENS = int(os.getenv("AGENT_MAX_TOKENS", "4000"))
+AGENT_MAX_SECONDS = float(os.getenv("AGENT_MAX_SECONDS", "120"))
+AGENT_STOPPED_NOTICE = "\n\nI stopped here because this request needed more steps than allowed. Please continue with a follow-up message."
+AGENT_INTERRUPTED_NOTICE = "The AI service stopped responding in the middle of the answer. Please try again."
+
+# Shared async HTTP client for the tool server, created lazily and closed on shutdown
+_tool_server_client: httpx.AsyncClient | None = None
+
+
+def get_tool_server_client() -> httpx.AsyncClient:
+    global _tool_server_client
+    if _tool_server_client is None or _tool_server_client.is_closed:
+        _tool_server_client = httpx.AsyncClient(
+            timeout=TOOL_SERVER_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=TOOL_SERVER_MAX_CONNECTIONS,
+                max_keepalive_connections=TOOL_SERVER_MAX_CONNECTIONS,
+            ),
+        )
+    return _tool_server_client
+
+
+async def active_session_user(token: str) -> schemas.TokenData | None:
+    """The user of a session that is still valid, None after logout or expiry."""
+    try:
+        return await auth.get_current_user(token)
+    except HTTPException:
+        return None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    insights_cache.start_refresher(lambda current_user: call_tool_server('get_company_info', {}, current_user),
+                                   active_session_user)
+    yield
+    await insights_cache.aclose()
+    if _tool_server_client is not None:
+        await _tool_server_client.aclose()
+    await llm_service.client_registry.aclose()
+    await conversation_summarizer.aclose()
+    await chat_histories.aclose()
+    await auth.sessions.aclose()
+
+
+app = FastAPI(title="EGroupware Agent Service", root_path="/chatbot", lifespan=lifespan)
+app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
 # Function to call the tool server
-def call_tool_server(tool_name: str, args: dict, user_credentials: schemas.TokenData):
+async def call_tool_server(tool_name: str, args: dict, user_credentials: schemas.TokenData):
     if not TOOL_SERVER_URL:
         return "Error: Tool Server URL is not configured."
 
@@ -41,19 +100,110 @@ def call_tool_server(tool_name: str, args: dict, user_credentials: schemas.Token
     payload = {"auth": auth_payload, "args": args}
 
     try:
-        response = requests.post(url, json=payload, timeout=20)
+        response = await get_tool_server_client().post(url, json=payload)
         response.raise_for_status()
         return response.json().get("result", "Tool executed but returned no result.")
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         try:
             error_detail = e.response.json().get("detail", e.response.text)
         except json.JSONDecodeError:
             error_detail = e.response.text
         return f"Error from Tool Server for '{tool_name}': {error_detail}"
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return f"Error connecting to the Tool Server: {e}"
 
 
+# Per-user cap on concurrently running tool calls; an entry lives as long as a stream holds it
+_user_tool_semaphores: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+
+def get_user_tool_semaphore(username: str) -> asyncio.Semaphore:
+    semaphore = _user_tool_semaphores.get(username)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(TOOL_CONCURRENCY_PER_USER)
+        _user_tool_semaphores[username] = semaphore
+    return semaphore
+
+
+class ToolCallRunner:
+    """Executes the tool calls of one agent round concurrently.
+
+    Calls are started individually (as soon as their arguments are complete) and
+    their results can be collected in completion order, while callers keep the
+    original tool_call order for the history.
+    """
+
+    def __init__(self, user_credentials: schemas.TokenData):
+        self.user_credentials = user_credentials
+        self.semaphore = get_user_tool_semaphore(user_credentials.username)
+        self.tasks: dict[int, asyncio.Task] = {}
+        self.results: dict[int, str] = {}
+
+    def start(self, index: int, tool_call: dict):
+        if index not in self.tasks:
+            self.tasks[index] = asyncio.create_task(self._run(tool_call))
+
+    async def _run(self, tool_call: dict) -> str:
+        name = tool_call["function"]["name"]
+        try:
+            args = json.loads(tool_call["function"]["arguments"] or "{}")
+        except json.JSONDecodeError as e:
+            return f"Error: invalid arguments for tool '{name}': {e}"
+        try:
+            if name == tool_results.FETCH_TOOL_NAME:
+                return tool_result_store.fetch(self.user_credentials.username, args)
+            async with self.semaphore:
+                return str(await call_tool_server(tool_name=name, args=args, user_credentials=self.user_credentials))
+        except Exception as e:
+            # Every call needs a result for the history, a failing tool must not end the stream
+            print(f"Error running tool '{name}': {e}")
+            return f"Error: tool '{name}' failed: {e}"
+
+    def finished(self):
+        """Yield (index, result) for calls that completed since the last check, without waiting."""
+        for index, task in self.tasks.items():
+            if index not in self.results and task.done():
+                self.results[index] = "Error: the tool call was cancelled." if task.cancelled() else task.result()
+                yield index, self.results[index]
+
+    async def wait_remaining(self, deadline: float | None = None):
+        """Yield (index, result) for all outstanding calls in completion order, until the monotonic deadline."""
+        pending = {task for index, task in self.tasks.items() if index not in self.results}
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                return
+            for item in self.finished():
+                yield item
+
+    def stop(self, reason: str) -> list:
+        """Cancel the outstanding calls; each gets an error result, so every started call has one."""
+        stopped = []
+        for index, task in self.tasks.items():
+            if index not in self.results:
+                task.cancel()
+                self.results[index] = f"Error: {reason}"
+                stopped.append((index, self.results[index]))
+        return stopped
+
+    def cancel(self):
+        # Client disconnected or generator closed early: don't leave calls running
+        for task in self.tasks.values():
+            task.cancel()
+
+
+def tool_arguments_complete(arguments: str) -> bool:
+    """True once a streamed arguments string is a complete JSON object"""
+    if not arguments.rstrip().endswith("}"):
+        return False
+    try:
+        json.loads(arguments)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
 # Basic routes for user interface
 @app.get("/", response_class=HTMLResponse, include_in_schema=False)
 async def read_login():
@@ -72,11 +222,12 @@ async def read_chat_ui():
 async def login_for_access_token(
         login_data: LoginRequest
 ):
-    # Save credentials to in-memory storage if they're valid
-    if not auth.verify_and_save_credentials(
+    # Only verified here, the credentials are kept in the session vault (a blocking request, kept off the event loop)
+    if not await asyncio.to_thread(
+            auth.verify_egroupware_credentials,
+            url=login_data.egw_url,
             username=login_data.username,
-            password=login_data.password,
-            egw_url=login_data.egw_url
+            password=login_data.password
     ):
         raise HTTPException(
             status_code=401,
@@ -103,19 +254,27 @@ async def login_for_access_token(
                 detail=f"Base URL is required for {login_data.provider_type} provider"
             )
 
-    # Create the JWT payload with all the session configuration
-    jwt_payload = {
-        "sub": login_data.username,
-        "pwd": login_data.password,
-        "egw_url": login_data.egw_url,
-        "ai_key": login_data.ai_key,
-        "provider_type": login_data.provider_type,
-        "base_url": login_data.base_url
-    }
-
-    # Create the token
-    token = auth.create_access_token(data=jwt_payload)
-    return {"access_token": token, "token_type": "bearer"}
+    # The client only gets an opaque session id, the credentials stay in the server-side vault
+    session_id = await auth.create_session(schemas.TokenData(
+        username=login_data.username,
+        password=login_data.password,
+        egw_url=login_data.egw_url,
+        ai_key=login_data.ai_key,
+        provider_type=login_data.provider_type,
+        base_url=login_data.base_url
+    ))
+    return {"access_token": session_id, "token_type": "bearer", "provider_type": login_data.provider_type}
+
+
+@app.post("/logout", tags=["Auth"])
+async def logout(token: str = Query(...)):
+    """End the session, its credentials are removed from the vault."""
+    user = await auth.sessions.get(token)
+    await auth.sessions.delete(token)
+    insights_cache.forget(token)
+    if user is not None:
+        conversation_summarizer.forget(user.username)
+    return {"status": "success"}
 
 
 tool_definitions = [
@@ -156,7 +315,7 @@ tool_definitions = [
         "type": "function",
         "function": {
             "name": "get_all_contacts",
-            "description": "Retrieves contacts from the EGroupware address book with pagination. For large contact lists, always start with a small limit (e.g., 20-50) and offer to show more if needed. Never retrieve more than 100 contacts at once.",
+            "description": "Retrieves contacts from the EGroupware address book ordered by name, with pagination. For large contact lists, always start with a small limit (e.g., 20-50) and offer to show more if needed. To show the next page, pass the 'next_cursor' value of the previous result as 'cursor'. Never retrieve more than 100 contacts at once.",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -167,11 +326,9 @@ tool_definitions = [
                         "maximum": 100,
                         "default": 50
                     },
-                    "offset": {
-                        "type": "integer",
-                        "description": "Number of contacts to skip for pagination (default: 0)",
-                        "minimum": 0,
-                        "default": 0
+                    "cursor": {
+                        "type": "string",
+                        "description": "The 'next_cursor' returned by the previous page. Omit for the first page."
                     }
                 },
                 "required": [],
@@ -265,7 +422,8 @@ tool_definitions = [
                 "type": "object",
                 "properties": {
                     "start_date": {"type": "string", "description": "Start date in YYYY-MM-DD format."},
-                    "end_date": {"type": "string", "description": "End date in YYYY-MM-DD format."}
+                    "end_date": {"type": "string", "description": "End date in YYYY-MM-DD format."},
+                    "time_zone": {"type": "string", "description": "The user's IANA Time Zone (e.g., 'Europe/Berlin'), if known. Event times are returned in it."}
                 },
                 "required": ["start_date", "end_date"],
             },
@@ -301,74 +459,177 @@ tool_definitions = [
         "type": "function",
         "function": {
             "name": "get_company_info",
-            "description": "Fetches the company's internal knowledge base. Use this to answer any questions about the company's mission, products, policies, history, or contact details.",
+            "description": "Searches the company's internal knowledge base. Use this to answer any questions about the company's mission, products, policies, history, or contact details.",
             "parameters": {
                 "type": "object",
-                "properties": {},
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "What to look up, e.g. 'support phone number' or 'pricing'. Only the most relevant sections are returned."
+                    },
+                    "top_k": {
+                        "type": "integer",
+                        "description": "Number of sections to return (default 3, max 10)."
+                    }
+                },
             },
         },
     },
+
+    tool_results.FETCH_TOOL_DEFINITION,
 ]
+# Each LLM call gets only the tool definitions relevant to the conversation
+tool_selection = tool_selector.ToolSelector(tool_definitions)
 
 
 # Chat streaming endpoint
-async def chat_stream_generator(message: str, current_user: schemas.TokenData) -> AsyncGenerator[str, None]:
-    if current_user.username not in chat_histories:
-        chat_histories[current_user.username] = [{"role": "system", "content": prompts.get_system_prompt()}]
-    chat_histories[current_user.username].append({"role": "user", "content": message})
-
-    stream = llm_service.get_streaming_chat_response(
-        messages=chat_histories[current_user.username],
-        tools=tool_definitions,
-        current_user_config=current_user
-    )
+def tool_result_event(tool_call: dict, result: str) -> str:
+    return f"data: {json.dumps({'type': 'tool_result', 'tool_name': tool_call['function']['name'], 'tool_call_id': tool_call['id'], 'result': result})}\n\n"
 
-    tool_calls, full_response = [], ""
-    for chunk in stream:
-        if not chunk.choices:
-            continue
-
-        delta = chunk.choices[0].delta
-        if delta and delta.content:
-            full_response += delta.content
-            yield f"data: {json.dumps({'type': 'token', 'content': delta.content})}\n\n"
-        elif delta and delta.tool_calls:
-            for tc_chunk in delta.tool_calls:
-                if len(tool_calls) <= tc_chunk.index:
-                    tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
-                tc = tool_calls[tc_chunk.index]
-                if tc_chunk.id: tc["id"] = tc_chunk.id
-                if tc_chunk.function.name: tc["function"]["name"] = tc_chunk.function.name
-                if tc_chunk.function.arguments: tc["function"]["arguments"] += tc_chunk.function.arguments
-
-    if full_response: chat_histories[current_user.username].append({"role": "assistant", "content": full_response})
-
-    if tool_calls:
-        chat_histories[current_user.username].append({"role": "assistant", "tool_calls": tool_calls})
-        for tool_call in tool_calls:
-            name, args = tool_call["function"]["name"], json.loads(tool_call["function"]["arguments"])
-            yield f"data: {json.dumps({'type': 'tool_call', 'tool_name': name})}\n\n"
-            response = call_tool_server(tool_name=name, args=args, user_credentials=current_user)
-            yield f"data: {json.dumps({'type': 'tool_result', 'result': str(response)})}\n\n"
-            chat_histories[current_user.username].append(
-                {"tool_call_id": tool_call["id"], "role": "tool", "name": name, "content": str(response)})
-
-        second_stream = llm_service.get_streaming_chat_response(
-            messages=chat_histories[current_user.username],
-            tools=tool_definitions,
-            current_user_config=current_user
-        )
-        second_response = ""
-        for chunk in second_stream:
-            if not chunk.choices:
-                continue
-            if chunk.choices[0].delta and chunk.choices[0].delta.content:
-                content = chunk.choices[0].delta.content
-                second_response += content
-                yield f"data: {json.dumps({'type': 'token', 'content': content})}\n\n"
-        if second_response: chat_histories[current_user.username].append(
-            {"role": "assistant", "content": second_response})
 
+async def chat_stream_generator(message: str, current_user: schemas.TokenData) -> AsyncGenerator[str, None]:
+    # Answer text is yielded as sse.TokenDelta, coalesce_tokens turns it into token frames
+    history = await chat_histories.load(current_user.username)
+    if history is None:
+        history = history_store.new_history([{"role": "system", "content": prompts.get_system_prompt()}])
+    history.append({"role": "user", "content": message})
+
+    started = time.monotonic()
+    deadline = started + AGENT_MAX_SECONDS
+    streamed_tokens = 0  # approximated as one token per provider delta
+
+    def budget_exhausted() -> bool:
+        return streamed_tokens >= AGENT_MAX_TOKENS or time.monotonic() >= deadline
+
+    for round_number in range(1, AGENT_MAX_ROUNDS + 1):
+        # Tool calls of the last round could not be answered by another round
+        tools_allowed = round_number < AGENT_MAX_ROUNDS
+        if budget_exhausted():
+            # The budget ran out while the tools of the previous round ran
+            history.append({"role": "assistant", "content": AGENT_STOPPED_NOTICE.lstrip()})
+            yield sse.TokenDelta(AGENT_STOPPED_NOTICE.lstrip())
+            break
+        # Store the turn so far, trimmed to the token budget that is sent to the LLM
+        history = await chat_histories.save(current_user.username, history)
+        # The date goes last, so the prefix (tools, system prompt, earlier turns) stays cacheable
+        try:
+            stream = await llm_service.get_streaming_chat_response(
+                messages=history + [prompts.get_datetime_message()],
+                # The last round must answer, it gets no tools to call
+                tools=tool_selection.select(history) if tools_allowed else None,
+                current_user_config=current_user
+            )
+        except Exception:
+            # Every provider failed before the first token: answer instead of dropping the stream
+            notice = "Sorry, the AI service is not reachable right now. Please try again in a moment."
+            yield sse.TokenDelta(notice)
+            break
+
+        runner = ToolCallRunner(current_user)
+        tool_calls, full_response, over_budget, interrupted = [], "", False, False
+        try:
+            try:
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None):
+                        usage = llm_service.prompt_cache_stats.record(chunk.usage)
+                        yield f"data: {json.dumps({'type': 'usage', 'round': round_number, **usage})}\n\n"
+                    if not chunk.choices:
+                        continue
+
+                    delta = chunk.choices[0].delta
+                    if delta and delta.content:
+                        streamed_tokens += 1
+                        full_response += delta.content
+                        yield sse.TokenDelta(delta.content)
+                    elif delta and delta.tool_calls:
+                        streamed_tokens += 1
+                        for tc_chunk in delta.tool_calls:
+                            # A new index means every earlier call has its full arguments
+                            for index in range(len(tool_calls), tc_chunk.index + 1):
+                                if index > 0 and tools_allowed:
+                                    runner.start(index - 1, tool_calls[index - 1])
+                                tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+                            tc = tool_calls[tc_chunk.index]
+                            if tc_chunk.id: tc["id"] = tc_chunk.id
+                            if tc_chunk.function.name:
+                                tc["function"]["name"] = tc_chunk.function.name
+                                yield f"data: {json.dumps({'type': 'tool_call', 'tool_name': tc['function']['name'], 'tool_call_id': tc['id'], 'round': round_number})}\n\n"
+                            if tc_chunk.function.arguments:
+                                tc["function"]["arguments"] += tc_chunk.function.arguments
+                                if tools_allowed and tool_arguments_complete(tc["function"]["arguments"]):
+                                    runner.start(tc_chunk.index, tc)
+
+                    for index, result in runner.finished():
+                        yield tool_result_event(tool_calls[index], result)
+
+                    if budget_exhausted():
+                        # Stop reading the answer; the provider stream is closed below
+                        over_budget = True
+                        break
+            except Exception as e:
+                # The provider failed mid-stream: tell the client and keep the results of started calls
+                print(f"Error streaming LLM response: {e}")
+                interrupted = True
+                yield f"data: {json.dumps({'type': 'error', 'message': AGENT_INTERRUPTED_NOTICE})}\n\n"
+
+            if over_budget and hasattr(stream, "aclose"):
+                await stream.aclose()
+
+            if (tool_calls and not tools_allowed) or (over_budget and not runner.tasks):
+                # Calls that were not executed must not end up in the history
+                full_response += AGENT_STOPPED_NOTICE
+                yield sse.TokenDelta(AGENT_STOPPED_NOTICE)
+                tool_calls = []
+
+            if interrupted and not runner.tasks:
+                # Calls whose arguments didn't arrive completely were never started
+                tool_calls = []
+
+            if not tool_calls:
+                if full_response: history.append({"role": "assistant", "content": full_response})
+                break
+
+            if not (over_budget or interrupted):
+                for index, tool_call in enumerate(tool_calls):
+                    runner.start(index, tool_call)
+            for index, result in runner.finished():
+                yield tool_result_event(tool_calls[index], result)
+            async for index, result in runner.wait_remaining(deadline):
+                yield tool_result_event(tool_calls[index], result)
+            # Calls still running when the budget ran out are cancelled with an error result
+            for index, result in runner.stop("the request ran out of time before the tool finished."):
+                yield tool_result_event(tool_calls[index], result)
+        finally:
+            runner.cancel()
+            # Also closes the provider stream when the client disconnected
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+
+        # Tool messages must follow the assistant message in the original tool_call order;
+        # calls the budget stopped before they started are left out
+        executed = [index for index in range(len(tool_calls)) if index in runner.results]
+        history.append({"role": "assistant", "content": full_response or None,
+                        "tool_calls": [tool_calls[index] for index in executed]})
+        for index in executed:
+            name = tool_calls[index]["function"]["name"]
+            content = tool_result_store.compact(current_user.username, name, runner.results[index])
+            history.append({"tool_call_id": tool_calls[index]["id"], "role": "tool", "name": name, "content": content})
+        if over_budget:
+            history.append({"role": "assistant", "content": AGENT_STOPPED_NOTICE.lstrip()})
+            yield sse.TokenDelta(AGENT_STOPPED_NOTICE)
+            break
+        if interrupted:
+            break
+
+    history = await chat_histories.save(current_user.username, history)
+    conversation_summarizer.record_turn(history, current_user.username, llm_calls=round_number)
+    # Compress older turns in the background, ready for the next message
+    conversation_summarizer.schedule(history, current_user)
+    if suggestions.SUGGESTIONS_IN_STREAM:
+        # Template suggestions need no LLM call; without, the client asks /suggestions after the end event
+        quick_replies = suggestion_engine.local(history, current_user.username, suggestions.STREAM_SUGGESTIONS_COUNT)
+        if quick_replies:
+            yield f"event: suggestions\ndata: {json.dumps({'suggestions': quick_replies})}\n\n"
     yield "event: end\ndata: {}\n\n"
 
 
@@ -392,57 +653,8 @@ async def get_suggestions(
         count: int = Query(3, ge=1, le=6)
 ):
     current_user = await auth.get_current_user(token)
-    history = chat_histories.get(current_user.username)
-    if not history:
-        # Provide generic starters if no history
-        return SuggestionResponse(suggestions=[
-                                                  "Show my upcoming meetings",
-                                                  "Add a new contact",
-                                                  "Create a task for next week"
-                                              ][:count])
-
-    # Build condensed recent context (last 6 turns)
-    recent = []
-    for msg in history[-12:]:  # rough pairs
-        role = msg.get('role')
-        if role in ('user', 'assistant') and msg.get('content'):
-            recent.append({"role": role, "content": msg['content'][:800]})
-
-    system_prompt = (
-        "You suggest short follow-up options. Return ONLY a JSON array of concise "
-        "user-facing suggestions (<=12 words each). Provide varied actionable intents."
-    )
-    messages = [{"role": "system", "content": system_prompt}] + recent + [
-        {"role": "user", "content": "Generate follow-up quick replies now."}
-    ]
-
-    raw = llm_service.get_non_streaming_completion(
-        messages,
-        current_user_config=current_user,
-        max_tokens=180,
-        temperature=0.8,
-    )
-    suggestions: list[str] = []
-    if raw:
-        import json as _json
-        try:
-            # Extract JSON array heuristically
-            start = raw.find('[')
-            end = raw.rfind(']')
-            if start != -1 and end != -1:
-                arr_txt = raw[start:end + 1]
-                parsed = _json.loads(arr_txt)
-                if isinstance(parsed, list):
-                    suggestions = [str(x).strip() for x in parsed if isinstance(x, (str, int, float))][:count]
-        except Exception:
-            pass
-    if not suggestions:
-        suggestions = [
-                          "List my upcoming events",
-                          "Create a new InfoLog task",
-                          "Search contacts for 'John'"
-                      ][:count]
-    return SuggestionResponse(suggestions=suggestions)
+    history = await chat_histories.load(current_user.username)
+    return SuggestionResponse(suggestions=await suggestion_engine.suggest(history, current_user, count))
 
 
 # Voice transcription endpoint
@@ -457,15 +669,20 @@ async def transcribe_audio(token: str = Form(...), audio: UploadFile = File(...)
     if current_user.provider_type != llm_service.ProviderType.OPENAI.value:
         raise HTTPException(status_code=400, detail="Voice transcription currently supported only for OpenAI provider")
 
+    provider = llm_service.Provider.create_provider(
+        provider_type=current_user.provider_type,
+        api_key=current_user.ai_key,
+        base_url=current_user.base_url
+    )
     try:
-        client = openai.OpenAI(api_key=current_user.ai_key)
+        client = provider.get_client()
         # Read bytes
         data = await audio.read()
         import io
         file_obj = io.BytesIO(data)
         file_obj.name = audio.filename or "voice.webm"
         # Whisper-1
-        result = client.audio.transcriptions.create(
+        result = await client.audio.transcriptions.create(
             model="whisper-1",
             file=(file_obj.name, file_obj, audio.content_type or "audio/webm"),
             response_format="json"
@@ -476,6 +693,8 @@ async def transcribe_audio(token: str = Form(...), audio: UploadFile = File(...)
         return TranscriptionResponse(text=text.strip())
     except Exception as e:  # noqa: BLE001
         raise HTTPException(status_code=500, detail=f"Transcription failed: {e}")
+    finally:
+        provider.release()
 
 
 # Endpoint to handle chat requests
@@ -489,7 +708,7 @@ async def chat_endpoint(
     Streams chat responses from the EGroupware Agent. Requires a valid token.
     """
     current_user = await auth.get_current_user(token)
-    return StreamingResponse(chat_stream_generator(message, current_user), media_type="text/event-stream")
+    return StreamingResponse(sse.coalesce_tokens(chat_stream_generator(message, current_user)), media_type="text/event-stream")
 
 
 class EGroupwareURLValidationRequest(BaseModel):
@@ -530,7 +749,8 @@ async def validate_egroupware_url(
             base_url = url.rstrip('/')
             test_url = f"{base_url}/groupdav.php/addressbook/"
 
-        response = requests.get(test_url, timeout=10, allow_redirects=False)
+        async with httpx.AsyncClient(timeout=10, follow_redirects=False) as client:
+            response = await client.get(test_url)
 
         # EGroupware can return 401 (unauthorized) or 302 (redirect to login)
         if response.status_code in [401, 302]:
@@ -541,7 +761,7 @@ async def validate_egroupware_url(
         else:
             return EGroupwareURLValidationResponse(valid=False,
                                                    detail=f"Unexpected status code: {response.status_code}")
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         return EGroupwareURLValidationResponse(valid=False, detail=f"Could not connect to EGroupware: {str(e)}")
 
 
@@ -578,10 +798,10 @@ async def validate_ai_key(data: dict):
             base_url=base_url
         )
 
-        # Make a minimal API call to validate the key
-        # This could fail depending on the provider if they don't support the same interface
-        # We'll catch exceptions and report them
-        client = provider.get_client()
+        # The endpoint needs no login, so the key gets a throwaway client instead of one
+        # from the shared pool (where it could evict the clients of logged-in users)
+        client = provider.create_client()
+        await client.close()
 
         # For simplicity, let's just return valid if we can create a client
         # In a production environment, you would make a test API call to verify
@@ -597,30 +817,41 @@ async def validate_ai_key(data: dict):
 # --- Agent-facing helper endpoints for the frontend to fetch real data ---
 
 
+def parse_tool_result(result):
+    """Decode a tool result; call_tool_server returns either a JSON string or an error string."""
+    try:
+        return json.loads(result) if isinstance(result, str) else result
+    except Exception:
+        return {'error': str(result)}
+
+
+async def fetch_events(current_user: schemas.TokenData, start_date: str, end_date: str):
+    return parse_tool_result(await call_tool_server('list_events', {'start_date': start_date, 'end_date': end_date}, current_user))
+
+
+async def fetch_tasks(current_user: schemas.TokenData, status: str | None = None, limit: int = 50):
+    return parse_tool_result(await call_tool_server('list_tasks', {'status': status, 'limit': limit}, current_user))
+
+
+async def fetch_insights(current_user: schemas.TokenData, token: str | None = None):
+    # First get company knowledge (cached by the tool server), its version is the cache key of the insights
+    knowledge_raw = await call_tool_server('get_company_info', {}, current_user)
+    version, content = insights.parse_knowledge(knowledge_raw)
+    return {'summary': await insights_cache.get(version, content, current_user, token)}
+
+
 @app.get('/api/events', tags=['API'])
 async def api_list_events(start_date: str = Query(...), end_date: str = Query(...), token: str = Query(...)):
     """Return calendar events between start_date and end_date for the authenticated user."""
     current_user = await auth.get_current_user(token)
-    result = call_tool_server('list_events', {'start_date': start_date, 'end_date': end_date}, current_user)
-    # call_tool_server returns either JSON string or an error string
-    try:
-        parsed = json.loads(result) if isinstance(result, str) else result
-    except Exception:
-        parsed = {'error': str(result)}
-    return JSONResponse(content={'result': parsed})
+    return JSONResponse(content={'result': await fetch_events(current_user, start_date, end_date)})
 
 
 @app.get('/api/tasks', tags=['API'])
 async def api_list_tasks(token: str = Query(...), status: str | None = Query(None), limit: int = Query(50)):
     """Return tasks from InfoLog for the authenticated user."""
     current_user = await auth.get_current_user(token)
-    args = {'status': status, 'limit': limit}
-    result = call_tool_server('list_tasks', args, current_user)
-    try:
-        parsed = json.loads(result) if isinstance(result, str) else result
-    except Exception:
-        parsed = {'error': str(result)}
-    return JSONResponse(content={'result': parsed})
+    return JSONResponse(content={'result': await fetch_tasks(current_user, status, limit)})
 
 
 class CreateTaskRequest(BaseModel):
@@ -634,40 +865,69 @@ async def api_create_task(payload: CreateTaskRequest, token: str = Query(...)):
     """Create a new task in InfoLog for the authenticated user."""
     current_user = await auth.get_current_user(token)
     args = payload.dict(exclude_unset=True)
-    result = call_tool_server('create_task', args, current_user)
-    try:
-        parsed = json.loads(result) if isinstance(result, str) else result
-    except Exception:
-        parsed = {'error': str(result)}
-    return JSONResponse(content={'result': parsed})
+    result = await call_tool_server('create_task', args, current_user)
+    return JSONResponse(content={'result': parse_tool_result(result)})
 
 
 @app.get('/api/ai-insights', tags=['API'])
 async def api_ai_insights(token: str = Query(...)):
     """Fetch company knowledge and return a short AI-generated insight summary."""
     current_user = await auth.get_current_user(token)
-    # First get company knowledge
-    knowledge_raw = call_tool_server('get_company_info', {}, current_user)
+    return JSONResponse(content={'result': await fetch_insights(current_user, token)})
+
+
+async def dashboard_section(name: str, coro) -> dict:
     try:
-        knowledge_parsed = json.loads(knowledge_raw) if isinstance(knowledge_raw, str) else knowledge_raw
-        content = ''
-        if isinstance(knowledge_parsed, dict) and knowledge_parsed.get('status') == 'success':
-            content = knowledge_parsed.get('content', '')
-        elif isinstance(knowledge_parsed, dict) and knowledge_parsed.get('content'):
-            content = knowledge_parsed.get('content')
-        elif isinstance(knowledge_parsed, str):
-            # If the tool returned a raw string
-            content = knowledge_parsed
-    except Exception:
-        content = str(knowledge_raw)
-
-    # Ask the LLM for a short summary / insights
-    system_prompt = prompts.get_system_prompt()
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": "Summarize the following company knowledge in 3 bullet points and suggest 2 quick actions a user can take with EGroupware:"},
-        {"role": "user", "content": content[:4000]}  # limit size
-    ]
-
-    summary = llm_service.get_non_streaming_completion(messages, current_user)
-    return JSONResponse(content={'result': {'summary': summary}})
\ No newline at end of file
+        return {'section': name, 'result': await coro}
+    except Exception as e:
+        print(f"Error fetching dashboard section '{name}': {e}")
+        return {'section': name, 'error': str(e)}
+
+
+async def dashboard_stream_generator(sections: dict) -> AsyncGenerator[str, None]:
+    """Run the dashboard sections concurrently and yield one NDJSON line per section as it completes."""
+    tasks = [asyncio.create_task(dashboard_section(name, coro)) for name, coro in sections.items()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield json.dumps(await next_done) + "\n"
+    finally:
+        # The client went away: stop the sections still running (a shared insight generation is shielded)
+        for task in tasks:
+            task.cancel()
+
+
+@app.get('/api/dashboard', tags=['API'])
+async def api_dashboard(start_date: str = Query(...), end_date: str = Query(...), token: str = Query(...),
+                        status: str | None = Query(None), limit: int = Query(10)):
+    """
+    Return the events, tasks and AI insights of the dashboard in one request.
+
+    The sections are fetched concurrently and streamed as NDJSON, one line
+    {"section": ..., "result": ...} (or "error") per section in the order they
+    complete, so events and tasks render before the LLM insight is ready.
+    """
+    current_user = await auth.get_current_user(token)
+    sections = {
+        'events': fetch_events(current_user, start_date, end_date),
+        'tasks': fetch_tasks(current_user, status, limit),
+        'insights': fetch_insights(current_user, token),
+    }
+    return StreamingResponse(dashboard_stream_generator(sections), media_type="application/x-ndjson")
+
+
+@app.get('/metrics', tags=['Monitoring'])
+async def metrics():
+    """Return runtime counters of the agent service (connection reuse, caches)."""
+    return JSONResponse(content={
+        'auth': auth.stats(),
+        'llm_clients': llm_service.client_registry.stats(),
+        'prompt_cache': llm_service.prompt_cache_stats.stats(),
+        'llm_routes': llm_service.route_stats.stats(),
+        'llm_gateway': llm_service.llm_gateway.stats(),
+        'chat_history': chat_histories.stats(),
+        'summarizer': conversation_summarizer.stats(),
+        'tool_results': tool_result_store.stats(),
+        'insights': insights_cache.stats(),
+        'suggestions': suggestion_engine.stats(),
+        'tool_selection': tool_selection.stats(),
+    })
@@ -1,8 +1,8 @@
 from datetime import datetime
 
-def get_system_prompt():
-    current_time = datetime.now()
-    return f"""
+# Static, byte-stable system prompt: providers cache the prompt prefix (tools + system prompt)
+# across requests, so nothing that changes per request may go in here.
+SYSTEM_PROMPT = """
 You are EGroupware Assistant, a specialized assistant for EGroupware. Your role is strictly limited to handling tasks, tools, and information related to this company.
 
 IDENTITY AND SCOPE
@@ -94,8 +94,19 @@ Let me know if you need anything else.
 
 DATE AND TIME
 
+The current date and time are given in the last system message. Use them for interpreting time expressions like "tomorrow" or "in 2 hours".
+"""
+
+
+def get_system_prompt():
+    return SYSTEM_PROMPT
+
+
+def get_datetime_message():
+    """Small trailing message with the volatile date and time, sent after the cached prefix."""
+    current_time = datetime.now().astimezone()
+    return {"role": "system", "content": f"""DATE AND TIME
+
 Current date: {current_time.strftime('%Y-%m-%d')}
 Current time: {current_time.strftime('%H:%M:%S')}
-Time zone: {datetime.now().astimezone().tzname()}
-Use this for interpreting time expressions like "tomorrow" or "in 2 hours".
-"""
\ No newline at end of file
+Time zone: {current_time.tzname()}"""}
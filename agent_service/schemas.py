@@ -4,6 +4,7 @@ from typing import Optional
 class Token(BaseModel):
     access_token: str
     token_type: str
+    provider_type: Optional[str] = None
 
 class TokenData(BaseModel):
     username: str
@@ -0,0 +1,181 @@
+import base64
+import hashlib
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from cryptography.fernet import Fernet, InvalidToken
+from dotenv import load_dotenv
+
+from .schemas import TokenData
+
+load_dotenv()
+
+# Session storage: "memory" (per process) or "redis" (shared by all workers)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+# Seconds a session is valid after login
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+# Maximum number of sessions held by the in-memory backend (least recently used are dropped)
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+# Seconds a worker uses its decrypted copy of a session before checking the shared backend again
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "30"))
+# Key encrypting the stored credentials, derived from JWT_SECRET_KEY if not set
+SESSION_VAULT_KEY = os.getenv("SESSION_VAULT_KEY") or os.getenv("JWT_SECRET_KEY")
+
+SESSION_ID_BYTES = 24
+
+
+def session_digest(session_id: str) -> str:
+    """Storage key of a session; the backend never sees a usable session id."""
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+
+
+def fernet_key(secret: Optional[str]) -> bytes:
+    if not secret:
+        # Sessions then only survive as long as this process
+        print("SESSION_VAULT_KEY and JWT_SECRET_KEY are not set, using a random session key")
+        return Fernet.generate_key()
+    return base64.urlsafe_b64encode(hashlib.sha256(secret.encode("utf-8")).digest())
+
+
+class SessionVault:
+    """
+    Opaque session ids mapped to the login credentials, encrypted at rest.
+
+    The client only holds a short random session id; the EGroupware password and AI
+    key stay on the server. Lookups are answered from a per-worker LRU of decrypted
+    sessions, the backend is only read on a miss or after SESSION_CACHE_TTL.
+    """
+
+    backend = "memory"
+
+    def __init__(self, ttl: int = SESSION_TTL, cache_ttl: float = SESSION_CACHE_TTL,
+                 max_sessions: int = SESSION_MAX_SESSIONS, key: Optional[str] = SESSION_VAULT_KEY):
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.max_sessions = max_sessions
+        self.fernet = Fernet(fernet_key(key))
+        self._cache: "OrderedDict[str, Tuple[TokenData, float, float]]" = OrderedDict()
+        self._records: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self.created = 0
+        self.cache_hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+
+    async def create(self, user: TokenData) -> str:
+        session_id = secrets.token_urlsafe(SESSION_ID_BYTES)
+        expires = time.time() + self.ttl
+        record = self.fernet.encrypt(json.dumps({**user.model_dump(), "exp": expires}).encode("utf-8"))
+        await self._store(session_digest(session_id), record)
+        self._remember(session_id, user, expires)
+        self.created += 1
+        return session_id
+
+    async def get(self, session_id: str) -> Optional[TokenData]:
+        now = time.time()
+        entry = self._cache.get(session_id)
+        if entry is not None:
+            user, expires, checked = entry
+            if expires > now and now - checked < self.cache_ttl:
+                self.cache_hits += 1
+                self._cache.move_to_end(session_id)
+                return user
+            del self._cache[session_id]
+
+        record = await self._load(session_digest(session_id))
+        if record is None:
+            self.misses += 1
+            return None
+        try:
+            data = json.loads(self.fernet.decrypt(record, ttl=self.ttl))
+        except InvalidToken:
+            self.misses += 1
+            return None
+        expires = data.pop("exp", 0)
+        if expires <= now:
+            self.misses += 1
+            return None
+        self.backend_hits += 1
+        user = TokenData(**data)
+        self._remember(session_id, user, expires)
+        return user
+
+    async def delete(self, session_id: str):
+        self._cache.pop(session_id, None)
+        await self._delete(session_digest(session_id))
+
+    def _remember(self, session_id: str, user: TokenData, expires: float):
+        self._cache[session_id] = (user, expires, time.time())
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.max_sessions:
+            self._cache.popitem(last=False)
+
+    # In-memory backend, the other backends override these
+
+    async def _store(self, key: str, record: bytes):
+        now = time.time()
+        self._records[key] = (record, now + self.ttl)
+        while self._records and (len(self._records) > self.max_sessions or next(iter(self._records.values()))[1] <= now):
+            self._records.popitem(last=False)
+
+    async def _load(self, key: str) -> Optional[bytes]:
+        entry = self._records.get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        self._records.move_to_end(key)
+        return entry[0]
+
+    async def _delete(self, key: str):
+        self._records.pop(key, None)
+
+    async def aclose(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.cache_hits + self.backend_hits + self.misses
+        return {
+            "backend": self.backend,
+            "cached": len(self._cache),
+            "created": self.created,
+            "cache_hits": self.cache_hits,
+            "backend_hits": self.backend_hits,
+            "misses": self.misses,
+            "cache_hit_ratio": round(self.cache_hits / lookups, 3) if lookups else 0,
+        }
+
+
+class RedisSessionVault(SessionVault):
+    """Sessions in Redis (needs the optional 'redis' package), shared by all workers and expired via the key TTL."""
+
+    backend = "redis"
+    key_prefix = "egw-chatbot:session:"
+
+    def __init__(self, url: str = SESSION_REDIS_URL, **kwargs):
+        super().__init__(**kwargs)
+        import redis.asyncio
+
+        self.redis = redis.asyncio.from_url(url)
+
+    async def _store(self, key: str, record: bytes):
+        await self.redis.set(self.key_prefix + key, record, ex=self.ttl)
+
+    async def _load(self, key: str) -> Optional[bytes]:
+        return await self.redis.get(self.key_prefix + key)
+
+    async def _delete(self, key: str):
+        await self.redis.delete(self.key_prefix + key)
+
+    async def aclose(self):
+        await self.redis.aclose()
+
+
+def create_session_vault(backend: str = SESSION_BACKEND) -> SessionVault:
+    if backend == "redis":
+        return RedisSessionVault()
+    if backend != "memory":
+        print(f"Unknown SESSION_BACKEND '{backend}', using the in-memory vault")
+    return SessionVault()
@@ -0,0 +1,89 @@
+import asyncio
+import os
+from json.encoder import encode_basestring_ascii
+from typing import AsyncGenerator, AsyncIterator, Optional, Union
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Milliseconds streamed tokens are collected into one SSE frame (0 = one frame per token)
+SSE_BATCH_WINDOW_MS = float(os.getenv("SSE_BATCH_WINDOW_MS", "10"))
+# A frame is sent early once it holds this many characters
+SSE_BATCH_MAX_CHARS = int(os.getenv("SSE_BATCH_MAX_CHARS", "256"))
+
+_END = object()
+
+
+class TokenDelta(str):
+    """Streamed answer text, merged with the following deltas into one token frame by coalesce_tokens."""
+
+
+def token_frame(text: str) -> str:
+    # The frame shape is fixed, only the content needs encoding (same output as json.dumps)
+    return 'data: {"type": "token", "content": ' + encode_basestring_ascii(text) + '}\n\n'
+
+
+async def _pump(events: AsyncIterator, queue: asyncio.Queue):
+    try:
+        async for event in events:
+            queue.put_nowait(event)
+        queue.put_nowait(_END)
+    except Exception as e:
+        # Raised again by the consumer
+        queue.put_nowait(e)
+
+
+async def coalesce_tokens(events: AsyncGenerator[Union[str, TokenDelta], None],
+                          window_ms: Optional[float] = None,
+                          max_chars: Optional[int] = None) -> AsyncGenerator[str, None]:
+    """
+    Turn the TokenDelta items of an event stream into token frames, one per time window.
+
+    The events are read by a separate task; after the first delta of a frame the
+    window is waited, then every delta that arrived meanwhile goes into the frame
+    (up to max_chars). Other events are passed on in order after the frame.
+    """
+    window = (SSE_BATCH_WINDOW_MS if window_ms is None else window_ms) / 1000
+    max_chars = SSE_BATCH_MAX_CHARS if max_chars is None else max_chars
+    if window <= 0:
+        # One frame per delta
+        try:
+            async for event in events:
+                yield token_frame(event) if isinstance(event, TokenDelta) else event
+        finally:
+            await events.aclose()
+        return
+
+    queue: asyncio.Queue = asyncio.Queue()
+    pump = asyncio.create_task(_pump(events, queue))
+    full = False
+    try:
+        while True:
+            event = await queue.get()
+            if isinstance(event, TokenDelta):
+                # Deltas left over from a full frame are sent without waiting again
+                if not full:
+                    await asyncio.sleep(window)
+                parts, size, event = [event], len(event), None
+                while size < max_chars and not queue.empty():
+                    item = queue.get_nowait()
+                    if not isinstance(item, TokenDelta):
+                        event = item
+                        break
+                    parts.append(item)
+                    size += len(item)
+                full = size >= max_chars
+                yield token_frame("".join(parts))
+                if event is None:
+                    continue
+            if event is _END:
+                break
+            if isinstance(event, Exception):
+                raise event
+            yield event
+    finally:
+        # The client went away: stop reading the events before closing them
+        pump.cancel()
+        await asyncio.gather(pump, return_exceptions=True)
+        await events.aclose()
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from . import llm_service
+from .history_store import split_turns
+
+load_dotenv()
+
+# Ask the LLM for suggestions when the templates find too few for the conversation state
+SUGGESTIONS_LLM_FALLBACK = os.getenv("SUGGESTIONS_LLM_FALLBACK", "true").lower() == "true"
+# Send the template suggestions as a 'suggestions' event at the end of the chat stream
+SUGGESTIONS_IN_STREAM = os.getenv("SUGGESTIONS_IN_STREAM", "true").lower() == "true"
+# Suggestions cached per conversation state (per worker)
+SUGGESTIONS_CACHE_MAX_SIZE = int(os.getenv("SUGGESTIONS_CACHE_MAX_SIZE", "1000"))
+# Number of suggestions sent with the chat stream, the chat UI shows four
+STREAM_SUGGESTIONS_COUNT = 4
+# Characters of each recent message given to the LLM
+LLM_CONTEXT_CHARS = 800
+
+STARTER_SUGGESTIONS = [
+    "Show my upcoming meetings",
+    "Add a new contact",
+    "Create a task for next week",
+]
+DEFAULT_SUGGESTIONS = [
+    "List my upcoming events",
+    "Create a new InfoLog task",
+    "Search contacts for 'John'",
+]
+
+# Follow-ups by the last tool used; a template is skipped if the turn has no value for one of its fields
+TOOL_TEMPLATES = {
+    "create_event": [
+        "Email the attendees about {title}",
+        "Create a task to prepare {title}",
+        "Show my events on {date}",
+        "Invite more people to {title}",
+        "Show my events for this week",
+        "Schedule another meeting",
+    ],
+    "list_events": [
+        "Show my events for next week",
+        "Schedule a new meeting",
+        "Create a task to prepare {title}",
+        "Email {email} about the meeting",
+        "Show tomorrow's events",
+        "Create a follow-up task",
+    ],
+    "create_task": [
+        "Schedule time to work on {title}",
+        "Create another task",
+        "Remind me about {title} on {date}",
+        "Show my upcoming meetings",
+        "Create a task for next week",
+    ],
+    "create_contact": [
+        "Send an email to {full_name}",
+        "Schedule a meeting with {full_name}",
+        "Search contacts at {company}",
+        "Add another contact",
+        "Show all my contacts",
+    ],
+    "search_contacts": [
+        "Send an email to {email}",
+        "Schedule a meeting with {email}",
+        "Add {query} as a new contact",
+        "Show all my contacts",
+        "Add a new contact",
+    ],
+    "get_all_contacts": [
+        "Show the next contacts",
+        "Send an email to {email}",
+        "Search contacts for {query}",
+        "Add a new contact",
+        "Schedule a meeting",
+    ],
+    "send_email": [
+        "Schedule a follow-up meeting with {email}",
+        "Create a task to follow up on {subject}",
+        "Add {email} to my contacts",
+        "Send another email",
+        "Show my upcoming meetings",
+    ],
+    "get_company_info": [
+        "Tell me more about {query}",
+        "How do I contact support?",
+        "What products does the company offer?",
+        "Create a task to follow up on this",
+        "Summarize the company's policies",
+    ],
+}
+# Follow-ups for a reply without tool calls, only usable with entities found in the reply
+REPLY_TEMPLATES = [
+    "Send an email to {email}",
+    "Search contacts for {email}",
+    "Show my events on {date}",
+    "Create a task due {date}",
+]
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+\w")
+_DATE = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+ENTITY_CHARS = 40
+
+StateKey = Tuple[str, str, int]
+
+
+def last_turn(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    _, turns = split_turns(history)
+    return turns[-1] if turns else []
+
+
+def state_hash(turn: List[Dict[str, Any]]) -> str:
+    """Hash of the last turn, the suggestions only depend on it."""
+    return hashlib.sha256(json.dumps(turn, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def extract_entities(turn: List[Dict[str, Any]]) -> Tuple[Optional[str], Dict[str, str]]:
+    """Return (last tool used, entities) of a turn: tool call arguments first, then emails and dates of the reply."""
+    last_tool, entities = None, {}
+    for message in turn:
+        for tool_call in message.get("tool_calls") or ():
+            name = tool_call["function"]["name"]
+            if name in TOOL_TEMPLATES:
+                last_tool = name
+            try:
+                args = json.loads(tool_call["function"]["arguments"] or "{}")
+            except json.JSONDecodeError:
+                continue
+            for key, value in args.items() if isinstance(args, dict) else ():
+                if isinstance(value, list):
+                    value = value[0] if value else None
+                if isinstance(value, str) and value.strip():
+                    entities[key] = value.strip()
+    if "to" in entities:
+        entities.setdefault("email", entities["to"])
+    for key in ("start_datetime", "start_date", "due_date"):
+        if key in entities:
+            entities.setdefault("date", entities[key][:10])
+
+    reply = turn[-1].get("content") if turn and turn[-1].get("role") == "assistant" else None
+    if reply:
+        email, date = _EMAIL.search(reply), _DATE.search(reply)
+        if email:
+            entities.setdefault("email", email.group(0))
+        if date:
+            entities.setdefault("date", date.group(0))
+    # Long values (descriptions, email bodies) make poor quick replies
+    return last_tool, {key: value for key, value in entities.items() if len(value) <= ENTITY_CHARS}
+
+
+def template_suggestions(turn: List[Dict[str, Any]], count: int) -> List[str]:
+    """Suggestions from the templates of the last tool used, filled with the entities of the turn."""
+    last_tool, entities = extract_entities(turn)
+    suggestions = []
+    for template in TOOL_TEMPLATES.get(last_tool, REPLY_TEMPLATES):
+        try:
+            suggestion = template.format_map(entities)
+        except KeyError:
+            continue
+        if suggestion not in suggestions:
+            suggestions.append(suggestion)
+        if len(suggestions) == count:
+            break
+    return suggestions
+
+
+def parse_suggestions(raw: str, count: int) -> List[str]:
+    try:
+        # Extract JSON array heuristically
+        start = raw.find('[')
+        end = raw.rfind(']')
+        if start != -1 and end != -1:
+            parsed = json.loads(raw[start:end + 1])
+            if isinstance(parsed, list):
+                return [str(x).strip() for x in parsed if isinstance(x, (str, int, float))][:count]
+    except Exception:
+        pass
+    return []
+
+
+class SuggestionEngine:
+    """
+    Quick reply suggestions after an assistant reply.
+
+    Intent templates keyed on the last tool used and the entities of the turn answer
+    most replies without an LLM call; the LLM is only asked when they find fewer
+    than the requested number. Results are cached by a hash of the last turn, so the
+    suggestions sent with the chat stream are reused by the /suggestions endpoint.
+    """
+
+    def __init__(self, max_size: int = SUGGESTIONS_CACHE_MAX_SIZE, llm_fallback: bool = SUGGESTIONS_LLM_FALLBACK):
+        self.max_size = max_size
+        self.llm_fallback = llm_fallback
+        self._entries: "OrderedDict[StateKey, List[str]]" = OrderedDict()
+        self.hits = 0
+        self.templates = 0
+        self.llm_calls = 0
+        self.defaults = 0
+
+    def _put(self, key: StateKey, suggestions: List[str]):
+        self._entries[key] = suggestions
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def local(self, history: List[Dict[str, Any]], username: str, count: int) -> List[str]:
+        """Cached or template suggestions, an empty list if the LLM is needed."""
+        turn = last_turn(history)
+        key = (username, state_hash(turn), count)
+        cached = self._entries.get(key)
+        if cached is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return cached
+        suggestions = template_suggestions(turn, count)
+        if len(suggestions) < count:
+            return []
+        self.templates += 1
+        self._put(key, suggestions)
+        return suggestions
+
+    async def suggest(self, history: Optional[List[Dict[str, Any]]], current_user, count: int) -> List[str]:
+        if not history:
+            # Provide generic starters if no history
+            return STARTER_SUGGESTIONS[:count]
+        suggestions = self.local(history, current_user.username, count)
+        if suggestions:
+            return suggestions
+
+        if self.llm_fallback:
+            self.llm_calls += 1
+            suggestions = await self._llm(history, current_user, count)
+        if not suggestions:
+            self.defaults += 1
+            return DEFAULT_SUGGESTIONS[:count]
+        self._put((current_user.username, state_hash(last_turn(history)), count), suggestions)
+        return suggestions
+
+    async def _llm(self, history: List[Dict[str, Any]], current_user, count: int) -> List[str]:
+        # Build condensed recent context (last 6 turns)
+        recent = []
+        for msg in history[-12:]:  # rough pairs
+            role = msg.get('role')
+            if role in ('user', 'assistant') and msg.get('content'):
+                recent.append({"role": role, "content": msg['content'][:LLM_CONTEXT_CHARS]})
+
+        system_prompt = (
+            "You suggest short follow-up options. Return ONLY a JSON array of concise "
+            "user-facing suggestions (<=12 words each). Provide varied actionable intents."
+        )
+        messages = [{"role": "system", "content": system_prompt}] + recent + [
+            {"role": "user", "content": "Generate follow-up quick replies now."}
+        ]
+        try:
+            raw = await llm_service.get_non_streaming_completion(
+                messages,
+                current_user_config=current_user,
+                max_tokens=180,
+                temperature=0.8,
+            )
+        except Exception as e:
+            print(f"Error generating suggestions: {e}")
+            return []
+        return parse_suggestions(raw, count) if raw else []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "templates": self.templates,
+            "llm_calls": self.llm_calls,
+            "defaults": self.defaults,
+        }
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from . import llm_service
+from .history_store import HistoryStore, count_message_tokens, split_turns
+
+load_dotenv()
+
+# Summarize older turns once a conversation exceeds this many prompt tokens (0 = never)
+HISTORY_SUMMARY_THRESHOLD = int(os.getenv("HISTORY_SUMMARY_THRESHOLD", "6000"))
+# Number of most recent turns that are always kept verbatim
+HISTORY_SUMMARY_KEEP_TURNS = int(os.getenv("HISTORY_SUMMARY_KEEP_TURNS", "3"))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "500"))
+# Tool results are shortened to this many characters in the summarization prompt
+SUMMARY_TOOL_RESULT_CHARS = 1500
+
+SUMMARY_PREFIX = "Summary of the earlier conversation with the user:\n"
+
+SUMMARY_PROMPT = (
+    "You compress a conversation between a user and an EGroupware assistant into a running summary "
+    "that replaces it in the assistant's memory. Keep every fact the assistant may need later: names, "
+    "email addresses, IDs, dates and times, created or found items, decisions, user preferences and open "
+    "questions. Merge the previous summary if there is one. Answer with concise bullet points only."
+)
+
+
+def is_summary(message: Dict[str, Any]) -> bool:
+    return message.get("role") == "system" and str(message.get("content", "")).startswith(SUMMARY_PREFIX)
+
+
+def _resolved(turn: List[Dict[str, Any]]) -> bool:
+    """A turn is resolved when every tool call got its result and the assistant answered."""
+    answered = {message.get("tool_call_id") for message in turn if message.get("role") == "tool"}
+    called = {tool_call["id"] for message in turn for tool_call in message.get("tool_calls") or ()}
+    return called <= answered and turn[-1].get("role") == "assistant" and not turn[-1].get("tool_calls")
+
+
+def _render(messages: List[Dict[str, Any]]) -> str:
+    lines = []
+    for message in messages:
+        role = message.get("role")
+        if role == "user":
+            lines.append(f"User: {message.get('content')}")
+        elif role == "assistant":
+            if message.get("content"):
+                lines.append(f"Assistant: {message['content']}")
+            for tool_call in message.get("tool_calls") or ():
+                lines.append(f"Assistant called {tool_call['function']['name']}({tool_call['function']['arguments']})")
+        elif role == "tool":
+            lines.append(f"Result of {message.get('name')}: {str(message.get('content'))[:SUMMARY_TOOL_RESULT_CHARS]}")
+    return "\n".join(lines)
+
+
+class ConversationSummarizer:
+    """
+    Compresses the older turns of long conversations into one running summary message.
+
+    Runs as a background task after a chat turn has been answered, so it never delays
+    a response. The recent turns and turns with unanswered tool calls stay verbatim.
+    """
+
+    def __init__(self, store: HistoryStore, threshold: int = HISTORY_SUMMARY_THRESHOLD,
+                 keep_turns: int = HISTORY_SUMMARY_KEEP_TURNS):
+        self.store = store
+        self.threshold = threshold
+        self.keep_turns = keep_turns
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Prompt tokens the latest summary of a conversation saves on every LLM call; dropped on logout,
+        # once the history has no summary anymore and beyond the history store's number of conversations
+        self._saved_per_call: "OrderedDict[str, int]" = OrderedDict()
+        self.summaries = 0
+        self.failures = 0
+        self.turns = 0
+        self.prompt_tokens_saved = 0
+
+    def schedule(self, history: List[Dict[str, Any]], current_user) -> Optional[asyncio.Task]:
+        """Start summarizing the conversation in the background if it is over the threshold."""
+        username = current_user.username
+        if not self.threshold or username in self._tasks:
+            return None
+        if sum(count_message_tokens(message) for message in history) <= self.threshold:
+            return None
+        task = asyncio.create_task(self._summarize(history, current_user))
+        self._tasks[username] = task
+        task.add_done_callback(lambda _: self._tasks.pop(username, None))
+        return task
+
+    async def _summarize(self, history: List[Dict[str, Any]], current_user):
+        head, turns = split_turns(history)
+        old_turns = []
+        for turn in turns[:max(len(turns) - self.keep_turns, 0)]:
+            if not _resolved(turn):
+                break
+            old_turns.append(turn)
+        if not old_turns:
+            return
+        summarized = [message for turn in old_turns for message in turn]
+        previous = next((message for message in head if is_summary(message)), None)
+
+        conversation = _render(summarized)
+        if previous is not None:
+            conversation = f"Previous summary:\n{previous['content'][len(SUMMARY_PREFIX):]}\n\nConversation:\n{conversation}"
+        try:
+            summary = await llm_service.get_non_streaming_completion(
+                [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": conversation}],
+                current_user_config=current_user,
+                max_tokens=HISTORY_SUMMARY_MAX_TOKENS,
+                temperature=0.2,
+            )
+        except Exception as e:
+            summary = ""
+            print(f"Error summarizing conversation: {e}")
+        if not summary.strip():
+            self.failures += 1
+            return
+
+        # The conversation may have moved on meanwhile, only replace the turns if they are still there
+        username = current_user.username
+        current = await self.store.load(username)
+        if current is None:
+            return
+        current_head, current_turns = split_turns(current)
+        current_messages = [message for turn in current_turns for message in turn]
+        if json.dumps(current_messages[:len(summarized)]) != json.dumps(summarized):
+            return
+
+        summary_message = {"role": "system", "content": SUMMARY_PREFIX + summary.strip()}
+        new_head = [message for message in current_head if not is_summary(message)] + [summary_message]
+        removed = summarized + ([previous] if previous is not None else [])
+        saved = sum(map(count_message_tokens, removed)) - count_message_tokens(summary_message)
+        await self.store.save(username, current.replaced(new_head + current_messages[len(summarized):]))
+        self._saved_per_call[username] = (self._saved_per_call.get(username, 0) if previous is not None else 0) + saved
+        self._saved_per_call.move_to_end(username)
+        while len(self._saved_per_call) > self.store.max_users:
+            self._saved_per_call.popitem(last=False)
+        self.summaries += 1
+
+    def record_turn(self, history: List[Dict[str, Any]], username: str, llm_calls: int):
+        """Account the prompt tokens the summary saved over the LLM calls of one turn."""
+        self.turns += 1
+        if any(is_summary(message) for message in history[:2]):
+            self.prompt_tokens_saved += self._saved_per_call.get(username, 0) * llm_calls
+        else:
+            # The history was cleared or expired since the summary
+            self._saved_per_call.pop(username, None)
+
+    def forget(self, username: str):
+        """The user logged out or the conversation was deleted."""
+        self._saved_per_call.pop(username, None)
+
+    async def aclose(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "summaries": self.summaries,
+            "failures": self.failures,
+            "running": len(self._tasks),
+            "prompt_tokens_saved": self.prompt_tokens_saved,
+            "prompt_tokens_saved_per_turn": round(self.prompt_tokens_saved / self.turns, 1) if self.turns else 0,
+        }
@@ -0,0 +1,206 @@
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .history_store import count_tokens
+
+load_dotenv()
+
+# Tool results up to this many characters are kept verbatim in the chat history
+TOOL_RESULT_INLINE_CHARS = int(os.getenv("TOOL_RESULT_INLINE_CHARS", "2000"))
+# Rows shown in the digest of a larger result
+TOOL_RESULT_PREVIEW_ROWS = int(os.getenv("TOOL_RESULT_PREVIEW_ROWS", "5"))
+# Full results kept for fetch_tool_result (per worker), and for how long
+TOOL_RESULT_STORE_MAX = int(os.getenv("TOOL_RESULT_STORE_MAX", "5000"))
+TOOL_RESULT_STORE_TTL = float(os.getenv("TOOL_RESULT_STORE_TTL", "3600"))
+
+PREVIEW_VALUE_CHARS = 120
+PREVIEW_TEXT_CHARS = 1000
+FETCH_MAX_ROWS = 50
+FETCH_TEXT_CHARS = 4000
+
+FETCH_TOOL_NAME = "fetch_tool_result"
+
+FETCH_TOOL_DEFINITION = {
+    "type": "function",
+    "function": {
+        "name": FETCH_TOOL_NAME,
+        "description": "Reads more of an earlier tool result that was shortened in the conversation (it has a 'result_id'). Use it instead of calling the original tool again.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "result_id": {"type": "string", "description": "The 'result_id' of the shortened result."},
+                "offset": {"type": "integer", "description": "First row (or character for text results) to return. Default 0."},
+                "limit": {"type": "integer", "description": f"Number of rows to return, max {FETCH_MAX_ROWS}. Default 20."},
+                "query": {"type": "string", "description": "Only return rows containing this text (case-insensitive)."},
+                "fields": {"type": "array", "items": {"type": "string"}, "description": "Only return these fields of each row."}
+            },
+            "required": ["result_id"],
+        },
+    },
+}
+
+
+def _rows(data: Any) -> Tuple[Optional[str], Optional[list]]:
+    """Return (key, rows) of the row list in a tool result: the result itself or its longest list field."""
+    if isinstance(data, list):
+        return None, data
+    if isinstance(data, dict):
+        lists = [(key, value) for key, value in data.items() if isinstance(value, list)]
+        if lists:
+            return max(lists, key=lambda item: len(item[1]))
+    return None, None
+
+
+def _text(data: Any, result: str) -> Tuple[Optional[str], str]:
+    """Return (key, text) of the text in a tool result: the result itself or its longest string field."""
+    if isinstance(data, dict):
+        strings = [(key, value) for key, value in data.items() if isinstance(value, str)]
+        if strings:
+            return max(strings, key=lambda item: len(item[1]))
+    return None, result
+
+
+def _short(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > PREVIEW_VALUE_CHARS:
+        return value[:PREVIEW_VALUE_CHARS] + "…"
+    return value
+
+
+def _project(row: Any, fields: Optional[List[str]] = None) -> Any:
+    if not isinstance(row, dict):
+        return _short(row)
+    return {key: value for key, value in row.items()
+            if (fields is None or key in fields) and value not in (None, "", [], {})}
+
+
+class ToolResultStore:
+    """
+    Keeps large tool results out of the chat history.
+
+    The history gets a digest (counts, the first rows, shortened values) with a
+    result_id; the full result stays here and the model reads more of it with the
+    fetch_tool_result tool, which the agent service answers locally.
+
+    The store is per worker, also with a shared HISTORY_BACKEND: a follow-up message
+    handled by another worker misses the result, and the model is told to call the
+    original tool again (as after TOOL_RESULT_STORE_TTL).
+    """
+
+    def __init__(self, max_size: int = TOOL_RESULT_STORE_MAX, ttl: float = TOOL_RESULT_STORE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._results: "OrderedDict[Tuple[str, str], Tuple[str, Any, float]]" = OrderedDict()
+        self.compacted = 0
+        self.history_tokens_saved = 0
+        self.fetches = 0
+        self.misses = 0
+
+    def _evict(self, now: float):
+        while self._results:
+            _, (_, _, stored) = next(iter(self._results.items()))
+            if now - stored <= self.ttl and len(self._results) <= self.max_size:
+                break
+            self._results.popitem(last=False)
+
+    def compact(self, username: str, tool_name: str, result: str) -> str:
+        """Return the content for the history: the result itself if small, otherwise a digest."""
+        if len(result) <= TOOL_RESULT_INLINE_CHARS or tool_name == FETCH_TOOL_NAME:
+            return result
+        try:
+            data = json.loads(result)
+        except json.JSONDecodeError:
+            data = None
+
+        result_id = f"tr_{uuid.uuid4().hex[:12]}"
+        now = time.monotonic()
+        self._results[(username, result_id)] = (result, data, now)
+        self._evict(now)
+
+        digest: Dict[str, Any] = {"result_id": result_id, "shortened": True}
+        if isinstance(data, dict):
+            digest.update({key: _short(value) for key, value in data.items() if not isinstance(value, (list, dict))})
+        rows_key, rows = _rows(data)
+        if rows:
+            fields = sorted({key for row in rows if isinstance(row, dict) for key in row})
+            digest.update({
+                "total_rows": len(rows),
+                "fields": fields,
+                rows_key or "rows": [
+                    {key: _short(value) for key, value in _project(row).items()} if isinstance(row, dict) else _short(row)
+                    for row in rows[:TOOL_RESULT_PREVIEW_ROWS]
+                ],
+                "note": f"Showing {min(len(rows), TOOL_RESULT_PREVIEW_ROWS)} of {len(rows)} rows. "
+                        f"Call {FETCH_TOOL_NAME} with this result_id (offset, limit, query, fields) for more."
+            })
+        else:
+            text_key, text = _text(data, result)
+            digest.update({
+                text_key or "content": text[:PREVIEW_TEXT_CHARS],
+                "total_chars": len(text),
+                "note": f"Showing the first {PREVIEW_TEXT_CHARS} characters. "
+                        f"Call {FETCH_TOOL_NAME} with this result_id and an offset to read more."
+            })
+
+        compacted = json.dumps(digest, ensure_ascii=False)
+        self.compacted += 1
+        self.history_tokens_saved += max(count_tokens(result) - count_tokens(compacted), 0)
+        return compacted
+
+    def fetch(self, username: str, args: Dict[str, Any]) -> str:
+        """Answer a fetch_tool_result call from the stored full result."""
+        self.fetches += 1
+        # The arguments come from the model: invalid ones get an error result the model can correct
+        if not isinstance(args, dict):
+            return json.dumps({"status": "error", "message": "The arguments must be a JSON object."})
+        try:
+            offset = max(int(args.get("offset") or 0), 0)
+            limit = min(max(int(args.get("limit") or 20), 1), FETCH_MAX_ROWS)
+        except (TypeError, ValueError, OverflowError):
+            return json.dumps({"status": "error", "message": "'offset' and 'limit' must be integers."})
+        fields = args.get("fields") or None
+        if fields is not None and not isinstance(fields, list):
+            return json.dumps({"status": "error", "message": "'fields' must be a list of field names."})
+
+        entry = self._results.get((username, str(args.get("result_id"))))
+        if entry is None:
+            self.misses += 1
+            return json.dumps({"status": "error", "message": "This result is no longer available, call the original tool again."})
+        result, data, _ = entry
+
+        rows_key, rows = _rows(data)
+        if rows:
+            query = str(args.get("query") or "").lower()
+            if query:
+                rows = [row for row in rows if query in json.dumps(row, ensure_ascii=False).lower()]
+            page = rows[offset:offset + limit]
+            return json.dumps({
+                "status": "success",
+                "total_rows": len(rows),
+                "offset": offset,
+                "has_more": offset + limit < len(rows),
+                rows_key or "rows": [_project(row, fields) for row in page],
+            }, ensure_ascii=False)
+
+        text_key, text = _text(data, result)
+        return json.dumps({
+            "status": "success",
+            "total_chars": len(text),
+            "offset": offset,
+            "has_more": offset + FETCH_TEXT_CHARS < len(text),
+            text_key or "content": text[offset:offset + FETCH_TEXT_CHARS],
+        }, ensure_ascii=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stored": len(self._results),
+            "compacted": self.compacted,
+            "history_tokens_saved": self.history_tokens_saved,
+            "fetches": self.fetches,
+            "misses": self.misses,
+        }
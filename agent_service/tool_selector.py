@@ -0,0 +1,177 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .history_store import count_tokens, split_turns
+from .tool_results import FETCH_TOOL_NAME
+
+load_dotenv()
+
+# Send only the tools relevant to the user's message instead of every definition (false = always all)
+TOOL_SELECTION = os.getenv("TOOL_SELECTION", "true").lower() == "true"
+# Tools called in this many recent turns stay available for follow-up messages
+TOOL_SELECTION_CONTEXT_TURNS = int(os.getenv("TOOL_SELECTION_CONTEXT_TURNS", "2"))
+# Minimum score of a tool to be selected
+TOOL_SELECTION_MIN_SCORE = 1.0
+
+# Words users say for a tool that its description doesn't contain; each counts as a strong match
+INTENT_KEYWORDS = {
+    "create_contact": "add new contact person save phone number address colleague customer",
+    "search_contacts": "find search look who contact email address phone number person colleague",
+    "get_all_contacts": "all contacts address book list show everyone next page more",
+    "send_email": "email mail send write message reply forward notify tell inform",
+    "create_event": "schedule meeting appointment event book call invite plan calendar reschedule",
+    "list_events": "calendar meeting appointment event agenda schedule today tomorrow week busy free upcoming",
+    "create_task": "task todo remind reminder infolog follow due deadline note",
+    "get_company_info": "company policy product price pricing support mission history office holiday vacation",
+}
+# Messages made only of these words need no tools
+SMALL_TALK = set(
+    "hi hello hey hallo moin thanks thank you ok okay great cool bye goodbye good morning evening night "
+    "yes no sure please how are who what can do help".split()
+)
+STOPWORDS = set(
+    "a an and are as at be by can for from in into is it its of on or the to with this that these those "
+    "you your user users any use used using if not only must should more most all new what which when how "
+    "me my we our do does there".split()
+)
+
+_WORD = re.compile(r"[a-z]{2,}")
+
+
+def stem(word: str) -> str:
+    for suffix in ("ing", "es", "ed", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def terms(text: str) -> List[str]:
+    return [stem(word) for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+def tool_name(tool: Dict[str, Any]) -> str:
+    return tool["function"]["name"]
+
+
+class ToolSelector:
+    """
+    Picks the tool definitions relevant to a chat turn by lexical matching.
+
+    Each tool is indexed by the words of its name, description and parameters
+    (weighted by how specific they are to the tool) plus INTENT_KEYWORDS. A turn gets
+    the tools matching the user's message and those called or asked for in recent turns; small talk
+    gets none, and a message matching nothing gets all of them (the
+    fetch_tool_result tool only while the history holds a shortened result). Every subset is
+    serialized once, in the original order, so equal subsets are identical requests.
+    """
+
+    def __init__(self, tools: List[Dict[str, Any]]):
+        self.tools = tools
+        self.names = [tool_name(tool) for tool in tools]
+        self.full_tokens = count_tokens(json.dumps(tools))
+        self._subsets: Dict[FrozenSet[str], Tuple[List[Dict[str, Any]], int]] = {}
+
+        documents = {}
+        for tool in tools:
+            function = tool["function"]
+            if function["name"] == FETCH_TOOL_NAME:
+                # Only offered while the history holds a shortened result
+                continue
+            parameters = function.get("parameters", {}).get("properties", {})
+            text = " ".join([function["name"].replace("_", " "), function.get("description", "")]
+                            + [f"{name.replace('_', ' ')} {spec.get('description', '')}" for name, spec in parameters.items()])
+            documents[function["name"]] = set(terms(text))
+        doc_freqs = Counter(term for words in documents.values() for term in words)
+        total = len(documents)
+        self._weights = {
+            name: {term: math.log(total / doc_freqs[term]) for term in words}
+            for name, words in documents.items()
+        }
+        for name, keywords in INTENT_KEYWORDS.items():
+            if name in self._weights:
+                for term in terms(keywords):
+                    self._weights[name][term] = max(self._weights[name].get(term, 0.0), TOOL_SELECTION_MIN_SCORE)
+
+        self.selections = 0
+        self.all_tools = 0
+        self.no_tools = 0
+        self.tokens_sent = 0
+        self.tokens_saved = 0
+
+    def subset(self, names: FrozenSet[str]) -> List[Dict[str, Any]]:
+        entry = self._subsets.get(names)
+        if entry is None:
+            tools = [tool for tool in self.tools if tool_name(tool) in names]
+            entry = self._subsets[names] = (tools, count_tokens(json.dumps(tools)) if tools else 0)
+        self.tokens_sent += entry[1]
+        self.tokens_saved += self.full_tokens - entry[1]
+        return entry[0]
+
+    def match(self, message: str) -> Optional[FrozenSet[str]]:
+        """Tools matching the message, None if it matches nothing (and isn't small talk)."""
+        words = _WORD.findall(message.lower())
+        if all(word in SMALL_TALK for word in words):
+            return frozenset()
+        query = set(terms(message))
+        matched = frozenset(
+            name for name, weights in self._weights.items()
+            if sum(weights.get(term, 0.0) for term in query) >= TOOL_SELECTION_MIN_SCORE
+        )
+        return matched or None
+
+    def select(self, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The tool definitions to send with the next LLM call of this conversation."""
+        self.selections += 1
+        if not TOOL_SELECTION:
+            return self.subset(frozenset(self.names))
+        _, turns = split_turns(history)
+        current = turns[-1] if turns else []
+        message = next((str(msg.get("content") or "") for msg in current if msg.get("role") == "user"), "")
+        # Shortened results in the history can only be read on with fetch_tool_result
+        shortened = any(msg.get("role") == "tool" and '"shortened": true' in str(msg.get("content"))
+                        for turn in turns for msg in turn)
+        matched = self.match(message)
+        if matched is None:
+            self.all_tools += 1
+            return self.subset(frozenset(name for name in self.names if shortened or name != FETCH_TOOL_NAME))
+
+        context = turns[-(TOOL_SELECTION_CONTEXT_TURNS + 1):]
+        called = [
+            {tool_call["function"]["name"] for msg in turn for tool_call in msg.get("tool_calls") or ()}
+            for turn in turns
+        ]
+        # Follow-ups ("yes, send it") and later rounds of this turn keep the tools used recently
+        # and the tools asked for by the recent user messages (a draft the user confirms wasn't sent yet)
+        recent = set().union(*called[-len(context):]) if context else set()
+        for turn in context[:-1]:
+            for msg in turn:
+                if msg.get("role") == "user":
+                    recent |= self.match(str(msg.get("content") or "")) or set()
+        selected = (matched | recent) & set(self.names)
+        if not selected:
+            # Anthropic rejects tool calls in the history of a request without tools
+            selected = set().union(*called) & set(self.names)
+        if selected and shortened:
+            selected.add(FETCH_TOOL_NAME)
+        if not selected:
+            self.no_tools += 1
+        return self.subset(frozenset(selected))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": TOOL_SELECTION,
+            "selections": self.selections,
+            "all_tools": self.all_tools,
+            "no_tools": self.no_tools,
+            "subsets": len(self._subsets),
+            "full_tokens": self.full_tokens,
+            "tokens_sent": self.tokens_sent,
+            "tokens_saved": self.tokens_saved,
+            "tokens_saved_per_call": round(self.tokens_saved / self.selections, 1) if self.selections else 0,
+        }
@@ -0,0 +1,101 @@
+"""
+Benchmark of CardDAV multistatus parsing on a synthetic addressbook.
+
+Compares the previous approach (ET.fromstring on the whole body plus vobject
+for every card) with the streaming path of the tool server
+(webdav.iter_multistatus over the byte stream plus the lightweight vCard field extractor).
+Reports wall time and peak Python heap usage of each.
+
+Usage:
+    python benchmarks/carddav_parse.py --cards 50000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tool_server.tools import carddav, webdav  # noqa: E402
+
+
+def write_multistatus(path: str, cards: int):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<d:multistatus xmlns:d="DAV:" xmlns:card="urn:ietf:params:xml:ns:carddav">\n')
+        for i in range(cards):
+            vcard = (
+                "BEGIN:VCARD\r\nVERSION:3.0\r\n"
+                f"UID:contact-{i}\r\nFN:Person {i}\r\nN:{i};Person;;;\r\n"
+                f"EMAIL;TYPE=work:person{i}@example.com\r\nTEL;TYPE=work:+49 221 {i:07d}\r\n"
+                f"ORG:Company {i % 500};Department {i % 7}\r\n"
+                f"ADR;TYPE=work:;;Street {i};City {i % 100};;{10000 + i % 90000};Germany\r\n"
+                f"NOTE:Synthetic contact number {i} used for parser benchmarks\r\n"
+                "END:VCARD\r\n"
+            )
+            f.write(f'<d:response><d:href>/groupdav.php/user/addressbook/{i}.vcf</d:href>'
+                    f'<d:propstat><d:prop><d:getetag>"{i}-1"</d:getetag>'
+                    f'<card:address-data>{escape(vcard)}</card:address-data></d:prop>'
+                    f'<d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>\n')
+        f.write("</d:multistatus>\n")
+
+
+def parse_tree_vobject(path: str) -> int:
+    import vobject
+
+    with open(path, "rb") as f:
+        body = f.read().decode("utf-8")
+    root = ET.fromstring(body)
+    contacts = []
+    for addr_data in root.iterfind(".//card:address-data", webdav.NAMESPACES):
+        vcard = vobject.readOne(addr_data.text)
+        contacts.append({
+            "name": vcard.fn.value,
+            "email": vcard.email.value,
+            "phone": vcard.tel.value,
+            "organization": vcard.org.value[0],
+            "address": f"{vcard.adr.value.street}, {vcard.adr.value.city}",
+        })
+    return len(contacts)
+
+
+def parse_streaming(path: str) -> int:
+    count = 0
+    with open(path, "rb") as f:
+        for entry in webdav.iter_multistatus(f):
+            if entry.data and carddav.parse_contact(entry.data):
+                count += 1
+    return count
+
+
+def measure(label: str, func, path: str):
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = func(path)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<24} cards={count:<7} time={elapsed:7.2f}s  peak={peak / 1024 / 1024:8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=50000)
+    parser.add_argument("--skip-vobject", action="store_true", help="Only run the streaming parser")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "multistatus.xml")
+        write_multistatus(path, args.cards)
+        print(f"document: {os.path.getsize(path) / 1024 / 1024:.1f} MiB, {args.cards} cards")
+        measure("streaming + extractor", parse_streaming, path)
+        if not args.skip_vobject:
+            measure("fromstring + vobject", parse_tree_vobject, path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Load test for the agent service chat stream.
+
+Opens N concurrent /chat SSE streams against a running agent service and
+reports time to first token (TTFT) and total stream time percentiles.
+
+Usage:
+    python benchmarks/chat_ttft.py --url http://localhost:8000 --token <jwt> \
+        --concurrency 30 --message "Hello"
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, int(round((pct / 100) * (len(ordered) - 1))))
+    return ordered[k]
+
+
+async def run_stream(client: httpx.AsyncClient, url: str, token: str, message: str):
+    started = time.perf_counter()
+    ttft = None
+    async with client.stream("GET", f"{url}/chat", params={"message": message, "token": token}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if ttft is None and line.startswith("data: "):
+                try:
+                    event = json.loads(line[6:])
+                except json.JSONDecodeError:
+                    continue
+                if event.get("type") == "token":
+                    ttft = time.perf_counter() - started
+            if line.startswith("event: end"):
+                break
+    return ttft, time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--message", default="Hello, what can you do?")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        wall = time.perf_counter()
+        results = await asyncio.gather(
+            *(run_stream(client, args.url, args.token, args.message) for _ in range(args.concurrency)),
+            return_exceptions=True,
+        )
+        wall = time.perf_counter() - wall
+
+    errors = [r for r in results if isinstance(r, Exception)]
+    ok = [r for r in results if not isinstance(r, Exception)]
+    ttfts = [r[0] for r in ok if r[0] is not None]
+    totals = [r[1] for r in ok]
+
+    print(f"streams: {len(results)}  ok: {len(ok)}  errors: {len(errors)}  wall: {wall:.2f}s")
+    if ttfts:
+        print(f"TTFT   p50={percentile(ttfts, 50):.3f}s p95={percentile(ttfts, 95):.3f}s "
+              f"max={max(ttfts):.3f}s mean={statistics.mean(ttfts):.3f}s")
+    if totals:
+        print(f"Total  p50={percentile(totals, 50):.3f}s p95={percentile(totals, 95):.3f}s max={max(totals):.3f}s")
+    for err in errors[:5]:
+        print(f"error: {err!r}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
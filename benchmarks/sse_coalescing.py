@@ -0,0 +1,114 @@
+"""
+Frames, bytes and CPU of the chat stream with and without token coalescing.
+
+Runs concurrent /chat streams against the agent service app in-process, with a
+mock LLM streaming single-token deltas (several arriving together per network
+read, then a short gap, like a real provider). Every run reports the SSE frames
+and bytes the server writes per response and the server CPU time per streamed
+token: first with one frame per token (SSE_BATCH_WINDOW_MS=0, the previous
+behaviour), then with each window given by --windows.
+
+Usage:
+    python benchmarks/sse_coalescing.py --streams 50 --tokens 500 --burst 4 --gap-ms 20 --windows 5,10,25
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+
+
+class MockLLMStream:
+    """Single-token deltas; `burst` of them arrive at once, then the stream waits `gap` seconds."""
+
+    def __init__(self, tokens: int, burst: int, gap: float):
+        self.tokens, self.burst, self.gap = tokens, burst, gap
+
+    async def __aiter__(self):
+        for index in range(self.tokens):
+            if index and index % self.burst == 0:
+                await asyncio.sleep(self.gap)
+            delta = SimpleNamespace(content=f" word{index % 100}", tool_calls=None)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+async def one_stream(app, token: str) -> tuple:
+    """Request /chat on the ASGI app directly and count the body writes the server makes."""
+    frames = size = 0
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/chat", "raw_path": b"/chat", "root_path": "",
+        "query_string": urlencode({"message": "Tell me something", "token": token}).encode(),
+        "headers": [], "server": ("bench", 80), "client": ("127.0.0.1", 1),
+    }
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal frames, size
+        if message["type"] == "http.response.body" and message.get("body"):
+            frames += 1
+            size += len(message["body"])
+
+    await app(scope, receive, send)
+    return frames, size
+
+
+async def run(window_ms: float, args) -> dict:
+    from agent_service import auth, llm_service, main, schemas, sse
+
+    sse.SSE_BATCH_WINDOW_MS = window_ms
+
+    async def mock_streaming_chat_response(messages, tools, current_user_config):
+        return MockLLMStream(args.tokens, args.burst, args.gap_ms / 1000)
+
+    llm_service.get_streaming_chat_response = mock_streaming_chat_response
+    tokens = []
+    for index in range(args.streams):
+        tokens.append(await auth.create_session(schemas.TokenData(
+            username=f"bench-{window_ms}-{index}", password="bench", egw_url="http://egw",
+            ai_key="bench", provider_type="openai")))
+
+    cpu, wall = time.process_time(), time.perf_counter()
+    results = await asyncio.gather(*(one_stream(main.app, token) for token in tokens))
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+
+    frames = sum(result[0] for result in results)
+    size = sum(result[1] for result in results)
+    streamed = args.streams * args.tokens
+    return {
+        "window_ms": window_ms,
+        "frames_per_response": round(frames / args.streams, 1),
+        "bytes_per_response": round(size / args.streams),
+        "cpu_us_per_token": round(cpu / streamed * 1e6, 1),
+        "seconds": round(wall, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=50, help="Concurrent chat streams")
+    parser.add_argument("--tokens", type=int, default=500, help="Tokens per response")
+    parser.add_argument("--burst", type=int, default=4, help="Deltas arriving together")
+    parser.add_argument("--gap-ms", type=float, default=20, help="Milliseconds between bursts")
+    parser.add_argument("--windows", default="5,10,25", help="Coalescing windows to compare, in milliseconds")
+    args = parser.parse_args()
+
+    for window_ms in [0.0] + [float(window) for window in args.windows.split(",") if window]:
+        print(json.dumps(asyncio.run(run(window_ms, args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Throughput benchmark of the tool server's threaded and async execution paths.
+
+Starts a local mock EGroupware (an asyncio HTTP server answering the InfoLog
+REST API after a fixed latency) and fires concurrent /execute/list_tasks calls
+at the tool server app in-process. The threaded run reproduces the previous
+setup (every tool on a pool of 40 threads); the async run uses the async tool
+variants on the event loop.
+
+Usage:
+    python benchmarks/tool_server_throughput.py --requests 2000 --concurrency 200 --latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+
+def start_mock_egroupware(latency: float) -> str:
+    """Serve the InfoLog listing on a keep-alive HTTP/1.1 asyncio server in a child process, return its URL."""
+    body = json.dumps({"responses": {
+        f"/infolog/{i}": {"id": i, "title": f"Task {i}", "status": "needs-action"} for i in range(20)
+    }}).encode("utf-8")
+    response = (b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                b"Content-Length: " + str(len(body)).encode("ascii") + b"\r\n\r\n" + body)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = next((int(line.split(b":", 1)[1]) for line in head.split(b"\r\n")
+                               if line.lower().startswith(b"content-length:")), 0)
+                if length:
+                    await reader.readexactly(length)
+                await asyncio.sleep(latency)
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def serve(port_queue):
+        async def main():
+            server = await asyncio.start_server(handle, "127.0.0.1", 0, backlog=1024)
+            port_queue.put(server.sockets[0].getsockname()[1])
+            await server.serve_forever()
+        asyncio.run(main())
+
+    # A separate process, so the mock doesn't compete with the tool server for the GIL
+    port_queue = multiprocessing.Queue()
+    multiprocessing.Process(target=serve, args=(port_queue,), daemon=True).start()
+    return f"http://127.0.0.1:{port_queue.get()}"
+
+
+async def run(mode: str, threads: int, egw_url: str, total: int, concurrency: int) -> dict:
+    from tool_server import main
+
+    main.TOOL_EXECUTION_MODE = mode
+    main.TOOL_WORKER_THREADS = threads
+    main.tool_executor = main.ToolExecutor()
+
+    payload = {"auth": {"username": "bench", "password": "bench", "egw_url": egw_url}, "args": {"limit": 5}}
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=main.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://tool-server", timeout=None) as client:
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/execute/list_tasks", json=payload)
+                if response.status_code != 200 or response.json()["result"].startswith('{"status": "error"'):
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "requests": total,
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(total / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds the mock EGroupware takes per request")
+    parser.add_argument("--threads", type=int, default=40, help="Worker threads of the threaded run")
+    args = parser.parse_args()
+
+    # Keep enough connections alive for both paths, so only the execution model differs
+    os.environ.setdefault("EGW_POOL_MAXSIZE", str(args.concurrency))
+    egw_url = start_mock_egroupware(args.latency)
+
+    for mode in ("thread", "async"):
+        print(json.dumps(asyncio.run(run(mode, args.threads, egw_url, args.requests, args.concurrency))))
+
+
+if __name__ == "__main__":
+    main()
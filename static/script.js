@@ -278,6 +278,7 @@ function setupLoginPage() {
             const data = await response.json();
             if (!response.ok) throw new Error(data.detail || 'Login failed.');
             localStorage.setItem('accessToken', data.access_token);
+            if (data.provider_type) localStorage.setItem('providerType', data.provider_type);
             window.location.href = createUrl('/chat-ui');
         } catch (error) {
             errorMessage.textContent = error.message;
@@ -302,25 +303,30 @@ function setupChatPage() {
     let audioChunks = [];
     const voiceBtn = document.getElementById('voice-btn');
     let recording = false;
-    // Disable voice if provider not OpenAI (decode JWT payload)
+    // Disable voice if provider not OpenAI (stored at login, older tokens carry it in the JWT payload)
     try {
+        let providerType = localStorage.getItem('providerType');
         const rawToken = localStorage.getItem('accessToken');
-        if (rawToken) {
+        if (!providerType && rawToken) {
             const parts = rawToken.split('.');
             if (parts.length === 3) {
-                const payload = JSON.parse(atob(parts[1].replace(/-/g,'+').replace(/_/g,'/')));
-                if (payload.provider_type && payload.provider_type !== 'openai' && voiceBtn) {
-                    voiceBtn.disabled = true;
-                    voiceBtn.title = 'Voice input available only with OpenAI provider';
-                }
+                providerType = JSON.parse(atob(parts[1].replace(/-/g,'+').replace(/_/g,'/'))).provider_type;
             }
         }
+        if (providerType && providerType !== 'openai' && voiceBtn) {
+            voiceBtn.disabled = true;
+            voiceBtn.title = 'Voice input available only with OpenAI provider';
+        }
     } catch (_) { /* ignore decode issues */ }
 
     if (logoutBtn) {
         logoutBtn.addEventListener('click', () => {
             if (eventSource) eventSource.close();
+            const token = localStorage.getItem('accessToken');
+            // Remove the credentials from the server-side session vault
+            if (token) fetch(createUrl(`/logout?token=${encodeURIComponent(token)}`), { method: 'POST', keepalive: true }).catch(() => {});
             localStorage.removeItem('accessToken');
+            localStorage.removeItem('providerType');
             window.location.href = createUrl('/');
         });
     }
@@ -461,6 +467,12 @@ function setupChatPage() {
                     .replace(/^[-*]\s+(.*)$/gm, '<br>• $1') // Bullet points
                     .replace(/\n/g, '<br>'); // line breaks
                 mainTextElement.innerHTML += sanitizedContent;
+            } else if (data.type === 'error') {
+                // The answer broke off; the end event follows
+                const errorElement = document.createElement('div');
+                errorElement.className = 'stream-error';
+                errorElement.textContent = data.message;
+                mainTextElement.appendChild(errorElement);
             }
             chatBox.scrollTop = chatBox.scrollHeight;
         };
@@ -470,9 +482,17 @@ function setupChatPage() {
             eventSource.close();
         };
 
+        // Suggestions sent with the stream save the extra /suggestions request
+        let streamedSuggestions = false;
+        eventSource.addEventListener('suggestions', (event) => {
+            const data = JSON.parse(event.data);
+            streamedSuggestions = true;
+            renderQuickReplies(data.suggestions || []);
+        });
+
         eventSource.addEventListener('end', () => {
              eventSource.close();
-             fetchSuggestions();
+             if (!streamedSuggestions) fetchSuggestions();
         });
     }
 
@@ -543,36 +563,45 @@ async function fetchDashboardData() {
     const end = start;
 
     try {
-        // Events
-        const evResp = await fetch(createUrl(`/api/events?start_date=${start}&end_date=${end}&token=${encodeURIComponent(token)}`));
-        if (evResp.ok) {
-            const evJson = await evResp.json();
-            const events = evJson.result || [];
-            const countEl = document.getElementById('events-count');
-            if (countEl) countEl.textContent = String((events && events.length) || 0);
-        }
-
-        // Tasks
-        const tResp = await fetch(createUrl(`/api/tasks?token=${encodeURIComponent(token)}&limit=10`));
-        if (tResp.ok) {
-            const tJson = await tResp.json();
-            const tasks = tJson.result || [];
-            const taskCountEl = document.getElementById('tasks-count');
-            if (taskCountEl) taskCountEl.textContent = String((tasks && tasks.length) || 0);
-        }
-
-        // AI insights (summary)
-        const aResp = await fetch(createUrl(`/api/ai-insights?token=${encodeURIComponent(token)}`));
-        if (aResp.ok) {
-            const aJson = await aResp.json();
-            const summary = aJson.result && aJson.result.summary ? aJson.result.summary : 'No insights available.';
-            renderAIInsights(summary);
+        // One request for all sections; each NDJSON line is rendered as soon as it arrives
+        const resp = await fetch(createUrl(`/api/dashboard?start_date=${start}&end_date=${end}&token=${encodeURIComponent(token)}&limit=10`));
+        if (!resp.ok || !resp.body) return;
+        const reader = resp.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let newline;
+            while ((newline = buffer.indexOf('\n')) >= 0) {
+                const line = buffer.slice(0, newline).trim();
+                buffer = buffer.slice(newline + 1);
+                if (line) renderDashboardSection(JSON.parse(line));
+            }
         }
     } catch (e) {
         console.error('Error fetching dashboard data', e);
     }
 }
 
+function renderDashboardSection(section) {
+    if (section.error) {
+        console.error(`Error fetching dashboard ${section.section}`, section.error);
+        return;
+    }
+    const result = section.result;
+    if (section.section === 'events') {
+        const countEl = document.getElementById('events-count');
+        if (countEl) countEl.textContent = String((result && result.length) || 0);
+    } else if (section.section === 'tasks') {
+        const taskCountEl = document.getElementById('tasks-count');
+        if (taskCountEl) taskCountEl.textContent = String((result && result.length) || 0);
+    } else if (section.section === 'insights') {
+        renderAIInsights(result && result.summary ? result.summary : 'No insights available.');
+    }
+}
+
 // Quick action handlers: hook buttons to basic actions
 document.addEventListener('click', (e) => {
     const target = e.target;
@@ -0,0 +1,179 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from agent_service.anthropic_adapter import stream_openai_chunks, to_anthropic_messages
+
+# Event sequences as recorded from Anthropic's streaming Messages API (data payloads of the SSE events)
+TEXT_STREAM = [
+    {"type": "message_start", "message": {"id": "msg_01", "type": "message", "role": "assistant", "content": [],
+                                          "stop_reason": None, "usage": {"input_tokens": 412, "output_tokens": 1}}},
+    {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+    {"type": "ping"},
+    {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Hello"}},
+    {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": ", how can I help?"}},
+    {"type": "content_block_stop", "index": 0},
+    {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+     "usage": {"output_tokens": 9}},
+    {"type": "message_stop"},
+]
+
+TOOL_STREAM = [
+    {"type": "message_start", "message": {"id": "msg_02", "type": "message", "role": "assistant", "content": [],
+                                          "stop_reason": None, "usage": {"input_tokens": 980, "output_tokens": 2}}},
+    {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+    {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Let me look that up."}},
+    {"type": "content_block_stop", "index": 0},
+    {"type": "content_block_start", "index": 1,
+     "content_block": {"type": "tool_use", "id": "toolu_01", "name": "search_contacts", "input": {}}},
+    {"type": "content_block_delta", "index": 1, "delta": {"type": "input_json_delta", "partial_json": ""}},
+    {"type": "content_block_delta", "index": 1, "delta": {"type": "input_json_delta", "partial_json": "{\"query\": "}},
+    {"type": "content_block_delta", "index": 1, "delta": {"type": "input_json_delta", "partial_json": "\"Anna\"}"}},
+    {"type": "content_block_stop", "index": 1},
+    {"type": "content_block_start", "index": 2,
+     "content_block": {"type": "tool_use", "id": "toolu_02", "name": "list_events", "input": {}}},
+    {"type": "content_block_stop", "index": 2},
+    {"type": "message_delta", "delta": {"stop_reason": "tool_use", "stop_sequence": None},
+     "usage": {"output_tokens": 61}},
+    {"type": "message_stop"},
+]
+
+
+def _namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_namespace(item) for item in value]
+    return value
+
+
+async def _replay(recorded):
+    for event in recorded:
+        yield _namespace(event)
+
+
+def translate(recorded):
+    async def collect():
+        return [chunk async for chunk in stream_openai_chunks(_replay(recorded))]
+    return asyncio.run(collect())
+
+
+def tool_calls(chunks):
+    """Merge the tool call deltas the way the chat loop does: {index: [id, name, arguments]}."""
+    calls = {}
+    for chunk in chunks:
+        for choice in chunk.choices:
+            for delta in choice.delta.tool_calls or ():
+                call = calls.setdefault(delta.index, [None, None, ""])
+                call[0] = delta.id or call[0]
+                call[1] = delta.function.name or call[1]
+                call[2] += delta.function.arguments or ""
+    return calls
+
+
+def test_text_deltas():
+    chunks = translate(TEXT_STREAM)
+
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices)
+    assert text == "Hello, how can I help?"
+    assert tool_calls(chunks) == {}
+
+
+def test_tool_use_with_input_json_delta():
+    chunks = translate(TOOL_STREAM)
+
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices)
+    assert text == "Let me look that up."
+    calls = tool_calls(chunks)
+    assert calls == {
+        0: ["toolu_01", "search_contacts", '{"query": "Anna"}'],
+        # A tool without input streams no JSON and still gets valid arguments
+        1: ["toolu_02", "list_events", "{}"],
+    }
+    assert json.loads(calls[0][2]) == {"query": "Anna"}
+
+
+def test_usage_has_the_output_tokens_of_message_delta():
+    chunks = translate(TOOL_STREAM)
+
+    usage_chunks = [chunk for chunk in chunks if chunk.usage is not None]
+    assert len(usage_chunks) == 1
+    assert usage_chunks[0].choices == []
+    assert usage_chunks[0].usage.input_tokens == 980
+    assert usage_chunks[0].usage.output_tokens == 61
+    # Sent after the finish reason, like OpenAI's include_usage chunk
+    assert chunks[-1] is usage_chunks[0]
+
+
+def test_stop_reason_becomes_finish_reason():
+    finish = [chunk.choices[0].finish_reason for chunk in translate(TEXT_STREAM) if chunk.choices]
+    assert finish[-1] == "stop"
+    assert finish[:-1] == [None] * (len(finish) - 1)
+
+    finish = [chunk.choices[0].finish_reason for chunk in translate(TOOL_STREAM) if chunk.choices]
+    assert finish[-1] == "tool_calls"
+
+
+def test_message_stop_ends_the_stream():
+    chunks = translate(TEXT_STREAM)
+
+    # message_stop (and ping) carry nothing, the finish and usage chunks of message_delta are the last ones
+    assert chunks[-2].choices[0].finish_reason == "stop"
+    assert chunks[-1].usage.output_tokens == 9
+    assert len(translate(TEXT_STREAM[:-1])) == len(chunks)
+
+
+def test_to_anthropic_messages_round_trips_tool_calls_and_results():
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "Find Anna and show my meetings"},
+        {"role": "assistant", "content": "Let me look that up.", "tool_calls": [
+            {"id": "toolu_01", "type": "function",
+             "function": {"name": "search_contacts", "arguments": '{"query": "Anna"}'}},
+            {"id": "toolu_02", "type": "function", "function": {"name": "list_events", "arguments": ""}},
+        ]},
+        {"role": "tool", "tool_call_id": "toolu_01", "name": "search_contacts", "content": '[{"name": "Anna"}]'},
+        {"role": "tool", "tool_call_id": "toolu_02", "name": "list_events", "content": "[]"},
+        {"role": "assistant", "content": "Anna is in your contacts and you have no meetings."},
+    ]
+
+    system, converted = to_anthropic_messages(messages)
+
+    assert system == [{"type": "text", "text": "You are a helpful assistant."}]
+    assert [message["role"] for message in converted] == ["user", "assistant", "user", "assistant"]
+    assert converted[1]["content"] == [
+        {"type": "text", "text": "Let me look that up."},
+        {"type": "tool_use", "id": "toolu_01", "name": "search_contacts", "input": {"query": "Anna"}},
+        {"type": "tool_use", "id": "toolu_02", "name": "list_events", "input": {}},
+    ]
+    # The results of one round are merged into a single user message
+    assert converted[2]["content"] == [
+        {"type": "tool_result", "tool_use_id": "toolu_01", "content": '[{"name": "Anna"}]'},
+        {"type": "tool_result", "tool_use_id": "toolu_02", "content": "[]"},
+    ]
+
+    # The recorded tool stream of that assistant turn yields the same calls back
+    calls = tool_calls(translate(TOOL_STREAM))
+    round_trip = [
+        {"type": "tool_use", "id": call_id, "name": name, "input": json.loads(arguments)}
+        for call_id, name, arguments in calls.values()
+    ]
+    assert round_trip == converted[1]["content"][1:]
+
+
+def test_to_anthropic_messages_without_tools_gives_tool_history_as_text():
+    messages = [
+        {"role": "user", "content": "Find Anna"},
+        {"role": "assistant", "content": None, "tool_calls": [
+            {"id": "toolu_01", "type": "function",
+             "function": {"name": "search_contacts", "arguments": '{"query": "Anna"}'}},
+        ]},
+        {"role": "tool", "tool_call_id": "toolu_01", "name": "search_contacts", "content": '[{"name": "Anna"}]'},
+    ]
+
+    _, converted = to_anthropic_messages(messages, tool_blocks=False)
+
+    blocks = [block for message in converted for block in message["content"]]
+    assert {block["type"] for block in blocks} == {"text"}
+    assert converted[1]["content"] == [{"type": "text", "text": '[Called tool search_contacts with {"query": "Anna"}]'}]
+    assert converted[2]["content"] == [{"type": "text", "text": '[Result of tool search_contacts]\n[{"name": "Anna"}]'}]
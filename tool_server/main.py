@@ -1,23 +1,51 @@
+import asyncio
 import os
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+
+import anyio
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel, ValidationError
 from typing import Any, Dict, Optional , List
 
-from .tools import addressbook, egw_calendar, infolog, knowledge, mail
+from .tools import addressbook, egw_calendar, infolog, knowledge, mail, session_pool
+from .tools.result_cache import result_cache
 # We still load env variables as fallback
 from dotenv import load_dotenv
 load_dotenv()
 
+EGROUPWARE_BASE_URL = os.getenv("EGROUPWARE_BASE_URL")
+
+# "async": tools with an async variant run on the event loop, the others on the tool worker threads
+# "thread": every tool runs on the tool worker threads
+TOOL_EXECUTION_MODE = os.getenv("TOOL_EXECUTION_MODE", "async").lower()
+# Threads for blocking tools (CardDAV/CalDAV sync), separate from FastAPI's default pool of 40
+TOOL_WORKER_THREADS = int(os.getenv("TOOL_WORKER_THREADS", "100"))
+# Concurrency limit per tool, e.g. "search_contacts=10,list_events=10"; others use TOOL_CONCURRENCY_DEFAULT (0 = unlimited)
+TOOL_CONCURRENCY_LIMITS = {
+    name.strip(): int(limit)
+    for name, _, limit in (item.partition("=") for item in os.getenv("TOOL_CONCURRENCY_LIMITS", "").split(",") if "=" in item)
+}
+TOOL_CONCURRENCY_DEFAULT = int(os.getenv("TOOL_CONCURRENCY_DEFAULT", "0"))
+# Seconds between checks whether the agent service still waits for a running tool
+TOOL_DISCONNECT_POLL_INTERVAL = float(os.getenv("TOOL_DISCONNECT_POLL_INTERVAL", "0.5"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the knowledge documents before the first request
+    await anyio.to_thread.run_sync(knowledge.knowledge_base.refresh)
+    yield
+    await session_pool.aclose()
+
+
 app = FastAPI(
     title="EGroupware Tool Server",
     description="An MCP-compliant server that exposes EGroupware tools.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 
-EGROUPWARE_BASE_URL = os.getenv("EGROUPWARE_BASE_URL")
-
-
 class AuthPayload(BaseModel):
     username: str
     password: str
@@ -39,7 +67,8 @@ class SearchContactsArgs(BaseModel):
 
 class GetAllContactsArgs(BaseModel):
     limit: Optional[int] = 50  # Default 50 contacts per page
-    offset: Optional[int] = 0  # Start from beginning
+    cursor: Optional[str] = None  # next_cursor of the previous page
+    offset: Optional[int] = 0  # Deprecated, use cursor
 
 
 class CreateEventArgs(BaseModel):
@@ -55,6 +84,7 @@ class CreateEventArgs(BaseModel):
 class ListEventsArgs(BaseModel):
     start_date: str
     end_date: str
+    time_zone: Optional[str] = None # IANA Time Zone of the user, default CALENDAR_TIME_ZONE
 
 
 class CreateTaskArgs(BaseModel):
@@ -78,26 +108,110 @@ class ListEmailsArgs(BaseModel):
     query: Optional[str] = None
     limit: Optional[int] = 10
 
+class GetCompanyInfoArgs(BaseModel):
+    query: Optional[str] = None  # Without a query the whole knowledge base is returned
+    top_k: Optional[int] = 3
+
 class ExecuteToolRequest(BaseModel):
     auth: AuthPayload
     args: Dict[str, Any]
 
 
+# tool name: (function, arguments model, async variant or None)
 tool_registry = {
-    "create_contact": (addressbook.create_contact, CreateContactArgs),
-    "search_contacts": (addressbook.search_contacts, SearchContactsArgs),
-    "get_all_contacts": (addressbook.get_all_contacts, GetAllContactsArgs),
-    "create_event": (egw_calendar.create_event, CreateEventArgs),
-    "list_events": (egw_calendar.list_events, ListEventsArgs),
-    "create_task": (infolog.create_task, CreateTaskArgs),
-    "list_tasks": (infolog.list_tasks, ListTasksArgs),
-    "send_email": (mail.send_email, SendEmailArgs),
-    "get_company_info": (knowledge.get_company_info, None),
+    "create_contact": (addressbook.create_contact, CreateContactArgs, addressbook.create_contact_async),
+    "search_contacts": (addressbook.search_contacts, SearchContactsArgs, None),
+    "get_all_contacts": (addressbook.get_all_contacts, GetAllContactsArgs, None),
+    "create_event": (egw_calendar.create_event, CreateEventArgs, egw_calendar.create_event_async),
+    "list_events": (egw_calendar.list_events, ListEventsArgs, None),
+    "create_task": (infolog.create_task, CreateTaskArgs, infolog.create_task_async),
+    "list_tasks": (infolog.list_tasks, ListTasksArgs, infolog.list_tasks_async),
+    "send_email": (mail.send_email, SendEmailArgs, mail.send_email_async),
+    "get_company_info": (knowledge.get_company_info, GetCompanyInfoArgs, None),
 }
 
 
+class ToolExecutor:
+    """
+    Runs tools for the /execute endpoint: async variants on the event loop, blocking
+    tools on a dedicated thread limiter, both bounded by per-tool concurrency limits.
+    """
+
+    def __init__(self):
+        self.limits: Dict[str, asyncio.Semaphore] = {}
+        self.thread_limiter: Optional[anyio.CapacityLimiter] = None
+        self.running: Dict[str, int] = {}
+        self.completed = 0
+        self.cancelled = 0
+
+    def _limit(self, tool_name: str) -> Optional[asyncio.Semaphore]:
+        limit = TOOL_CONCURRENCY_LIMITS.get(tool_name, TOOL_CONCURRENCY_DEFAULT)
+        if limit <= 0:
+            return None
+        if tool_name not in self.limits:
+            self.limits[tool_name] = asyncio.Semaphore(limit)
+        return self.limits[tool_name]
+
+    async def _call(self, tool_name: str, kwargs: dict):
+        tool_function, _, async_function = tool_registry[tool_name]
+        if async_function is not None and TOOL_EXECUTION_MODE == "async":
+            return await async_function(**kwargs)
+        if self.thread_limiter is None:
+            self.thread_limiter = anyio.CapacityLimiter(TOOL_WORKER_THREADS)
+        # A cancelled call gives up waiting, the blocking request finishes in the background
+        return await anyio.to_thread.run_sync(
+            lambda: tool_function(**kwargs), abandon_on_cancel=True, limiter=self.thread_limiter
+        )
+
+    async def run(self, tool_name: str, kwargs: dict):
+        limit = self._limit(tool_name)
+        self.running[tool_name] = self.running.get(tool_name, 0) + 1
+        try:
+            if limit is None:
+                result = await self._call(tool_name, kwargs)
+            else:
+                async with limit:
+                    result = await self._call(tool_name, kwargs)
+            self.completed += 1
+            return result
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.running[tool_name] -= 1
+
+    async def run_until_disconnected(self, http_request: Request, tool_name: str, kwargs: dict):
+        """Run the tool, cancelling it if the agent service disconnects before it finishes."""
+        task = asyncio.ensure_future(self.run(tool_name, kwargs))
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=TOOL_DISCONNECT_POLL_INTERVAL)
+                if done:
+                    return task.result()
+                if await http_request.is_disconnected():
+                    print(f"Client disconnected, cancelling tool '{tool_name}'")
+                    task.cancel()
+                    raise HTTPException(status_code=499, detail="Client disconnected.")
+        finally:
+            if not task.done():
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": TOOL_EXECUTION_MODE,
+            "running": {name: count for name, count in self.running.items() if count},
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "worker_threads_busy": self.thread_limiter.borrowed_tokens if self.thread_limiter else 0,
+            "worker_threads": TOOL_WORKER_THREADS,
+        }
+
+
+tool_executor = ToolExecutor()
+
+
 @app.post("/execute/{tool_name}")
-def execute_tool(tool_name: str, request: ExecuteToolRequest):
+async def execute_tool(tool_name: str, request: ExecuteToolRequest, http_request: Request):
     # Use the URL provided in the auth payload if available, otherwise fall back to env variable
     base_url = request.auth.egw_url if hasattr(request.auth, "egw_url") and request.auth.egw_url else EGROUPWARE_BASE_URL
 
@@ -107,7 +221,7 @@ def execute_tool(tool_name: str, request: ExecuteToolRequest):
     if tool_name not in tool_registry:
         raise HTTPException(status_code=404, detail=f"Tool '{tool_name}' not found.")
 
-    tool_function, args_model = tool_registry[tool_name]
+    _, args_model, _ = tool_registry[tool_name]
 
     try:
         if args_model:
@@ -121,10 +235,21 @@ def execute_tool(tool_name: str, request: ExecuteToolRequest):
     try:
         user_auth = (request.auth.username, request.auth.password)
         if tool_name == "get_company_info":
-            result = tool_function()
+            kwargs = args_dict
         else:
-            result = tool_function(base_url=base_url, auth=user_auth, **args_dict)
+            kwargs = dict(base_url=base_url, auth=user_auth, **args_dict)
+        cache_key = result_cache.make_key(base_url, user_auth, tool_name, args_dict)
+        generation = result_cache.generation(base_url, request.auth.username)
+        result = result_cache.get(cache_key) if cache_key else None
+        if result is None:
+            result = await tool_executor.run_until_disconnected(http_request, tool_name, kwargs)
+            if cache_key:
+                # Dropped if a write invalidated the user's results meanwhile
+                result_cache.put(cache_key, result, generation)
+        result_cache.invalidate(base_url, request.auth.username, tool_name)
         return {"result": result}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500,
                             detail=f"An unexpected error occurred executing tool '{tool_name}': {str(e)}")
@@ -132,4 +257,9 @@ def execute_tool(tool_name: str, request: ExecuteToolRequest):
 
 @app.get("/", summary="Health Check")
 def read_root():
-    return {"status": "EGroupware Tool Server is running", "available_tools": list(tool_registry.keys())}
\ No newline at end of file
+    return {"status": "EGroupware Tool Server is running", "available_tools": list(tool_registry.keys())}
+
+
+@app.get("/metrics", summary="Runtime Metrics")
+def read_metrics():
+    return {"tools": tool_executor.stats(), "result_cache": result_cache.stats(), "egw_http_pools": session_pool.stats()}
@@ -1,16 +1,11 @@
 from typing import Optional
 import requests
-import vobject
 import json
 
-def create_contact(base_url: str, auth: tuple, full_name: str, email: str,
-                   phone: Optional[str] = None, company: Optional[str] = None,
-                   address: Optional[str] = None, notes: Optional[str] = None):
-    """
-    CREATE CONTACT TOOL
-    Adds a new contact to the EGroupware address book.
-    """
-    url = f"{base_url}/addressbook/"
+from . import contact_index, session_pool
+
+def _contact_payload(full_name: str, email: str, phone: Optional[str] = None, company: Optional[str] = None,
+                     address: Optional[str] = None, notes: Optional[str] = None) -> dict:
     name_parts = full_name.split()
     first_name, last_name = (name_parts[0], " ".join(name_parts[1:])) if len(name_parts) > 1 else (full_name, "")
 
@@ -25,30 +20,56 @@ def create_contact(base_url: str, auth: tuple, full_name: str, email: str,
     if phone: payload["phones/tel_work"] = phone
     if address: payload["addresses/work/street"] = address
     if notes: payload["notes/note"] = notes
+    return payload
 
-    try:
-        response = requests.post(url, auth=auth, json=payload, headers={"Content-Type": "application/json"})
-        response.raise_for_status()
 
-        # Return a JSON object containing the status and the data that was just created.
-        return json.dumps({
-            "status": "success",
-            "message": "Contact created successfully.",
-            "contact_details": payload  # <-- Give the LLM the data to format!
-        })
-    except requests.exceptions.HTTPError as e:
-        error_details = e.response.text
+def _contact_created(base_url: str, auth: tuple, payload: dict, response) -> str:
+    """Tool result for the (requests or httpx) response of the create request."""
+    if response.status_code >= 400:
         return json.dumps({
             "status": "error",
-            "message": f"Failed to create contact. Server responded with status {e.response.status_code}.",
-            "details": error_details
+            "message": f"Failed to create contact. Server responded with status {response.status_code}.",
+            "details": response.text
         })
+    contact_index.mark_stale(base_url, auth[0])
+
+    # Return a JSON object containing the status and the data that was just created.
+    return json.dumps({
+        "status": "success",
+        "message": "Contact created successfully.",
+        "contact_details": payload  # <-- Give the LLM the data to format!
+    })
+
+
+def create_contact(base_url: str, auth: tuple, full_name: str, email: str,
+                   phone: Optional[str] = None, company: Optional[str] = None,
+                   address: Optional[str] = None, notes: Optional[str] = None):
+    """
+    CREATE CONTACT TOOL
+    Adds a new contact to the EGroupware address book.
+    """
+    payload = _contact_payload(full_name, email, phone, company, address, notes)
+    response = session_pool.post(f"{base_url}/addressbook/", auth=auth, json=payload,
+                                 headers={"Content-Type": "application/json"})
+    return _contact_created(base_url, auth, payload, response)
+
+
+async def create_contact_async(base_url: str, auth: tuple, full_name: str, email: str,
+                               phone: Optional[str] = None, company: Optional[str] = None,
+                               address: Optional[str] = None, notes: Optional[str] = None):
+    """Async variant of create_contact for the tool server's async execution path."""
+    payload = _contact_payload(full_name, email, phone, company, address, notes)
+    response = await session_pool.apost(f"{base_url}/addressbook/", auth=auth, json=payload,
+                                        headers={"Content-Type": "application/json"})
+    return _contact_created(base_url, auth, payload, response)
 
 
 def search_contacts(base_url: str, auth: tuple, query: str):
     """
-    Search contacts using CardDAV and filtering locally.
+    Search contacts using the local contact index.
     This function searches through ALL contacts, not just a paginated subset.
+    The index is synced incrementally with the CardDAV addressbook, so only
+    changed vCards are transferred and parsed.
 
     Args:
         base_url: Base URL of the EGroupware installation
@@ -58,85 +79,19 @@ def search_contacts(base_url: str, auth: tuple, query: str):
     Returns:
         JSON string with filtered contact results
     """
-    url = f"{base_url}/addressbook/"
-
-    # Use CardDAV PROPFIND to get ALL contacts for searching
-    propfind_body = '''<?xml version="1.0" encoding="UTF-8"?>
-<propfind xmlns="DAV:" xmlns:card="urn:ietf:params:xml:ns:carddav">
-    <prop>
-        <getetag/>
-        <card:address-data/>
-    </prop>
-</propfind>'''
-
-    headers = {
-        "Content-Type": "application/xml",
-        "Depth": "1"
-    }
-
     try:
-        # Make PROPFIND request to get ALL contacts for searching
-        response = requests.request("PROPFIND", url, auth=auth, headers=headers, data=propfind_body)
-        response.raise_for_status()
-
-        # Parse the XML response to extract vCard data
-        import xml.etree.ElementTree as ET
-        root = ET.fromstring(response.text)
-
-        all_contacts = []
-        namespaces = {
-            'dav': 'DAV:',
-            'card': 'urn:ietf:params:xml:ns:carddav'
-        }
-
-        for response_elem in root.findall('.//dav:response', namespaces):
-            # Look for address-data elements containing vCard
-            address_data_elems = response_elem.findall('.//card:address-data', namespaces)
-
-            for addr_data in address_data_elems:
-                if addr_data.text and addr_data.text.strip():
-                    try:
-                        vcard = vobject.readOne(addr_data.text)
-
-                        full_name = getattr(vcard, 'fn', None)
-                        email = getattr(vcard, 'email', None)
-                        phone = getattr(vcard, 'tel', None)
-                        org = getattr(vcard, 'org', None)
-                        address = getattr(vcard, 'adr', None)
-
-                        all_contacts.append({
-                            "name": full_name.value if full_name else "",
-                            "email": email.value if email else "",
-                            "phone": phone.value if phone else "",
-                            "organization": org.value[0] if org and hasattr(org, 'value') and len(org.value) > 0 else "",
-                            "address": f"{address.street}, {address.city}" if address and hasattr(address, 'street') and hasattr(address, 'city') else ""
-                        })
-                    except Exception as parse_error:
-                        continue
+        index = contact_index.get_index(base_url, auth[0])
+        index.refresh(auth)
 
         # Filter contacts based on query - search through ALL contacts
-        filtered_contacts = []
-        query_lower = query.lower()
-
-        for contact in all_contacts:
-            # Combine all searchable fields
-            searchable_text = " ".join(filter(None, [
-                contact.get("name", ""),
-                contact.get("email", ""),
-                contact.get("phone", ""),
-                contact.get("organization", ""),
-                contact.get("address", "")
-            ])).lower()
-
-            # Check if query matches any field
-            if query_lower in searchable_text:
-                filtered_contacts.append(contact)
+        filtered_contacts = index.search(query)
+        total_contacts = len(index)
 
         return json.dumps({
             "status": "success",
             "found": bool(filtered_contacts),
-            "message": f"Found {len(filtered_contacts)} contact(s) matching '{query}' (searched through {len(all_contacts)} total contacts)." if filtered_contacts else f"No contacts found matching '{query}' (searched through {len(all_contacts)} total contacts).",
-            "total_searched": len(all_contacts),
+            "message": f"Found {len(filtered_contacts)} contact(s) matching '{query}' (searched through {total_contacts} total contacts)." if filtered_contacts else f"No contacts found matching '{query}' (searched through {total_contacts} total contacts).",
+            "total_searched": total_contacts,
             "contacts": filtered_contacts
         })
 
@@ -156,89 +111,38 @@ def search_contacts(base_url: str, auth: tuple, query: str):
 
 
 
-def get_all_contacts(base_url: str, auth: tuple, limit: Optional[int] = 10, offset: Optional[int] = 0):
+def get_all_contacts(base_url: str, auth: tuple, limit: Optional[int] = 10, cursor: Optional[str] = None,
+                     offset: Optional[int] = 0):
     """
     GET ALL CONTACTS TOOL
-    Retrieves contacts from the EGroupware address book via CardDAV with pagination.
-
+    Retrieves contacts from the EGroupware address book ordered by name, with cursor based pagination.
+    Pages are served from the synced contact index; pass the returned next_cursor to get the next page.
+    The raw offset is only kept for backwards compatibility.
     """
     # Enforce reasonable limits
     limit = min(limit or 10, 15)  # Max 15 contacts per request
     offset = max(offset or 0, 0)   # No negative offsets
 
-    url = f"{base_url}/addressbook/"
-
-    # First, get the list of contact URLs using PROPFIND
-    propfind_body = '''<?xml version="1.0" encoding="UTF-8"?>
-<propfind xmlns="DAV:" xmlns:card="urn:ietf:params:xml:ns:carddav">
-    <prop>
-        <getetag/>
-        <card:address-data/>
-    </prop>
-</propfind>'''
-
-    headers = {
-        "Content-Type": "application/xml",
-        "Depth": "1"
-    }
-
     try:
-        # Make PROPFIND request to get all contacts
-        response = requests.request("PROPFIND", url, auth=auth, headers=headers, data=propfind_body)
-        response.raise_for_status()
-
-        # Parse the XML response to extract vCard data
-        import xml.etree.ElementTree as ET
-        root = ET.fromstring(response.text)
-
-        all_contacts = []
-        namespaces = {
-            'dav': 'DAV:',
-            'card': 'urn:ietf:params:xml:ns:carddav'
-        }
-
-        for response_elem in root.findall('.//dav:response', namespaces):
-            # Look for address-data elements containing vCard
-            address_data_elems = response_elem.findall('.//card:address-data', namespaces)
-
-            for addr_data in address_data_elems:
-                if addr_data.text and addr_data.text.strip():
-                    try:
-                        vcard = vobject.readOne(addr_data.text)
-
-                        full_name = getattr(vcard, 'fn', None)
-                        email = getattr(vcard, 'email', None)
-                        phone = getattr(vcard, 'tel', None)
-                        org = getattr(vcard, 'org', None)
-                        address = getattr(vcard, 'adr', None)
-
-                        all_contacts.append({
-                            "name": full_name.value if full_name else "",
-                            "email": email.value if email else "",
-                            "phone": phone.value if phone else "",
-                            "organization": org.value[0] if org and hasattr(org, 'value') and len(org.value) > 0 else "",
-                            "address": f"{address.street}, {address.city}" if address and hasattr(address, 'street') and hasattr(address, 'city') else ""
-                        })
-                    except Exception as parse_error:
-                        continue
-
-        # Apply pagination
-        total_contacts = len(all_contacts)
-        paginated_contacts = all_contacts[offset:offset + limit]
+        index = contact_index.get_index(base_url, auth[0])
+        index.refresh(auth)
 
-        # Calculate pagination info
-        has_more = offset + limit < total_contacts
-        next_offset = offset + limit if has_more else None
+        try:
+            paginated_contacts, next_cursor, total_contacts = index.page(limit, cursor=cursor, offset=offset)
+        except ValueError as e:
+            return json.dumps({
+                "status": "error",
+                "message": f"{str(e)}. Start again without a cursor."
+            })
 
         return json.dumps({
             "status": "success",
-            "message": f"Retrieved {len(paginated_contacts)} contact(s) from address book (page {offset//limit + 1}).",
+            "message": f"Retrieved {len(paginated_contacts)} contact(s) from address book.",
             "total_contacts": total_contacts,
             "returned_contacts": len(paginated_contacts),
-            "offset": offset,
             "limit": limit,
-            "has_more": has_more,
-            "next_offset": next_offset,
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor,
             "contacts": paginated_contacts
         })
 
@@ -0,0 +1,225 @@
+import os
+from datetime import datetime, time, timedelta, timezone, tzinfo
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import vobject
+from dateutil import tz
+
+from . import webdav
+from .webdav import SyncTokenInvalid  # noqa: F401 (raised by sync_collection)
+
+# CalDAV helpers used by the calendar tools and the event cache.
+
+# Number of hrefs requested per calendar-multiget REPORT
+MULTIGET_BATCH_SIZE = 200
+
+# IANA time zone of date ranges, floating times and all-day dates when the request names none
+CALENDAR_TIME_ZONE = os.getenv("CALENDAR_TIME_ZONE", "UTC")
+
+
+def get_time_zone(name: Optional[str] = None) -> tzinfo:
+    """The user's time zone (or CALENDAR_TIME_ZONE); ValueError for unknown names."""
+    zone = tz.gettz(name or CALENDAR_TIME_ZONE)
+    if zone is None:
+        raise ValueError(f"Unknown time zone '{name or CALENDAR_TIME_ZONE}'")
+    return zone
+
+
+def calendar_url(base_url: str) -> str:
+    return f"{base_url}/calendar/"
+
+
+def get_sync_token(base_url: str, auth: tuple) -> Optional[str]:
+    return webdav.get_sync_token(calendar_url(base_url), auth)
+
+
+def sync_collection(base_url: str, auth: tuple, sync_token: Optional[str]) -> Tuple[str, Dict[str, str], Set[str]]:
+    """Incremental sync of the calendar, see webdav.sync_collection."""
+    return webdav.sync_collection(calendar_url(base_url), auth, sync_token)
+
+
+def _utc(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def calendar_query(base_url: str, auth: tuple, start: datetime, end: datetime) -> Iterator[Tuple[str, str, str]]:
+    """
+    Fetch the calendar objects with at least one event instance in [start, end)
+    with a calendar-query REPORT, so the server does the range filtering
+    (including recurring events). Yields (href, etag, ical_text).
+    """
+    report_body = f'''<?xml version="1.0" encoding="UTF-8"?>
+<c:calendar-query xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+    <d:prop>
+        <d:getetag/>
+        <c:calendar-data/>
+    </d:prop>
+    <c:filter>
+        <c:comp-filter name="VCALENDAR">
+            <c:comp-filter name="VEVENT">
+                <c:time-range start="{_utc(start)}" end="{_utc(end)}"/>
+            </c:comp-filter>
+        </c:comp-filter>
+    </c:filter>
+</c:calendar-query>'''
+
+    response = webdav.stream_request("REPORT", calendar_url(base_url), auth, report_body)
+    with response:
+        response.raise_for_status()
+        for entry in webdav.iter_multistatus(response.raw):
+            if webdav.is_member_href(entry.href) and entry.data and entry.data.strip():
+                yield entry.href, entry.etag or "", entry.data
+
+
+def multiget(base_url: str, auth: tuple, hrefs: Iterable[str]) -> Iterator[Tuple[str, str, str]]:
+    """
+    Fetch the given calendar objects with calendar-multiget REPORTs in batches.
+    Yields (href, etag, ical_text) for every object the server returned.
+    """
+    hrefs = list(hrefs)
+    for start in range(0, len(hrefs), MULTIGET_BATCH_SIZE):
+        batch = hrefs[start:start + MULTIGET_BATCH_SIZE]
+        href_elems = "\n".join(f"    <d:href>{webdav.xml_escape(href)}</d:href>" for href in batch)
+        report_body = f'''<?xml version="1.0" encoding="UTF-8"?>
+<c:calendar-multiget xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+    <d:prop>
+        <d:getetag/>
+        <c:calendar-data/>
+    </d:prop>
+{href_elems}
+</c:calendar-multiget>'''
+
+        response = webdav.stream_request("REPORT", calendar_url(base_url), auth, report_body)
+        with response:
+            response.raise_for_status()
+            for entry in webdav.iter_multistatus(response.raw):
+                if webdav.is_member_href(entry.href) and entry.data and entry.data.strip():
+                    yield entry.href, entry.etag or "", entry.data
+
+
+def parse_calendar_object(ical_text: str) -> Optional[list]:
+    """Return the VEVENT components of a calendar object, None if it can't be parsed."""
+    try:
+        calendar = vobject.readOne(ical_text)
+    except Exception:
+        return None
+    return list(getattr(calendar, 'vevent_list', []))
+
+
+def _aware(value, zone: tzinfo) -> datetime:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=zone)
+    return datetime.combine(value, time.min, tzinfo=zone)
+
+
+def _local_start(value, zone: tzinfo) -> str:
+    # Same format as the JSCalendar start of the REST API: local date-time without offset
+    if not isinstance(value, datetime):
+        return f"{value.isoformat()}T00:00:00"
+    if value.tzinfo:
+        value = value.astimezone(zone).replace(tzinfo=None)
+    return value.replace(microsecond=0).isoformat()
+
+
+def _value(component, name: str, default=None):
+    prop = getattr(component, name, None)
+    return prop.value if prop is not None else default
+
+
+def _duration(vevent, zone: tzinfo) -> timedelta:
+    start = vevent.dtstart.value
+    end = _value(vevent, 'dtend')
+    if end is not None:
+        return _aware(end, zone) - _aware(start, zone)
+    duration = _value(vevent, 'duration')
+    if duration is not None:
+        return duration
+    # RFC 5545: all-day events without end last one day, timed events are instantaneous
+    return timedelta(days=1) if not isinstance(start, datetime) else timedelta(0)
+
+
+def _iso_duration(value: timedelta) -> str:
+    total = int(value.total_seconds())
+    days, rest = divmod(total, 86400)
+    hours, rest = divmod(rest, 3600)
+    minutes, seconds = divmod(rest, 60)
+    time_part = (f"{hours}H" if hours else "") + (f"{minutes}M" if minutes else "") + (f"{seconds}S" if seconds else "")
+    result = "P" + (f"{days}D" if days else "") + (f"T{time_part}" if time_part else "")
+    return result if result != "P" else "PT0S"
+
+
+def _overlaps(start: datetime, duration: timedelta, range_start: datetime, range_end: datetime) -> bool:
+    if start >= range_end:
+        return False
+    return start + duration > range_start or (not duration and start >= range_start)
+
+
+def _occurrence(vevent, start, duration: timedelta, recurring: bool, zone: tzinfo) -> dict:
+    location = _value(vevent, 'location')
+    status = _value(vevent, 'status')
+    priority = _value(vevent, 'priority')
+    return {
+        "uid": _value(vevent, 'uid'),
+        "title": _value(vevent, 'summary'),
+        "start": _local_start(start, zone),
+        "duration": _iso_duration(duration),
+        "description": _value(vevent, 'description'),
+        "location": location or None,
+        "status": status.lower() if status else None,
+        "priority": int(priority) if priority not in (None, "") else None,
+        "recurring": recurring
+    }
+
+
+def expand_occurrences(vevents: list, range_start: datetime, range_end: datetime,
+                       zone: tzinfo) -> List[Tuple[datetime, dict]]:
+    """
+    Expand the VEVENTs of one calendar object into the instances overlapping
+    [range_start, range_end). Recurrence rules, RDATE/EXDATE and overridden
+    instances (RECURRENCE-ID) are applied; floating times and all-day dates are
+    in the user's time zone. Returns (aware start, event) pairs.
+    """
+    master = None
+    overrides = {}
+    for vevent in vevents:
+        if not hasattr(vevent, 'dtstart'):
+            continue
+        recurrence_id = _value(vevent, 'recurrence_id')
+        if recurrence_id is not None:
+            overrides[_aware(recurrence_id, zone)] = vevent
+        elif master is None:
+            master = vevent
+
+    occurrences = []
+    if master is not None:
+        start = master.dtstart.value
+        duration = _duration(master, zone)
+        recurring = hasattr(master, 'rrule') or hasattr(master, 'rdate')
+        if recurring:
+            rules = master.getrruleset(addRDate=True)
+            lower, upper = range_start - duration, range_end
+            if not (isinstance(start, datetime) and start.tzinfo):
+                # Floating and all-day rules produce naive datetimes in the user's time zone
+                lower = lower.astimezone(zone).replace(tzinfo=None)
+                upper = upper.astimezone(zone).replace(tzinfo=None)
+            instances = rules.between(lower, upper, inc=True)
+        else:
+            instances = [start]
+
+        for instance in instances:
+            if isinstance(instance, datetime) and not isinstance(start, datetime):
+                instance = instance.date()
+            instance_start = _aware(instance, zone)
+            if instance_start in overrides:
+                continue
+            if _overlaps(instance_start, duration, range_start, range_end):
+                occurrences.append((instance_start, _occurrence(master, instance, duration, recurring, zone)))
+
+    for vevent in overrides.values():
+        if (_value(vevent, 'status') or "").upper() == "CANCELLED":
+            continue
+        start = vevent.dtstart.value
+        duration = _duration(vevent, zone)
+        if _overlaps(_aware(start, zone), duration, range_start, range_end):
+            occurrences.append((_aware(start, zone), _occurrence(vevent, start, duration, True, zone)))
+    return occurrences
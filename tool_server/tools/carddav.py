@@ -0,0 +1,130 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from . import webdav
+from .webdav import SyncTokenInvalid  # noqa: F401 (raised by sync_collection)
+
+# CardDAV helpers used by the addressbook tools and the contact index.
+
+# Number of hrefs requested per addressbook-multiget REPORT
+MULTIGET_BATCH_SIZE = 200
+
+
+def addressbook_url(base_url: str) -> str:
+    return f"{base_url}/addressbook/"
+
+
+def list_etags(base_url: str, auth: tuple) -> Dict[str, str]:
+    """List all cards of the addressbook as {href: etag} without fetching vCard data."""
+    return webdav.list_etags(addressbook_url(base_url), auth)
+
+
+def sync_collection(base_url: str, auth: tuple, sync_token: Optional[str]) -> Tuple[str, Dict[str, str], Set[str]]:
+    """Incremental sync of the addressbook, see webdav.sync_collection."""
+    return webdav.sync_collection(addressbook_url(base_url), auth, sync_token)
+
+
+def multiget(base_url: str, auth: tuple, hrefs: Iterable[str]) -> Iterator[Tuple[str, str, str]]:
+    """
+    Fetch the given cards with addressbook-multiget REPORTs in batches.
+    Yields (href, etag, vcard_text) for every card the server returned.
+    """
+    hrefs = list(hrefs)
+    for start in range(0, len(hrefs), MULTIGET_BATCH_SIZE):
+        batch = hrefs[start:start + MULTIGET_BATCH_SIZE]
+        href_elems = "\n".join(f"    <d:href>{webdav.xml_escape(href)}</d:href>" for href in batch)
+        report_body = f'''<?xml version="1.0" encoding="UTF-8"?>
+<card:addressbook-multiget xmlns:d="DAV:" xmlns:card="urn:ietf:params:xml:ns:carddav">
+    <d:prop>
+        <d:getetag/>
+        <card:address-data/>
+    </d:prop>
+{href_elems}
+</card:addressbook-multiget>'''
+
+        response = webdav.stream_request("REPORT", addressbook_url(base_url), auth, report_body)
+        with response:
+            response.raise_for_status()
+            for entry in webdav.iter_multistatus(response.raw):
+                if webdav.is_member_href(entry.href) and entry.data and entry.data.strip():
+                    yield entry.href, entry.etag or "", entry.data
+
+
+def _unfold_lines(vcard_text: str) -> Iterator[str]:
+    """Yield the logical lines of a vCard, joining folded continuation lines (RFC 6350 3.2)."""
+    current = None
+    for line in vcard_text.splitlines():
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def _split_value(value: str, separator: str = ";") -> List[str]:
+    """Split a structured value on unescaped separators and unescape the components."""
+    if "\\" not in value:
+        return value.split(separator)
+    parts, current, escaped = [], [], False
+    for char in value:
+        if escaped:
+            current.append("\n" if char in "nN" else char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == separator:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def parse_vcard_fields(vcard_text: str) -> Dict[str, str]:
+    """
+    Lightweight vCard reader for the properties the tools use (FN, EMAIL, TEL, ORG, ADR).
+    Returns the raw value of the first occurrence of each, keyed by property name.
+    """
+    wanted = {"FN", "EMAIL", "TEL", "ORG", "ADR"}
+    fields = {}
+    for line in _unfold_lines(vcard_text):
+        # The value starts at the first colon outside of a quoted parameter value
+        split_at = line.find(":")
+        if split_at < 0:
+            continue
+        if '"' in line[:split_at]:
+            in_quotes = False
+            for position, char in enumerate(line):
+                if char == '"':
+                    in_quotes = not in_quotes
+                elif char == ":" and not in_quotes:
+                    split_at = position
+                    break
+        name = line[:split_at].split(";", 1)[0].rsplit(".", 1)[-1].upper()
+        if name in wanted and name not in fields:
+            fields[name] = line[split_at + 1:]
+            if len(fields) == len(wanted):
+                break
+    return fields
+
+
+def parse_contact(vcard_text: str) -> Optional[dict]:
+    """Extract the contact fields used by the tools from a vCard, None if it can't be parsed."""
+    if "BEGIN:VCARD" not in vcard_text.upper():
+        return None
+    fields = parse_vcard_fields(vcard_text)
+
+    org = _split_value(fields.get("ORG", ""))
+    # ADR components: post office box; extended address; street; locality; region; postal code; country
+    adr = _split_value(fields.get("ADR", "")) + [""] * 7
+
+    return {
+        "name": _split_value(fields.get("FN", ""), separator="\0")[0],
+        "email": _split_value(fields.get("EMAIL", ""), separator="\0")[0],
+        "phone": _split_value(fields.get("TEL", ""), separator="\0")[0],
+        "organization": org[0],
+        "address": ", ".join(part for part in (adr[2], adr[3]) if part)
+    }
@@ -0,0 +1,174 @@
+import base64
+import bisect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import carddav, webdav
+
+# Minimum seconds between two syncs of the same index (0 = sync before every lookup)
+CONTACT_INDEX_SYNC_INTERVAL = float(os.getenv("CONTACT_INDEX_SYNC_INTERVAL", "5"))
+# Maximum number of (egw_url, user) indexes kept in memory
+CONTACT_INDEX_MAX_USERS = int(os.getenv("CONTACT_INDEX_MAX_USERS", "200"))
+
+SEARCH_FIELDS = ("name", "email", "phone", "organization", "address")
+
+
+class ContactIndex:
+    """
+    In-memory index of one user's CardDAV addressbook.
+
+    The index is kept fresh incrementally: a sync-collection REPORT (or, if the
+    server does not support it, an ETag-only PROPFIND diff) tells which cards
+    changed, and only those are re-fetched via addressbook-multiget and re-parsed.
+    """
+
+    def __init__(self, base_url: str, username: str):
+        self.base_url = base_url
+        self.username = username
+        self.lock = threading.Lock()
+        self.contacts: Dict[str, dict] = {}
+        self.etags: Dict[str, str] = {}
+        self.search_text: Dict[str, str] = {}
+        self.sync_token: Optional[str] = None
+        self.supports_sync = True
+        self.auth_digest: Optional[str] = None
+        self.last_sync = 0.0
+        # Bumped on every change, invalidates the cached sort order
+        self.version = 0
+        self._ordered: List[Tuple[str, str]] = []
+        self._ordered_version = -1
+
+    def refresh(self, auth: tuple, force: bool = False):
+        """Bring the index up to date; concurrent callers wait for a single sync."""
+        digest = webdav.credentials_digest(auth)
+        with self.lock:
+            # Different credentials always go to the server first, so they get validated
+            fresh = time.monotonic() - self.last_sync < CONTACT_INDEX_SYNC_INTERVAL
+            if not force and fresh and digest == self.auth_digest:
+                return
+
+            token, changed, removed = self._fetch_changes(auth)
+            for href in removed:
+                self._remove(href)
+
+            fetched = set()
+            for href, etag, vcard_text in carddav.multiget(self.base_url, auth, changed.keys()):
+                contact = carddav.parse_contact(vcard_text)
+                if contact is None:
+                    self._remove(href)
+                    continue
+                self.contacts[href] = contact
+                self.etags[href] = etag or changed.get(href, "")
+                self.search_text[href] = " ".join(filter(None, (contact.get(f, "") for f in SEARCH_FIELDS))).lower()
+                self.version += 1
+                fetched.add(href)
+            # Cards deleted between listing and multiget
+            for href in set(changed) - fetched:
+                self._remove(href)
+            # Only advance once the changes are applied, a failed multiget is retried from the old token
+            self.sync_token = token
+
+            self.auth_digest = digest
+            self.last_sync = time.monotonic()
+
+    def _fetch_changes(self, auth: tuple) -> Tuple[Optional[str], Dict[str, str], Set[str]]:
+        """Return (new sync token, {href: etag} of new or changed cards, removed hrefs) since the last sync."""
+        if self.supports_sync:
+            try:
+                token, listed, removed = carddav.sync_collection(self.base_url, auth, self.sync_token)
+            except carddav.SyncTokenInvalid:
+                if self.sync_token:
+                    # Token expired on the server: start over with a full sync-collection
+                    self.sync_token = None
+                    return self._fetch_changes(auth)
+                self.supports_sync = False
+            else:
+                if self.sync_token is None:
+                    # A full listing: everything we know but the server didn't list is gone
+                    removed = set(self.etags) - set(listed)
+                changed = {href: etag for href, etag in listed.items() if self.etags.get(href) != etag}
+                return token, changed, removed
+
+        listed = carddav.list_etags(self.base_url, auth)
+        changed = {href: etag for href, etag in listed.items() if self.etags.get(href) != etag}
+        return None, changed, set(self.etags) - set(listed)
+
+    def _remove(self, href: str):
+        if self.contacts.pop(href, None) is not None:
+            self.version += 1
+        self.etags.pop(href, None)
+        self.search_text.pop(href, None)
+
+    def mark_stale(self):
+        self.last_sync = 0.0
+
+    def search(self, query: str) -> List[dict]:
+        query_lower = query.lower()
+        return [self.contacts[href] for href, text in list(self.search_text.items()) if query_lower in text]
+
+    def ordered_keys(self) -> List[Tuple[str, str]]:
+        """Sort keys (lowercase name, href) of all cards, cached until the index changes."""
+        with self.lock:
+            if self._ordered_version != self.version:
+                self._ordered = sorted((contact["name"].lower(), href) for href, contact in self.contacts.items())
+                self._ordered_version = self.version
+            return self._ordered
+
+    def page(self, limit: int, cursor: Optional[str] = None, offset: int = 0) -> Tuple[List[dict], Optional[str], int]:
+        """
+        Return (contacts, next_cursor, total) for one page ordered by name.
+
+        The cursor encodes the sort key of the last returned card, so pages stay
+        consistent while cards are added or removed between requests.
+        """
+        keys = self.ordered_keys()
+        start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else min(offset, len(keys))
+        page_keys = keys[start:start + limit]
+        contacts = [self.contacts[href] for _, href in page_keys if href in self.contacts]
+        next_cursor = encode_cursor(page_keys[-1]) if page_keys and start + limit < len(keys) else None
+        return contacts, next_cursor, len(keys)
+
+    def __len__(self):
+        return len(self.contacts)
+
+
+def encode_cursor(key: Tuple[str, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        name, href = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(name), str(href)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid pagination cursor: {cursor}") from e
+
+
+_indexes: "OrderedDict[Tuple[str, str], ContactIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(base_url: str, username: str) -> ContactIndex:
+    """Return the contact index of (egw_url, user), evicting the least recently used one if needed."""
+    key = (base_url.rstrip('/'), username)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = ContactIndex(base_url, username)
+            while len(_indexes) > CONTACT_INDEX_MAX_USERS:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(key)
+        return index
+
+
+def mark_stale(base_url: str, username: str):
+    """Force the next lookup of this user's index to sync with the server."""
+    with _indexes_lock:
+        index = _indexes.get((base_url.rstrip('/'), username))
+    if index is not None:
+        index.mark_stale()
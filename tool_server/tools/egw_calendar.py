@@ -1,25 +1,14 @@
 
 import requests
 import json
+from datetime import datetime, timedelta
 from typing import Optional, List
 
+from . import caldav, event_cache, session_pool
 
-def create_event(
-        base_url: str,
-        auth: tuple,
-        title: str,
-        start_datetime: str,
-        duration_minutes: int = 60,
-        time_zone: str = "Europe/Berlin",
-        description: Optional[str] = None,
-        location: Optional[str] = None,
-        priority: int = 5
-):
-    """
-    Schedules a new event in the user's personal EGroupware calendar.
-    """
-    url = f"{base_url}/calendar/"
 
+def _event_payload(title: str, start_datetime: str, duration_minutes: int = 60, time_zone: str = "Europe/Berlin",
+                   description: Optional[str] = None, location: Optional[str] = None, priority: int = 5) -> dict:
     # --- Payload Construction (minimum required fields) ---
     payload = {
         "title": title,
@@ -41,80 +30,82 @@ def create_event(
                 "name": location
             }
         }
+    return payload
 
-    # --- API Call and Response Handling ---
-    try:
-        response = requests.post(
-            url,
-            auth=auth,
-            json=payload,
-            headers={
-                "Content-Type": "application/json",
-                "Prefer": "return=representation"
-            }
-        )
-        response.raise_for_status()
 
-        return json.dumps({
-            "status": "success",
-            "message": f"Event '{title}' created successfully at {start_datetime}."
-        })
+EVENT_HEADERS = {
+    "Content-Type": "application/json",
+    "Prefer": "return=representation"
+}
 
-    except requests.exceptions.HTTPError as e:
+
+def _event_created(base_url: str, auth: tuple, title: str, start_datetime: str, response) -> str:
+    """Tool result for the (requests or httpx) response of the create request."""
+    if response.status_code >= 400:
         return json.dumps({
             "status": "error",
-            "message": f"Failed to create event. API Error: {e.response.text}"
+            "message": f"Failed to create event. API Error: {response.text}"
         })
+    event_cache.mark_stale(base_url, auth[0])
+
+    return json.dumps({
+        "status": "success",
+        "message": f"Event '{title}' created successfully at {start_datetime}."
+    })
 
 
-def list_events(base_url: str, auth: tuple, start_date: str, end_date: str):
+def create_event(
+        base_url: str,
+        auth: tuple,
+        title: str,
+        start_datetime: str,
+        duration_minutes: int = 60,
+        time_zone: str = "Europe/Berlin",
+        description: Optional[str] = None,
+        location: Optional[str] = None,
+        priority: int = 5
+):
+    """
+    Schedules a new event in the user's personal EGroupware calendar.
     """
-    Retrieves and lists events from the calendar.
+    payload = _event_payload(title, start_datetime, duration_minutes, time_zone, description, location, priority)
+    response = session_pool.post(f"{base_url}/calendar/", auth=auth, json=payload, headers=EVENT_HEADERS)
+    return _event_created(base_url, auth, title, start_datetime, response)
+
+
+async def create_event_async(base_url: str, auth: tuple, title: str, start_datetime: str, duration_minutes: int = 60,
+                             time_zone: str = "Europe/Berlin", description: Optional[str] = None,
+                             location: Optional[str] = None, priority: int = 5):
+    """Async variant of create_event for the tool server's async execution path."""
+    payload = _event_payload(title, start_datetime, duration_minutes, time_zone, description, location, priority)
+    response = await session_pool.apost(f"{base_url}/calendar/", auth=auth, json=payload, headers=EVENT_HEADERS)
+    return _event_created(base_url, auth, title, start_datetime, response)
+
+
+def list_events(base_url: str, auth: tuple, start_date: str, end_date: str, time_zone: Optional[str] = None):
+    """
+    Retrieves and lists events between start_date and end_date (inclusive).
+    The date range is filtered by the server (CalDAV calendar-query) and recurring
+    events are expanded into their instances. Results come from a per-user event
+    cache that only fetches changes since the last query. Dates and the returned
+    start times are in time_zone (default CALENDAR_TIME_ZONE).
     """
-    url = f"{base_url}/calendar/"
+    try:
+        zone = caldav.get_time_zone(time_zone)
+    except ValueError as e:
+        return json.dumps({"status": "error", "message": str(e)})
+    try:
+        range_start = datetime.strptime(start_date[:10], "%Y-%m-%d").replace(tzinfo=zone)
+        range_end = datetime.strptime(end_date[:10], "%Y-%m-%d").replace(tzinfo=zone) + timedelta(days=1)
+    except ValueError:
+        return json.dumps({
+            "status": "error",
+            "message": f"Invalid date range '{start_date}' - '{end_date}', expected YYYY-MM-DD."
+        })
 
     try:
-        response = requests.get(
-            url,
-            auth=auth,
-            headers={"Accept": "application/json"}
-        )
-        response.raise_for_status()
-        data = response.json()
-
-        # Parse the responses structure as per EGroupware API
-        responses = data.get("responses", {})
-        if not responses:
-            return json.dumps([])
-
-        processed_events = []
-        for event_path, event_data in responses.items():
-            if event_data and isinstance(event_data, dict):
-                # Filter events by date range if needed
-                event_start = event_data.get("start", "")
-                if event_start:
-                    # Simple date filtering - extract date part
-                    event_date = event_start.split("T")[0] if "T" in event_start else event_start
-                    if start_date <= event_date <= end_date:
-                        # Extract location from locations object
-                        location_name = None
-                        locations = event_data.get("locations", {})
-                        if locations:
-                            first_location = next(iter(locations.values()), {})
-                            location_name = first_location.get("name")
-
-                        processed_events.append({
-                            "uid": event_data.get("uid"),
-                            "title": event_data.get("title"),
-                            "start": event_data.get("start"),
-                            "duration": event_data.get("duration"),
-                            "description": event_data.get("description"),
-                            "location": location_name,
-                            "status": event_data.get("status"),
-                            "priority": event_data.get("priority")
-                        })
-
-        return json.dumps(processed_events)
+        cache = event_cache.get_cache(base_url, auth[0])
+        return json.dumps(cache.query(auth, range_start, range_end, zone))
 
     except requests.exceptions.HTTPError as e:
         return json.dumps({
@@ -125,4 +116,4 @@ def list_events(base_url: str, auth: tuple, start_date: str, end_date: str):
         return json.dumps({
             "status": "error",
             "message": f"An unexpected error occurred: {str(e)}"
-        })
\ No newline at end of file
+        })
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, tzinfo
+from typing import Dict, List, Optional, Tuple
+
+from . import caldav, webdav
+
+# Minimum seconds between two delta syncs of the same cache (0 = sync before every query)
+EVENT_CACHE_SYNC_INTERVAL = float(os.getenv("EVENT_CACHE_SYNC_INTERVAL", "5"))
+# Maximum number of (egw_url, user) calendars kept in memory
+EVENT_CACHE_MAX_USERS = int(os.getenv("EVENT_CACHE_MAX_USERS", "200"))
+
+
+class EventCache:
+    """
+    Cache of one user's calendar objects for date range queries.
+
+    Ranges not yet covered are fetched with a server-side filtered calendar-query.
+    Afterwards the cache is kept fresh with sync-collection deltas keyed by the
+    collection's sync-token, so repeated range queries only transfer changed events.
+    If the server provides no sync-token, every query goes to the server.
+    """
+
+    def __init__(self, base_url: str, username: str):
+        self.base_url = base_url
+        self.username = username
+        self.lock = threading.Lock()
+        self.objects: Dict[str, Tuple[str, list]] = {}  # href -> (etag, VEVENT components)
+        self.covered: List[Tuple[datetime, datetime]] = []
+        self.sync_token: Optional[str] = None
+        self.supports_sync = True
+        self.auth_digest: Optional[str] = None
+        self.last_sync = 0.0
+
+    def query(self, auth: tuple, range_start: datetime, range_end: datetime, zone: tzinfo) -> List[dict]:
+        """Return the event instances overlapping [range_start, range_end), sorted by start, with times in zone."""
+        digest = webdav.credentials_digest(auth)
+        with self.lock:
+            if not self.supports_sync:
+                objects = [caldav.parse_calendar_object(ical) for _, _, ical in
+                           caldav.calendar_query(self.base_url, auth, range_start, range_end)]
+            else:
+                # Different credentials always go to the server first, so they get validated
+                fresh = time.monotonic() - self.last_sync < EVENT_CACHE_SYNC_INTERVAL
+                if self.sync_token and (not fresh or digest != self.auth_digest):
+                    self._apply_delta(auth)
+
+                if not self._is_covered(range_start, range_end):
+                    if self.sync_token is None:
+                        # Take the token before querying, changes in between arrive with the next delta
+                        self.sync_token = caldav.get_sync_token(self.base_url, auth)
+                    for href, etag, ical in caldav.calendar_query(self.base_url, auth, range_start, range_end):
+                        self._store(href, etag, ical)
+                    if self.sync_token:
+                        self._add_covered(range_start, range_end)
+                    else:
+                        self.supports_sync = False
+                        self.objects.clear()
+
+                self.auth_digest = digest
+                self.last_sync = time.monotonic()
+                objects = [vevents for _, vevents in self.objects.values()]
+
+        occurrences = []
+        for vevents in objects:
+            if vevents:
+                occurrences.extend(caldav.expand_occurrences(vevents, range_start, range_end, zone))
+        occurrences.sort(key=lambda occurrence: occurrence[0])
+        return [event for _, event in occurrences]
+
+    def _apply_delta(self, auth: tuple):
+        try:
+            token, changed, removed = caldav.sync_collection(self.base_url, auth, self.sync_token)
+        except caldav.SyncTokenInvalid:
+            # Token expired or sync unsupported: drop everything and query ranges again
+            self._reset()
+            return
+
+        for href in removed:
+            self.objects.pop(href, None)
+        changed = {href: etag for href, etag in changed.items() if self.objects.get(href, (None,))[0] != etag}
+        fetched = set()
+        for href, etag, ical in caldav.multiget(self.base_url, auth, changed.keys()):
+            self._store(href, etag or changed.get(href, ""), ical)
+            fetched.add(href)
+        for href in set(changed) - fetched:
+            self.objects.pop(href, None)
+        self.sync_token = token
+
+    def _store(self, href: str, etag: str, ical: str):
+        vevents = caldav.parse_calendar_object(ical)
+        if vevents:
+            self.objects[href] = (etag, vevents)
+        else:
+            self.objects.pop(href, None)
+
+    def _is_covered(self, start: datetime, end: datetime) -> bool:
+        return any(covered_start <= start and end <= covered_end for covered_start, covered_end in self.covered)
+
+    def _add_covered(self, start: datetime, end: datetime):
+        merged = []
+        for covered_start, covered_end in sorted(self.covered + [(start, end)]):
+            if merged and covered_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], covered_end))
+            else:
+                merged.append((covered_start, covered_end))
+        self.covered = merged
+
+    def _reset(self):
+        self.objects.clear()
+        self.covered = []
+        self.sync_token = None
+
+    def mark_stale(self):
+        self.last_sync = 0.0
+
+
+_caches: "OrderedDict[Tuple[str, str], EventCache]" = OrderedDict()
+_caches_lock = threading.Lock()
+
+
+def get_cache(base_url: str, username: str) -> EventCache:
+    """Return the event cache of (egw_url, user), evicting the least recently used one if needed."""
+    key = (base_url.rstrip('/'), username)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = EventCache(base_url, username)
+            while len(_caches) > EVENT_CACHE_MAX_USERS:
+                _caches.popitem(last=False)
+        else:
+            _caches.move_to_end(key)
+        return cache
+
+
+def mark_stale(base_url: str, username: str):
+    """Force the next query of this user's calendar to fetch the latest changes."""
+    with _caches_lock:
+        cache = _caches.get((base_url.rstrip('/'), username))
+    if cache is not None:
+        cache.mark_stale()
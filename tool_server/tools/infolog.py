@@ -1,8 +1,36 @@
-import requests
 import json
 from typing import Optional
 import re
 
+from . import session_pool
+
+
+def _tasks_from_response(response, limit: int) -> str:
+    """Tool result for the (requests or httpx) response of the InfoLog listing."""
+    if response.status_code >= 400:
+        return json.dumps({
+            "status": "error",
+            "message": f"API Error: {response.status_code} - {response.text}"
+        })
+    data = response.json()
+
+    # Extract items - EGroupware returns a 'responses' mapping similar to calendar
+    responses = data.get('responses', {}) if isinstance(data, dict) else {}
+    tasks = []
+    for _, t in responses.items():
+        if not t or not isinstance(t, dict):
+            continue
+        tasks.append({
+            'id': t.get('id') or t.get('uid'),
+            'title': t.get('title'),
+            'description': t.get('description'),
+            'due': t.get('due'),
+            'status': t.get('status')
+        })
+        if len(tasks) >= limit:
+            break
+    return json.dumps(tasks)
+
 
 def list_tasks(base_url: str, auth: tuple, status: Optional[str] = None, limit: int = 50):
     """
@@ -13,47 +41,26 @@ def list_tasks(base_url: str, auth: tuple, status: Optional[str] = None, limit:
         params = {}
         if status:
             params['status'] = status
-        response = requests.get(url, auth=auth, params=params, headers={"Accept": "application/json"})
-        response.raise_for_status()
-        data = response.json()
-
-        # Extract items - EGroupware returns a 'responses' mapping similar to calendar
-        responses = data.get('responses', {}) if isinstance(data, dict) else {}
-        tasks = []
-        for _, t in responses.items():
-            if not t or not isinstance(t, dict):
-                continue
-            tasks.append({
-                'id': t.get('id') or t.get('uid'),
-                'title': t.get('title'),
-                'description': t.get('description'),
-                'due': t.get('due'),
-                'status': t.get('status')
-            })
-            if len(tasks) >= limit:
-                break
-        return json.dumps(tasks)
-    except requests.exceptions.HTTPError as e:
-        return json.dumps({
-            "status": "error",
-            "message": f"API Error: {e.response.status_code} - {e.response.text}"
-        })
+        response = session_pool.get(url, auth=auth, params=params, headers={"Accept": "application/json"})
+        return _tasks_from_response(response, limit)
     except Exception as e:
         return json.dumps({"status": "error", "message": f"Unexpected error: {str(e)}"})
 
 
-def create_task(
-        base_url: str,
-        auth: tuple,
-        title: str,
-        due_date: Optional[str] = None,  # Expects YYYY-MM-DD format from the user
-        description: Optional[str] = None
-):
-    """
-    Creates a new task in the user's personal InfoLog using the EGroupware REST API.
-    """
+async def list_tasks_async(base_url: str, auth: tuple, status: Optional[str] = None, limit: int = 50):
+    """Async variant of list_tasks for the tool server's async execution path."""
     url = f"{base_url}/infolog/"
+    try:
+        params = {}
+        if status:
+            params['status'] = status
+        response = await session_pool.aget(url, auth=auth, params=params, headers={"Accept": "application/json"})
+        return _tasks_from_response(response, limit)
+    except Exception as e:
+        return json.dumps({"status": "error", "message": f"Unexpected error: {str(e)}"})
 
+
+def _task_payload(title: str, due_date: Optional[str] = None, description: Optional[str] = None) -> dict:
     # --- Construct the payload based STRICTLY on the REST API documentation ---
     payload = {
         "title": title,
@@ -68,26 +75,51 @@ def create_task(
         # The API expects a 'due' field with a date and time.
         # If the user only provides a date, we'll default to the end of that day.
         payload["due"] = f"{due_date} 23:59:59"
+    return payload
 
-    try:
-        response = requests.post(
-            url, auth=auth, json=payload, headers={"Content-Type": "application/json"}
-        )
-        response.raise_for_status()
 
-        # Construct a clear success message for the LLM
-        success_message = f"Task '{title}' was created successfully in your InfoLog."
-        if due_date:
-            success_message += f" It is due on {due_date}."
-
-        return json.dumps({
-            "status": "success",
-            "message": success_message,
-            "created_task_details": payload
-        })
-    except requests.exceptions.HTTPError as e:
-        error_text = e.response.text
+def _task_created(title: str, due_date: Optional[str], payload: dict, response) -> str:
+    """Tool result for the (requests or httpx) response of the create request."""
+    if response.status_code >= 400:
         return json.dumps({
             "status": "error",
-            "message": f"Failed to create the task. The server responded with an error: {error_text}"
-        })
\ No newline at end of file
+            "message": f"Failed to create the task. The server responded with an error: {response.text}"
+        })
+
+    # Construct a clear success message for the LLM
+    success_message = f"Task '{title}' was created successfully in your InfoLog."
+    if due_date:
+        success_message += f" It is due on {due_date}."
+
+    return json.dumps({
+        "status": "success",
+        "message": success_message,
+        "created_task_details": payload
+    })
+
+
+def create_task(
+        base_url: str,
+        auth: tuple,
+        title: str,
+        due_date: Optional[str] = None,  # Expects YYYY-MM-DD format from the user
+        description: Optional[str] = None
+):
+    """
+    Creates a new task in the user's personal InfoLog using the EGroupware REST API.
+    """
+    payload = _task_payload(title, due_date, description)
+    response = session_pool.post(
+        f"{base_url}/infolog/", auth=auth, json=payload, headers={"Content-Type": "application/json"}
+    )
+    return _task_created(title, due_date, payload, response)
+
+
+async def create_task_async(base_url: str, auth: tuple, title: str, due_date: Optional[str] = None,
+                            description: Optional[str] = None):
+    """Async variant of create_task for the tool server's async execution path."""
+    payload = _task_payload(title, due_date, description)
+    response = await session_pool.apost(
+        f"{base_url}/infolog/", auth=auth, json=payload, headers={"Content-Type": "application/json"}
+    )
+    return _task_created(title, due_date, payload, response)
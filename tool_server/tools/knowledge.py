@@ -1,42 +1,229 @@
-
 import os
 import json
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Directory with the knowledge documents (*.md, *.txt), loaded once and reloaded when a file changes
+KNOWLEDGE_DIR = os.getenv(
+    "KNOWLEDGE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), 'knowledge')
+)
+# Minimum seconds between two checks of the file modification times
+KNOWLEDGE_RELOAD_INTERVAL = float(os.getenv("KNOWLEDGE_RELOAD_INTERVAL", "2"))
+# Sections longer than this are split into several chunks at paragraph boundaries
+KNOWLEDGE_CHUNK_CHARS = int(os.getenv("KNOWLEDGE_CHUNK_CHARS", "1200"))
+
+KNOWLEDGE_EXTENSIONS = (".md", ".txt")
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*$")
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+class Chunk(NamedTuple):
+    source: str
+    section: str
+    content: str
+
+
+def split_sections(source: str, text: str) -> List[Chunk]:
+    """Split a markdown document into chunks per heading, each labelled with its heading path."""
+    chunks = []
+    path: List[str] = []
+    lines: List[str] = []
+
+    def flush():
+        body = "\n".join(lines).strip().strip("-").strip()
+        if body:
+            section = " > ".join(path) or source
+            paragraphs, current = body.split("\n\n"), ""
+            for paragraph in paragraphs:
+                if current and len(current) + len(paragraph) > KNOWLEDGE_CHUNK_CHARS:
+                    chunks.append(Chunk(source, section, current))
+                    current = ""
+                current = f"{current}\n\n{paragraph}" if current else paragraph
+            chunks.append(Chunk(source, section, current))
+        lines.clear()
+
+    for line in text.splitlines():
+        heading = _HEADING.match(line)
+        if heading:
+            flush()
+            level = len(heading.group(1))
+            path[level - 1:] = [heading.group(2)]
+        else:
+            lines.append(line)
+    flush()
+    return chunks
+
+
+class KnowledgeIndex(NamedTuple):
+    """One loaded version of the knowledge base; replaced as a whole, never changed."""
+    version: str
+    documents: Dict[str, str]
+    chunks: List[Chunk]
+    term_freqs: List[Counter]
+    lengths: List[int]
+    doc_freqs: Counter
+    avg_length: float
+
+
+EMPTY_INDEX = KnowledgeIndex("", {}, [], [], [], Counter(), 0.0)
+
+
+class KnowledgeBase:
+    """
+    The knowledge documents held in memory, split into sections with a BM25 index.
+
+    Files are read once; later calls only compare modification times (at most every
+    KNOWLEDGE_RELOAD_INTERVAL seconds) and reload the documents when one changed.
+    A reload swaps in a new KnowledgeIndex, so readers holding the old one stay consistent.
+    """
+
+    def __init__(self, directory: str = KNOWLEDGE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.index = EMPTY_INDEX
+        self._mtimes: Dict[str, float] = {}
+        self._last_check = 0.0
+
+    @property
+    def version(self) -> str:
+        return self.index.version
+
+    @property
+    def documents(self) -> Dict[str, str]:
+        return self.index.documents
+
+    @property
+    def chunks(self) -> List[Chunk]:
+        return self.index.chunks
+
+    def _scan(self) -> Dict[str, float]:
+        mtimes = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.lower().endswith(KNOWLEDGE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    mtimes[path] = os.stat(path).st_mtime_ns
+        return mtimes
+
+    def refresh(self, force: bool = False):
+        """Reload the documents if a file was added, changed or removed."""
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.version and now - self._last_check < KNOWLEDGE_RELOAD_INTERVAL:
+                return
+            self._last_check = now
+            mtimes = self._scan()
+            if not force and self.version and mtimes == self._mtimes:
+                return
+            self._load(mtimes)
+
+    def _load(self, mtimes: Dict[str, float]):
+        documents, chunks = {}, []
+        digest = hashlib.sha256()
+        for path in sorted(mtimes):
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            source = os.path.relpath(path, self.directory)
+            documents[source] = text
+            chunks.extend(split_sections(source, text))
+            digest.update(source.encode("utf-8") + b"\0" + text.encode("utf-8") + b"\0")
+
+        term_freqs = [Counter(tokenize(f"{chunk.section}\n{chunk.content}")) for chunk in chunks]
+        lengths = [sum(freqs.values()) for freqs in term_freqs]
+        doc_freqs = Counter(term for freqs in term_freqs for term in freqs)
+
+        avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+        # A single assignment: searches running meanwhile keep reading the previous index
+        self.index = KnowledgeIndex(digest.hexdigest()[:16], documents, chunks, term_freqs, lengths, doc_freqs, avg_length)
+        self._mtimes = mtimes
 
+    def search(self, query: str, top_k: int = 3,
+               index: Optional[KnowledgeIndex] = None) -> List[Tuple[float, Chunk]]:
+        """Return the top_k chunks by BM25 score for the query, best first."""
+        index = index or self.index
+        terms = set(tokenize(query))
+        total = len(index.chunks)
+        scored = []
+        for position, freqs in enumerate(index.term_freqs):
+            score = 0.0
+            for term in terms:
+                frequency = freqs.get(term)
+                if not frequency:
+                    continue
+                idf = math.log(1 + (total - index.doc_freqs[term] + 0.5) / (index.doc_freqs[term] + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * index.lengths[position] / (index.avg_length or 1))
+                score += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+            if score > 0:
+                scored.append((score, index.chunks[position]))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return scored[:top_k]
 
-def get_company_info():
+    def full_text(self, index: Optional[KnowledgeIndex] = None) -> str:
+        return "\n\n".join((index or self.index).documents.values())
+
+
+knowledge_base = KnowledgeBase()
+
+
+def get_company_info(query: Optional[str] = None, top_k: Optional[int] = 3):
     """
-    Fetches the company's knowledge base by reading a local markdown file.
+    Fetches the company's knowledge base.
     Use this to answer any questions about the company, its products, policies, history,
-    contact information, or recent news.
+    contact information, or recent news. With a query, only the most relevant sections
+    are returned (BM25 ranking over all knowledge documents); without, the whole knowledge base.
     """
     try:
-        # This path is constructed relative to the current file's location,
-        # making it robust and independent of where the server is run from.
-        # __file__ -> /.../tool_server/tools/knowledge.py
-        # os.path.dirname(__file__) -> /.../tool_server/tools
-        # os.path.dirname(...) -> /.../tool_server
-        # os.path.join(...) -> /.../tool_server/knowledge/company_info.md
-        knowledge_file_path = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)), 'knowledge', 'company_info.md'
-        )
-
-        with open(knowledge_file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        # Return the content in a structured JSON format, consistent with other tools.
+        knowledge_base.refresh()
+        # One index for the whole answer, a concurrent reload doesn't mix versions
+        index = knowledge_base.index
+        if not index.documents:
+            return json.dumps({
+                "status": "error",
+                "message": "No knowledge documents could be found on the server."
+            })
+
+        if not query or not query.strip():
+            # Return the content in a structured JSON format, consistent with other tools.
+            return json.dumps({
+                "status": "success",
+                "message": "Company knowledge base retrieved successfully.",
+                "version": index.version,
+                "content": knowledge_base.full_text(index)
+            })
+
+        top_k = min(max(top_k or 3, 1), 10)
+        results = knowledge_base.search(query, top_k, index)
+        if not results:
+            return json.dumps({
+                "status": "success",
+                "message": f"No sections match '{query}'. Try other words; these sections exist.",
+                "version": index.version,
+                "sections": sorted({chunk.section for chunk in index.chunks})
+            })
         return json.dumps({
             "status": "success",
-            "message": "Company knowledge base retrieved successfully.",
-            "content": content
-        })
-    except FileNotFoundError:
-        return json.dumps({
-            "status": "error",
-            "message": "The company knowledge file (company_info.md) could not be found on the server."
+            "message": f"Found {len(results)} relevant section(s) for '{query}'.",
+            "version": index.version,
+            "results": [
+                {"source": chunk.source, "section": chunk.section, "score": round(score, 2), "content": chunk.content}
+                for score, chunk in results
+            ]
         })
     except Exception as e:
         return json.dumps({
             "status": "error",
-            "message": f"An unexpected error occurred while reading the knowledge file: {str(e)}"
+            "message": f"An unexpected error occurred while reading the knowledge base: {str(e)}"
         })
-
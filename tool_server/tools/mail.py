@@ -1,23 +1,12 @@
-import requests
 import json
 from typing import Optional, List
 from datetime import datetime
 
+from . import session_pool
 
-def send_email(
-        base_url: str,
-        auth: tuple,
-        to: List[str],
-        subject: str,
-        body: Optional[str] = None,
-        cc: Optional[List[str]] = None,
-        bcc: Optional[List[str]] = None
-):
-    """
-    Sends an email using the EGroupware REST API.
-    """
-    url = f"{base_url}/mail/"
 
+def _email_payload(to: List[str], subject: str, body: Optional[str] = None,
+                   cc: Optional[List[str]] = None, bcc: Optional[List[str]] = None) -> dict:
     # --- Construct the payload based on the POST documentation ---
     payload = {
         "to": to,
@@ -31,19 +20,47 @@ def send_email(
         payload["cc"] = cc
     if bcc:
         payload["bcc"] = bcc
+    return payload
 
-    try:
-        response = requests.post(url, auth=auth, json=payload, headers={"Content-Type": "application/json"})
-        response.raise_for_status()
-
-        success_message = f"Email with subject '{subject}' was sent successfully to {', '.join(to)}."
 
-        return json.dumps({
-            "status": "success",
-            "message": success_message,
-        })
-    except requests.exceptions.HTTPError as e:
+def _email_sent(to: List[str], subject: str, response) -> str:
+    """Tool result for the (requests or httpx) response of the send request."""
+    if response.status_code >= 400:
         return json.dumps({
             "status": "error",
-            "message": f"Failed to send email. API Error: {e.response.text}"
-        })
\ No newline at end of file
+            "message": f"Failed to send email. API Error: {response.text}"
+        })
+
+    success_message = f"Email with subject '{subject}' was sent successfully to {', '.join(to)}."
+
+    return json.dumps({
+        "status": "success",
+        "message": success_message,
+    })
+
+
+def send_email(
+        base_url: str,
+        auth: tuple,
+        to: List[str],
+        subject: str,
+        body: Optional[str] = None,
+        cc: Optional[List[str]] = None,
+        bcc: Optional[List[str]] = None
+):
+    """
+    Sends an email using the EGroupware REST API.
+    """
+    payload = _email_payload(to, subject, body, cc, bcc)
+    response = session_pool.post(f"{base_url}/mail/", auth=auth, json=payload,
+                                 headers={"Content-Type": "application/json"})
+    return _email_sent(to, subject, response)
+
+
+async def send_email_async(base_url: str, auth: tuple, to: List[str], subject: str, body: Optional[str] = None,
+                           cc: Optional[List[str]] = None, bcc: Optional[List[str]] = None):
+    """Async variant of send_email for the tool server's async execution path."""
+    payload = _email_payload(to, subject, body, cc, bcc)
+    response = await session_pool.apost(f"{base_url}/mail/", auth=auth, json=payload,
+                                        headers={"Content-Type": "application/json"})
+    return _email_sent(to, subject, response)
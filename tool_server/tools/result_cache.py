@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from . import webdav
+
+# Short-lived cache of read-only tool results, shared by the chat, dashboard and suggestions.
+
+# Seconds a result of each read tool is served from the cache (0 = not cached)
+DEFAULT_TTLS = {
+    "list_events": 30,
+    "list_tasks": 30,
+    "get_all_contacts": 60,
+    "search_contacts": 60,
+    "get_company_info": 300,
+}
+# Read tools whose results a write tool changes
+INVALIDATES = {
+    "create_event": ("list_events",),
+    "create_task": ("list_tasks",),
+    "create_contact": ("get_all_contacts", "search_contacts"),
+}
+
+# Override TTLs per tool, e.g. "list_events=10,get_company_info=600"
+TOOL_CACHE_TTLS = {
+    **DEFAULT_TTLS,
+    **{
+        name.strip(): float(ttl)
+        for name, _, ttl in (item.partition("=") for item in os.getenv("TOOL_CACHE_TTLS", "").split(",") if "=" in item)
+    },
+}
+# Memory cap of all cached results together
+TOOL_CACHE_MAX_BYTES = int(os.getenv("TOOL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+CacheKey = Tuple[str, str, str, str, str]
+
+
+class ResultCache:
+    """
+    LRU cache of tool results keyed by (egw_url, user, credentials, tool, normalized args).
+
+    Every invalidation bumps the user's generation; a read result is only stored if no
+    write invalidated the user's results while the read ran, so it can't bring back stale data.
+    """
+
+    def __init__(self, max_bytes: int = TOOL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self._entries: "OrderedDict[CacheKey, Tuple[str, int, float]]" = OrderedDict()
+        # (egw_url, user) -> number of invalidations, users without writes are not listed
+        self._generations: Dict[Tuple[str, str], int] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    @staticmethod
+    def make_key(base_url: str, auth: tuple, tool_name: str, args: Dict[str, Any]) -> Optional[CacheKey]:
+        """Cache key of a read tool call, None if the tool's results are not cached."""
+        if not TOOL_CACHE_TTLS.get(tool_name):
+            return None
+        # The credentials are part of the key, a wrong password never gets a cached result
+        return (base_url.rstrip("/"), auth[0], webdav.credentials_digest(auth), tool_name,
+                json.dumps(args, sort_keys=True, default=str))
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def generation(self, base_url: str, username: str) -> int:
+        """Taken before a read starts and passed to put() with its result."""
+        return self._generations.get((base_url.rstrip("/"), username), 0)
+
+    def put(self, key: CacheKey, result: str, generation: Optional[int] = None):
+        # Errors are not cached, the next call should try again
+        if not isinstance(result, str) or result.startswith('{"status": "error"'):
+            return
+        size = len(result.encode("utf-8"))
+        if size > self.max_bytes // 4:
+            return
+        with self.lock:
+            if generation is not None and generation != self._generations.get((key[0], key[1]), 0):
+                # A write invalidated the user's results while this read ran
+                self.stale_puts += 1
+                return
+            self._remove(key)
+            self._entries[key] = (result, size, time.monotonic() + TOOL_CACHE_TTLS[key[3]])
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: CacheKey):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def invalidate(self, base_url: str, username: str, tool_name: str):
+        """Drop the cached results of the user's read tools that the write tool tool_name changes."""
+        affected = INVALIDATES.get(tool_name)
+        if not affected:
+            return
+        base_url = base_url.rstrip("/")
+        with self.lock:
+            self._generations[(base_url, username)] = self._generations.get((base_url, username), 0) + 1
+            for key in [key for key in self._entries if key[0] == base_url and key[1] == username and key[3] in affected]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0,
+            "invalidations": self.invalidations,
+            "stale_puts": self.stale_puts,
+        }
+
+
+result_cache = ResultCache()
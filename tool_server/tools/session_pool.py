@@ -0,0 +1,355 @@
+import asyncio
+import itertools
+import os
+import threading
+import weakref
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, Dict, Set
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared, keep-alive HTTP sessions for all requests to EGroupware, one per host.
+
+# Maximum connections to one EGroupware host (sync and async pools each), further requests wait for a free one
+EGW_POOL_MAXSIZE = int(os.getenv("EGW_POOL_MAXSIZE", "20"))
+# Seconds a request waits for a free connection before it fails
+EGW_POOL_TIMEOUT = float(os.getenv("EGW_POOL_TIMEOUT", "30"))
+# Maximum number of distinct hosts with a pooled session
+EGW_POOL_MAX_HOSTS = int(os.getenv("EGW_POOL_MAX_HOSTS", "50"))
+EGW_CONNECT_TIMEOUT = float(os.getenv("EGW_CONNECT_TIMEOUT", "5"))
+EGW_READ_TIMEOUT = float(os.getenv("EGW_READ_TIMEOUT", "60"))
+# Retries (with exponential backoff) for connection errors and idempotent reads
+EGW_RETRIES = int(os.getenv("EGW_RETRIES", "2"))
+EGW_RETRY_BACKOFF = float(os.getenv("EGW_RETRY_BACKOFF", "0.3"))
+
+# Keep-alive connections per async client, a host gets EGW_POOL_MAXSIZE / ASYNC_CLIENT_CONNECTIONS clients
+ASYNC_CLIENT_CONNECTIONS = 20
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PROPFIND", "REPORT"})
+RETRY_STATUS = (502, 503, 504)
+
+
+class PoolTimeout(requests.exceptions.ConnectionError):
+    """No connection to the host became free within EGW_POOL_TIMEOUT."""
+
+
+class _HostPool:
+    """Session and request counters of one EGroupware host."""
+
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.pool_timeouts = 0
+        # Requests between _get_pool() and release(); an evicted pool is closed once they are done
+        self.in_flight = 0
+        self.evicted = False
+        # One slot per connection in use, held until the response (or its streamed body) is closed
+        self.slots = threading.BoundedSemaphore(EGW_POOL_MAXSIZE)
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.session = self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        host_pool = self
+
+        class CountingRetry(Retry):
+            def increment(self, *args, **kwargs):
+                with host_pool.lock:
+                    host_pool.retries += 1
+                return super().increment(*args, **kwargs)
+
+        retry = CountingRetry(
+            total=EGW_RETRIES,
+            connect=EGW_RETRIES,
+            read=EGW_RETRIES,
+            status=EGW_RETRIES,
+            backoff_factor=EGW_RETRY_BACKOFF,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False,
+        )
+        # pool_block: never more than EGW_POOL_MAXSIZE connections, the slots make sure nobody waits here
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=EGW_POOL_MAXSIZE, pool_block=True, max_retries=retry)
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        # The session is shared by all users of the host: never keep cookies between requests
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        return session
+
+    def acquire(self) -> bool:
+        """Wait for a free connection slot; False after EGW_POOL_TIMEOUT."""
+        if not self.slots.acquire(timeout=EGW_POOL_TIMEOUT):
+            with self.lock:
+                self.pool_timeouts += 1
+            return False
+        with self.lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return True
+
+    def release(self, slot: bool = True):
+        """The request is done (its connection returned if it held a slot)."""
+        if slot:
+            self.slots.release()
+        with self.lock:
+            self.in_use -= slot
+            self.in_flight -= 1
+            close = self.evicted and not self.in_flight
+        if close:
+            self.session.close()
+
+    def evict(self):
+        with self.lock:
+            self.evicted = True
+            close = not self.in_flight
+        if close:
+            self.session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "connections_in_use": self.in_use,
+                "peak_connections_in_use": self.peak_in_use,
+                "pool_timeouts": self.pool_timeouts,
+                "pool_maxsize": EGW_POOL_MAXSIZE,
+            }
+
+
+_pools: Dict[str, _HostPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _get_pool(url: str) -> _HostPool:
+    """The pool of the URL's host with the request counted as in flight; finish with pool.release()."""
+    origin = _origin(url)
+    with _pools_lock:
+        pool = _pools.get(origin)
+        if pool is None:
+            if len(_pools) >= EGW_POOL_MAX_HOSTS:
+                # Drop the oldest host; its session is closed once its requests in flight are done
+                _pools.pop(next(iter(_pools))).evict()
+            pool = _pools[origin] = _HostPool(origin)
+        with pool.lock:
+            pool.in_flight += 1
+            pool.requests += 1
+        return pool
+
+
+def _release_on_close(response: requests.Response, pool: _HostPool):
+    """A streamed body keeps its connection until the response is closed (or garbage collected)."""
+    released = threading.Lock()
+
+    def release():
+        if released.acquire(blocking=False):
+            pool.release()
+
+    close = response.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            release()
+
+    response.close = close_and_release
+    weakref.finalize(response, release)
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Drop-in replacement for requests.request that uses the shared session of the
+    URL's host and applies the configured connect/read timeouts by default.
+    At most EGW_POOL_MAXSIZE requests per host run at once, others wait up to EGW_POOL_TIMEOUT.
+    """
+    kwargs.setdefault("timeout", (EGW_CONNECT_TIMEOUT, EGW_READ_TIMEOUT))
+    pool = _get_pool(url)
+    if not pool.acquire():
+        pool.release(slot=False)
+        raise PoolTimeout(f"No free connection to {pool.origin} within {EGW_POOL_TIMEOUT} seconds")
+    try:
+        response = pool.session.request(method, url, **kwargs)
+    except BaseException as e:
+        if isinstance(e, requests.exceptions.RequestException):
+            with pool.lock:
+                pool.errors += 1
+        pool.release()
+        raise
+    if kwargs.get("stream"):
+        _release_on_close(response, pool)
+    else:
+        pool.release()
+    return response
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+class _NoCookies(httpx.Cookies):
+    """Cookie store that never keeps anything, the async client is shared by all users as well."""
+
+    def __init__(self):
+        super().__init__()
+        self.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+
+class _AsyncHostPool:
+    """httpx.AsyncClients and request counters of one EGroupware host, used by the async tools."""
+
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        # Requests using the clients right now; an evicted pool is closed once they are done
+        self.in_flight = 0
+        self.evicted = False
+        # httpcore scans all connections of a pool for every request, which gets slow
+        # with hundreds of them: spread the connections over several small clients,
+        # which together have at most EGW_POOL_MAXSIZE
+        count = max(1, -(-EGW_POOL_MAXSIZE // ASYNC_CLIENT_CONNECTIONS))
+        self.clients = [self._create_client(max(1, EGW_POOL_MAXSIZE // count + (index < EGW_POOL_MAXSIZE % count)))
+                        for index in range(count)]
+        self._next_client = itertools.cycle(self.clients)
+
+    @staticmethod
+    def _create_client(connections: int) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            # Connection errors are retried by the transport, status retries are done in arequest()
+            transport=httpx.AsyncHTTPTransport(
+                retries=EGW_RETRIES,
+                # Like the sync pools: requests beyond the limit wait up to EGW_POOL_TIMEOUT for a connection
+                limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+            ),
+            timeout=httpx.Timeout(EGW_READ_TIMEOUT, connect=EGW_CONNECT_TIMEOUT, pool=EGW_POOL_TIMEOUT),
+            cookies=_NoCookies(),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return next(self._next_client)
+
+    def evict(self):
+        self.evicted = True
+        if not self.in_flight:
+            _close_later(self)
+
+    def release(self):
+        self.in_flight -= 1
+        if self.evicted and not self.in_flight:
+            _close_later(self)
+
+    async def aclose(self):
+        _evicted_pools.discard(self)
+        for client in self.clients:
+            await client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "in_flight": self.in_flight,
+            "clients": len(self.clients),
+            "pool_maxsize": EGW_POOL_MAXSIZE,
+        }
+
+
+_async_pools: Dict[str, _AsyncHostPool] = {}
+# Pools dropped from _async_pools that still have requests in flight, closed by their last request or on shutdown
+_evicted_pools: Set[_AsyncHostPool] = set()
+_closing: Set[asyncio.Task] = set()
+
+
+def _close_later(pool: _AsyncHostPool):
+    task = asyncio.get_running_loop().create_task(pool.aclose())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+def _get_async_pool(url: str) -> _AsyncHostPool:
+    origin = _origin(url)
+    pool = _async_pools.get(origin)
+    if pool is None:
+        if len(_async_pools) >= EGW_POOL_MAX_HOSTS:
+            # Drop the oldest host; its clients are closed once its requests in flight are done
+            oldest = _async_pools.pop(next(iter(_async_pools)))
+            _evicted_pools.add(oldest)
+            oldest.evict()
+        pool = _async_pools[origin] = _AsyncHostPool(origin)
+    return pool
+
+
+async def arequest(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Async counterpart of request() on a shared httpx.AsyncClient per host.
+    Idempotent methods are retried with backoff on 502/503/504, like the sync sessions.
+    """
+    pool = _get_async_pool(url)
+    pool.requests += 1
+    pool.in_flight += 1
+    attempt = 0
+    try:
+        while True:
+            try:
+                response = await pool.client.request(method, url, **kwargs)
+            except httpx.HTTPError:
+                pool.errors += 1
+                raise
+            if response.status_code not in RETRY_STATUS or method.upper() not in IDEMPOTENT_METHODS \
+                    or attempt >= EGW_RETRIES:
+                return response
+            await response.aclose()
+            await asyncio.sleep(EGW_RETRY_BACKOFF * (2 ** attempt))
+            attempt += 1
+            pool.retries += 1
+    finally:
+        pool.release()
+
+
+async def aget(url: str, **kwargs) -> httpx.Response:
+    return await arequest("GET", url, **kwargs)
+
+
+async def apost(url: str, **kwargs) -> httpx.Response:
+    return await arequest("POST", url, **kwargs)
+
+
+async def aclose():
+    """Close the async clients, called on shutdown of the tool server."""
+    while _async_pools:
+        await _async_pools.popitem()[1].aclose()
+    while _evicted_pools:
+        await _evicted_pools.pop().aclose()
+    await asyncio.gather(*_closing, return_exceptions=True)
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """Per-host pool statistics for the metrics endpoint."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    result = {pool.origin: pool.stats() for pool in pools}
+    for origin, pool in list(_async_pools.items()):
+        result.setdefault(origin, {})["async"] = pool.stats()
+    return result
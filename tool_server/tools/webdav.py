@@ -0,0 +1,192 @@
+import hashlib
+import secrets
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, Dict, Iterator, NamedTuple, Optional, Set, Tuple
+
+import requests
+
+from . import session_pool
+
+# Generic WebDAV helpers shared by the CardDAV and CalDAV tools.
+# Multistatus bodies are parsed incrementally from the response stream, so peak
+# memory does not grow with the size of the collection.
+
+DAV_NS = "DAV:"
+CARDDAV_NS = "urn:ietf:params:xml:ns:carddav"
+CALDAV_NS = "urn:ietf:params:xml:ns:caldav"
+NAMESPACES = {
+    'dav': DAV_NS,
+    'card': CARDDAV_NS,
+    'cal': CALDAV_NS
+}
+
+# Status codes with which servers reject a sync-token or the sync-collection report itself
+SYNC_UNSUPPORTED_STATUS = (400, 403, 409, 412, 415, 501)
+
+_RESPONSE_TAG = f"{{{DAV_NS}}}response"
+_HREF_TAG = f"{{{DAV_NS}}}href"
+_STATUS_TAG = f"{{{DAV_NS}}}status"
+_PROPSTAT_TAG = f"{{{DAV_NS}}}propstat"
+_ETAG_TAG = f"{{{DAV_NS}}}getetag"
+_SYNC_TOKEN_TAG = f"{{{DAV_NS}}}sync-token"
+_DATA_TAGS = (f"{{{CARDDAV_NS}}}address-data", f"{{{CALDAV_NS}}}calendar-data")
+
+# Per-process secret so caches never store anything derived from a password alone
+_AUTH_SECRET = secrets.token_bytes(32)
+
+
+class SyncTokenInvalid(Exception):
+    """The server rejected the sync-token or does not support sync-collection."""
+
+
+class DavResponse(NamedTuple):
+    """One <response> of a multistatus body, or the trailing <sync-token> (sync_token set, other fields None).
+
+    data holds the address-data (vCard) or calendar-data (iCalendar) property, if requested.
+    """
+    href: Optional[str] = None
+    status: Optional[str] = None
+    etag: Optional[str] = None
+    data: Optional[str] = None
+    sync_token: Optional[str] = None
+
+
+def credentials_digest(auth: tuple) -> str:
+    """Keyed digest of (username, password) used to check whether cached data may be served."""
+    return hashlib.sha256(_AUTH_SECRET + "\0".join(auth).encode("utf-8")).hexdigest()
+
+
+def iter_multistatus(source: BinaryIO) -> Iterator[DavResponse]:
+    """
+    Incrementally parse a DAV multistatus document from a binary stream.
+
+    Every <response> is yielded as soon as its end tag is read and then dropped
+    from the tree, so only one response is held in memory at a time.
+    """
+    root, depth = None, 0
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+
+        if elem.tag == _RESPONSE_TAG:
+            etag = data = sync_token = None
+            for propstat in elem.iter(_PROPSTAT_TAG):
+                etag = etag or propstat.findtext(f".//{_ETAG_TAG}")
+                sync_token = sync_token or propstat.findtext(f".//{_SYNC_TOKEN_TAG}")
+                for data_tag in _DATA_TAGS:
+                    data = data or propstat.findtext(f".//{data_tag}")
+            yield DavResponse(
+                href=elem.findtext(_HREF_TAG),
+                status=elem.findtext(_STATUS_TAG),
+                etag=etag,
+                data=data,
+                sync_token=sync_token,
+            )
+            root.clear()
+        elif elem.tag == _SYNC_TOKEN_TAG and depth == 1:
+            # Only the top-level token, not a <sync-token> property inside a response
+            yield DavResponse(sync_token=(elem.text or "").strip())
+
+
+def stream_request(method: str, url: str, auth: tuple, body: str, depth: str = "1") -> requests.Response:
+    response = session_pool.request(
+        method, url, auth=auth, data=body.encode('utf-8'), stream=True,
+        headers={"Content-Type": "application/xml; charset=utf-8", "Depth": depth}
+    )
+    if response.ok:
+        # Let urllib3 undo any Content-Encoding while the parser reads the raw stream
+        response.raw.decode_content = True
+    return response
+
+
+def is_member_href(href: Optional[str]) -> bool:
+    # The collection itself is listed with a trailing slash, its members are not
+    return bool(href) and not href.endswith('/')
+
+
+def xml_escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def list_etags(collection_url: str, auth: tuple) -> Dict[str, str]:
+    """
+    List all members of a collection as {href: etag} with a Depth:1 PROPFIND
+    that only asks for ETags (no vCard / iCalendar data).
+    """
+    propfind_body = '''<?xml version="1.0" encoding="UTF-8"?>
+<propfind xmlns="DAV:">
+    <prop>
+        <getetag/>
+    </prop>
+</propfind>'''
+
+    response = stream_request("PROPFIND", collection_url, auth, propfind_body)
+    with response:
+        response.raise_for_status()
+        etags = {}
+        for entry in iter_multistatus(response.raw):
+            if is_member_href(entry.href) and entry.etag:
+                etags[entry.href] = entry.etag
+    return etags
+
+
+def get_sync_token(collection_url: str, auth: tuple) -> Optional[str]:
+    """Current sync-token of a collection (Depth:0 PROPFIND), None if the server doesn't provide one."""
+    propfind_body = '''<?xml version="1.0" encoding="UTF-8"?>
+<propfind xmlns="DAV:">
+    <prop>
+        <sync-token/>
+    </prop>
+</propfind>'''
+
+    response = stream_request("PROPFIND", collection_url, auth, propfind_body, depth="0")
+    with response:
+        response.raise_for_status()
+        for entry in iter_multistatus(response.raw):
+            if entry.sync_token:
+                return entry.sync_token.strip()
+    return None
+
+
+def sync_collection(collection_url: str, auth: tuple, sync_token: Optional[str]) -> Tuple[str, Dict[str, str], Set[str]]:
+    """
+    Run a sync-collection REPORT (RFC 6578).
+
+    With sync_token=None the server lists every member. Returns the new sync-token,
+    {href: etag} of new or changed members and the set of removed hrefs.
+    Raises SyncTokenInvalid if the token expired or the report is not supported.
+    """
+    report_body = f'''<?xml version="1.0" encoding="UTF-8"?>
+<sync-collection xmlns="DAV:">
+    <sync-token>{xml_escape(sync_token or "")}</sync-token>
+    <sync-level>1</sync-level>
+    <prop>
+        <getetag/>
+    </prop>
+</sync-collection>'''
+
+    response = stream_request("REPORT", collection_url, auth, report_body)
+    with response:
+        if response.status_code in SYNC_UNSUPPORTED_STATUS:
+            raise SyncTokenInvalid(f"sync-collection rejected with status {response.status_code}")
+        response.raise_for_status()
+
+        new_token, changed, removed = None, {}, set()
+        for entry in iter_multistatus(response.raw):
+            if entry.href is None and entry.sync_token is not None:
+                new_token = entry.sync_token
+            elif not is_member_href(entry.href):
+                continue
+            elif " 404 " in f"{entry.status or ''} ":
+                # Removed members carry a 404 status directly on the response element
+                removed.add(entry.href)
+            elif entry.etag:
+                changed[entry.href] = entry.etag
+
+    if not new_token:
+        raise SyncTokenInvalid("sync-collection response contains no sync-token")
+    return new_token, changed, removed